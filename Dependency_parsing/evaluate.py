@@ -0,0 +1,68 @@
+import sys
+import time
+from optparse import OptionParser
+import numpy as np
+import torch
+from utils import Parser, read_conll, config
+from parser_transitions import minibatch_parse
+from model import ParserModel
+
+def parse(parser, model, dataset, batch_size, device=torch.device("cpu"), timing=None):
+    '''
+    dataset: vectorized examples
+    return: predicted heads and labels of every sentence, word 0 (ROOT) excluded
+    '''
+    confs = minibatch_parse(parser, model, dataset, batch_size, device, timing)
+    heads = []
+    labels = []
+    for ex, conf in zip(dataset, confs):
+        head = [-1] * len(ex['word'])
+        label = [-1] * len(ex['word'])
+        for (h, d, l) in conf.arcs:
+            head[d] = h
+            label[d] = -1 if l is None else l
+        heads.append(head[1:])
+        labels.append(label[1:])
+    return heads, labels
+
+def evaluate(parser, model, dataset, batch_size, device=torch.device("cpu")):
+    '''
+    UAS / LAS (None for an unlabeled parser) over dataset, punctuation skipped unless parser.with_punct
+    '''
+    timing = dict()
+    start = time.perf_counter()
+    heads, labels = parse(parser, model, dataset, batch_size, device, timing)
+    score_start = time.perf_counter()
+    pred_head = np.concatenate([np.asarray(h, dtype=np.int64) for h in heads])
+    pred_label = np.concatenate([np.asarray(l, dtype=np.int64) for l in labels])
+    gold_head = np.concatenate([np.asarray(ex['head'][1:], dtype=np.int64) for ex in dataset])
+    gold_label = np.concatenate([np.asarray(ex['label'][1:], dtype=np.int64) for ex in dataset])
+    mask = np.ones(len(gold_head), dtype=bool)
+    if not parser.with_punct:
+        gold_pos = np.concatenate([np.asarray(ex['pos'][1:], dtype=np.int64) for ex in dataset])
+        mask = ~np.isin(gold_pos, parser.punct_pos)
+    head_correct = (pred_head == gold_head) & mask
+    uas = head_correct.sum() / max(mask.sum(), 1)
+    las = None if parser.unlabeled else (head_correct & (pred_label == gold_label)).sum() / max(mask.sum(), 1)
+    end = time.perf_counter()
+    timing['score'] = end - score_start
+    print("%d sentences in %.2fs, %.1f sentences/s" % (len(dataset), end - start, len(dataset) / (end - start)), file=sys.stderr)
+    print(" ".join("%s %.2fs" % (phase, cost) for (phase, cost) in timing.items()), file=sys.stderr)
+    return uas, las
+
+def main():
+    option_parser = OptionParser(usage="%prog [options] train.conll dev.conll model.pth (written by ParserModel.save)")
+    option_parser.add_option("--batch_size", dest="batch_size", type="int", default=1024)
+    option_parser.add_option("--cuda", dest="cuda", action="store_true", default=False)
+    (options, args) = option_parser.parse_args()
+    if len(args) != 3:
+        option_parser.error("need train.conll, dev.conll and model.pth")
+    device = torch.device("cuda:0" if options.cuda else "cpu")
+    parser = Parser(read_conll(args[0], lowercase=config.lowercase))
+    dev_set = parser.vectorize(read_conll(args[1], lowercase=config.lowercase))
+    model = ParserModel.load(args[2], device)
+    uas, las = evaluate(parser, model, dev_set, options.batch_size, device)
+    print("UAS: %.2f" % (uas * 100) + ("" if las is None else ", LAS: %.2f" % (las * 100)))
+
+if __name__ == '__main__':
+    main()
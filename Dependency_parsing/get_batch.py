@@ -1,7 +1,8 @@
 import numpy as np
 
 def get_batch(data, batch_size, shuffle=True):
-    list_data = type(data) is list and (type(data[0]) is list or type(data[0]) is np.ndarray)
+    # isinstance: memory-mapped arrays (np.memmap) must take the fancy-indexing path too
+    list_data = type(data) is list and (type(data[0]) is list or isinstance(data[0], np.ndarray))
     data_size = len(data[0]) if list_data else len(data)
     indices = np.arange(data_size)
     if shuffle:
@@ -12,7 +13,7 @@ def get_batch(data, batch_size, shuffle=True):
             else _minibatch(data, minibatch_indices)
 
 def _minibatch(data, minibatch_idx):
-    return data[minibatch_idx] if type(data) is np.ndarray else [data[i] for i in minibatch_idx]
+    return data[minibatch_idx] if isinstance(data, np.ndarray) else [data[i] for i in minibatch_idx]
 
 def test_all_close(name, actual, expected):
     if actual.shape != expected.shape:
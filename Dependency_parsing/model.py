@@ -1,3 +1,5 @@
+import warnings
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -7,11 +9,12 @@ class ParserModel(nn.Module):
 
     def __init__(self, embeddings, args):
         super(ParserModel, self).__init__()
+        self.args = args
         self.n_features = args['n_features']
-        self.n_classes = ['n_classes']
-        self.dropout_prob = ['dropout_prob']
+        self.n_classes = args['n_classes']
+        self.dropout_prob = args['dropout_prob']
         self.embed_size = embeddings.shape[1]
-        self.hidden_size = ['hidden_size']
+        self.hidden_size = args['hidden_size']
         self.pretrained_embeddings = nn.Embedding(embeddings.shape[0], self.embed_size)
         self.pretrained_embeddings.weight = nn.Parameter(torch.tensor(embeddings))
 
@@ -21,16 +24,111 @@ class ParserModel(nn.Module):
         self.dropout = nn.Dropout(self.dropout_prob)
         self.hidden_to_logits = nn.Linear(self.hidden_size, self.n_classes)
         init.xavier_uniform_(self.hidden_to_logits.weight)
+        # filled by precompute; non-persistent buffers follow model.to(device) but stay out of state_dict
+        self.register_buffer('cache', None, persistent=False)
+        self.register_buffer('cache_slot', None, persistent=False)
+        self.register_buffer('cache_weight', None, persistent=False)
+        self.cache_version = None
 
     def embedding_lookup(self, t):
         x = self.pretrained_embeddings(t)
         x = x.view(-1, self.n_features * self.embed_size) 
         return x
 
+    def precompute(self, features, top_k):
+        '''
+        Chen & Manning (2014): cache E[w] * W_p for the top_k most frequent ids at every feature position p,
+        used by forward in eval mode until the weights change (train(), load_state_dict, an in-place update)
+        features: n_instances * n_features training feature ids
+        '''
+        features = torch.as_tensor(features, dtype=torch.long)
+        n_tokens = self.pretrained_embeddings.weight.shape[0]
+        weight = self.embed_to_hidden.weight.view(self.hidden_size, self.n_features, self.embed_size)
+        slot = torch.full((self.n_features, n_tokens), -1, dtype=torch.long)
+        cache = []
+        offset = 0
+        with torch.no_grad():
+            for p in range(self.n_features):
+                counts = torch.bincount(features[:, p], minlength=n_tokens)
+                top = counts.topk(min(top_k, n_tokens)).indices
+                top = top[counts[top] > 0]
+                slot[p, top] = torch.arange(offset, offset + len(top))
+                cache.append(self.pretrained_embeddings.weight[top] @ weight[:, p, :].t())
+                offset += len(top)
+        self.cache = torch.cat(cache, dim=0)
+        self.cache_slot = slot.to(self.cache.device)
+        # n_features * embed_size * hidden_size blocks for the uncached ids
+        self.cache_weight = weight.detach().permute(1, 2, 0).contiguous()
+        self.cache_version = self.weight_version()
+
+    def weight_version(self):
+        '''
+        changes whenever the weights behind the cache are replaced or updated in place (e.g. an optimizer step)
+        '''
+        return tuple((id(w), w._version) for w in [self.pretrained_embeddings.weight, self.embed_to_hidden.weight])
+
+    def clear_cache(self):
+        self.cache = None
+        self.cache_slot = None
+        self.cache_weight = None
+        self.cache_version = None
+
+    def train(self, mode=True):
+        # the weights are about to be trained, the cache would go stale
+        if mode:
+            self.clear_cache()
+        return super(ParserModel, self).train(mode)
+
+    def load_state_dict(self, state_dict, strict=True):
+        self.clear_cache()
+        return super(ParserModel, self).load_state_dict(state_dict, strict)
+
+    def cached_hidden(self, t):
+        '''
+        embed_to_hidden(embedding_lookup(t)) as a sum of cached partial products,
+        ids outside the cache go through their own column block of embed_to_hidden
+        '''
+        position = torch.arange(self.n_features, device=t.device)
+        slot = self.cache_slot[position, t]
+        hit = slot >= 0
+        h = F.embedding_bag(slot.clamp(min=0), self.cache, per_sample_weights=hit.to(self.cache.dtype), mode='sum')
+        h = h + self.embed_to_hidden.bias
+        pos, rows = (~hit).t().nonzero(as_tuple=True)
+        if len(rows) > 0:
+            counts = torch.bincount(pos, minlength=self.n_features).tolist()
+            x = torch.split(self.pretrained_embeddings(t[rows, pos]), counts)
+            partial = [x[p] @ self.cache_weight[p] for p in range(self.n_features) if counts[p] > 0]
+            h = h.index_add(0, rows, torch.cat(partial, dim=0))
+        return h
+
     def forward(self, t):
-        t = self.embedding_lookup(t)
-        t = self.embed_to_hidden(t)
+        if self.cache is not None and self.cache_version != self.weight_version():
+            warnings.warn("ParserModel weights changed since precompute, dropping the cache")
+            self.clear_cache()
+        if self.cache is not None and not self.training:
+            t = self.cached_hidden(t)
+        else:
+            t = self.embedding_lookup(t)
+            t = self.embed_to_hidden(t)
         t = F.relu(t)
         t = self.dropout(t)
         logits = self.hidden_to_logits(t)
         return logits
+
+    def save(self, model_path):
+        '''
+        only tensors and plain types, so the file loads with torch.load(weights_only=True)
+        '''
+        params = {
+            'args': self.args,
+            'embedding_shape': list(self.pretrained_embeddings.weight.shape),
+            'state_dict': self.state_dict()
+        }
+        torch.save(params, model_path)
+
+    @staticmethod
+    def load(model_path, device=torch.device("cpu")):
+        params = torch.load(model_path, map_location=device)
+        model = ParserModel(np.zeros(params['embedding_shape'], dtype=np.float32), params['args'])
+        model.load_state_dict(params['state_dict'])
+        return model.to(device)
@@ -0,0 +1,48 @@
+import time
+import torch
+from utils import Configuration
+
+def minibatch_parse(parser, model, dataset, batch_size, device=torch.device("cpu"), timing=None):
+    '''
+    dataset: vectorized examples, ex['word'][0] is ROOT
+    batch_size configurations advance in lockstep: one feature LongTensor and one model forward per step,
+    finished sentences leave the batch and waiting ones take their place
+    timing: optional dict, seconds spent in 'featurize' / 'forward' / 'transition' are added to it
+    return: the final Configuration of every sentence, in input order
+    '''
+    confs = [Configuration(len(ex['word'])) for ex in dataset]
+    tran_kind = torch.tensor(parser.tran_kind, dtype=torch.long)
+    pending = list(range(len(dataset)))[::-1]
+    active = []
+    if timing is None:
+        timing = dict()
+    for phase in ['featurize', 'forward', 'transition']:
+        timing.setdefault(phase, 0.0)
+    flag = model.training
+    model.eval()
+    with torch.no_grad():
+        while len(active) > 0 or len(pending) > 0:
+            while len(active) < batch_size and len(pending) > 0:
+                i = pending.pop()
+                if not confs[i].is_terminal():
+                    active.append(i)
+            if len(active) == 0:
+                break
+            start = time.perf_counter()
+            features = torch.tensor([parser.extract_features(confs[i], dataset[i]) for i in active], dtype=torch.long)
+            legal = torch.tensor([parser.legal_transitions(confs[i]) for i in active], dtype=torch.bool)
+            featurize = time.perf_counter()
+            logits = model(features.to(device)).cpu()
+            forward = time.perf_counter()
+            logits.masked_fill_(~legal[:, tran_kind], float('-inf'))
+            predict = logits.argmax(dim=-1).tolist()
+            for i, t in zip(active, predict):
+                parser.apply_transition(confs[i], t)
+            active = [i for i in active if not confs[i].is_terminal()]
+            end = time.perf_counter()
+            timing['featurize'] += featurize - start
+            timing['forward'] += forward - featurize
+            timing['transition'] += end - forward
+    if flag:
+        model.train()
+    return confs
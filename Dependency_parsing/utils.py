@@ -1,12 +1,127 @@
+import os
+import sys
+import time
+import hashlib
+import multiprocessing
+import numpy as np
+from tqdm import tqdm
+from collections import Counter
+
+P_PREFIX = '<p>:'
+L_PREFIX = '<l>:'
+UNK = '<UNK>'
+NULL = '<NULL>'
+ROOT = '<ROOT>'
+
+class Config(object):
+    language = 'english'
+    with_punct = True
+    unlabeled = True
+    lowercase = True
+    use_pos = True
+    use_dep = True
+    use_dep = use_dep and (not unlabeled)
+
+config = Config()
+
+PUNCTS = ["''", ",", ".", ":", "``", "-LRB-", "-RRB-"]
+
+def read_conll(in_file, lowercase=False, max_example=None):
+    examples = []
+    with open(in_file) as f:
+        word, pos, head, label = [], [], [], []
+        for line in f.readlines():
+            sp = line.strip().split('\t')
+            if len(sp) == 10:
+                if '-' not in sp[0]:
+                    word.append(sp[1].lower() if lowercase else sp[1])
+                    pos.append(sp[4])
+                    head.append(int(sp[6]))
+                    label.append(sp[7])
+            elif len(word) > 0:
+                examples.append({'word': word, 'pos': pos, 'head': head, 'label': label})
+                word, pos, head, label = [], [], [], []
+                if (max_example is not None) and (len(examples) == max_example):
+                    break
+        if len(word) > 0:
+            examples.append({'word': word, 'pos': pos, 'head': head, 'label': label})
+    return examples
+
+def build_dict(keys, n_max=None, offset=0):
+    '''
+    keys: iterable of keys, or a Counter of them
+    '''
+    count = Counter(keys)
+    ls = count.most_common() if n_max is None else count.most_common(n_max)
+    return {w[0]: index + offset for (index, w) in enumerate(ls)}
+
+class Configuration(object):
+    '''
+    stack / buffer / arcs of one sentence (word 0 is ROOT)
+    children of every head are indexed as arcs are added, nearest first, so the
+    outermost left / right children are always at the end of lc[k] / rc[k]
+    '''
+    def __init__(self, n_words):
+        self.n_words = n_words
+        self.stack = [0]
+        self.next = 1
+        self.arcs = []
+        self.lc = [[] for _ in range(n_words)]
+        self.rc = [[] for _ in range(n_words)]
+
+    def buffer(self, k=None):
+        end = self.n_words if k is None else min(self.n_words, self.next + k)
+        return list(range(self.next, end))
+
+    def buffer_size(self):
+        return self.n_words - self.next
+
+    def shift(self):
+        self.stack.append(self.next)
+        self.next += 1
+
+    def left_arc(self, label=None):
+        dep = self.stack.pop(-2)
+        self.add_arc(self.stack[-1], dep, label)
+
+    def right_arc(self, label=None):
+        dep = self.stack.pop()
+        self.add_arc(self.stack[-1], dep, label)
+
+    def add_arc(self, head, dep, label=None):
+        self.arcs.append((head, dep, label))
+        if dep < head:
+            # arc-standard attaches left children right to left, so this is an append
+            children = self.lc[head]
+            i = len(children)
+            while i > 0 and children[i - 1] < dep:
+                i -= 1
+        else:
+            children = self.rc[head]
+            i = len(children)
+            while i > 0 and children[i - 1] > dep:
+                i -= 1
+        children.insert(i, dep)
+
+    def is_terminal(self):
+        return self.next == self.n_words and len(self.stack) == 1
 
 class Parser(object):
 
     def __init__(self, dataset):
-        root_labels = list([l for ex in dataset
-                           for (h, l) in zip(ex['head'], ex['label']) if h == 0])
-        deprel = [self.root_label] + list(set([w for ex in dataset
-                                               for w in ex['label']
-                                               if w != self.root_label]))
+        # one pass over the treebank instead of one list per vocabulary
+        root_labels = Counter()
+        label_count = Counter()
+        pos_count = Counter()
+        word_count = Counter()
+        for ex in dataset:
+            root_labels.update(l for (h, l) in zip(ex['head'], ex['label']) if h == 0)
+            label_count.update(ex['label'])
+            pos_count.update(ex['pos'])
+            word_count.update(ex['word'])
+        self.root_label = root_labels.most_common()[0][0]
+        # sorted, not set order: label and transition ids must not depend on PYTHONHASHSEED
+        deprel = [self.root_label] + sorted(w for w in label_count if w != self.root_label)
         tok2id = {L_PREFIX + l: i for (i, l) in enumerate(deprel)}
         tok2id[L_PREFIX + NULL] = self.L_NULL = len(tok2id)
 
@@ -26,15 +141,16 @@ class Parser(object):
         self.n_trans = len(trans)
         self.tran2id = {t: i for (i, t) in enumerate(trans)}
         self.id2tran = {i: t for (i, t) in enumerate(trans)}
+        # 0: left-arc, 1: right-arc, 2: shift, for every transition id
+        self.tran_kind = [0] * self.n_deprel + [1] * self.n_deprel + [2]
 
-        tok2id.update(build_dict([P_PREFIX + w for ex in dataset for w in ex['pos']],
+        tok2id.update(build_dict(Counter({P_PREFIX + w: c for (w, c) in pos_count.items()}),
                                   offset=len(tok2id)))
         tok2id[P_PREFIX + UNK] = self.P_UNK = len(tok2id)
         tok2id[P_PREFIX + NULL] = self.P_NULL = len(tok2id)
         tok2id[P_PREFIX + ROOT] = self.P_ROOT = len(tok2id)
 
-        tok2id.update(build_dict([w for ex in dataset for w in ex['word']],
-                                  offset=len(tok2id)))
+        tok2id.update(build_dict(word_count, offset=len(tok2id)))
         tok2id[UNK] = self.UNK = len(tok2id)
         tok2id[NULL] = self.NULL = len(tok2id)
         tok2id[ROOT] = self.ROOT = len(tok2id)
@@ -44,56 +160,121 @@ class Parser(object):
 
         self.n_features = 18 + (18 if config.use_pos else 0) + (12 if config.use_dep else 0)
         self.n_tokens = len(tok2id)
+        self.punct_pos = [tok2id[P_PREFIX + w] for w in PUNCTS if P_PREFIX + w in tok2id]
+
+    def vectorize(self, examples):
+        vec_examples = []
+        for ex in examples:
+            word = [self.ROOT] + [self.tok2id.get(w, self.UNK) for w in ex['word']]
+            pos = [self.P_ROOT] + [self.tok2id.get(P_PREFIX + w, self.P_UNK) for w in ex['pos']]
+            head = [-1] + ex['head']
+            label = [-1] + [self.tok2id.get(L_PREFIX + w, -1) for w in ex['label']]
+            vec_examples.append({'word': word, 'pos': pos, 'head': head, 'label': label})
+        return vec_examples
+
+    def get_oracle(self, conf, ex, pending):
+        '''
+        static arc-standard oracle on the gold tree of ex
+        pending[k]: gold dependents of k not attached yet
+        return: transition id, None when the tree is non-projective
+        '''
+        shift = self.n_trans - 1 if conf.buffer_size() > 0 else None
+        if len(conf.stack) < 2:
+            return shift
+        i0 = conf.stack[-1]
+        i1 = conf.stack[-2]
+        if i1 > 0 and ex['head'][i1] == i0:
+            return 0 if self.unlabeled else ex['label'][i1]
+        if ex['head'][i0] == i1 and pending[i0] == 0:
+            return 1 if self.unlabeled else ex['label'][i0] + self.n_deprel
+        return shift
+
+    def create_instances(self, examples):
+        '''
+        one oracle pass over vectorized examples
+        return: features (n_instances * n_features) and gold transitions (n_instances), both int32
+        '''
+        features = []
+        transitions = []
+        for ex in examples:
+            n_words = len(ex['word'])
+            conf = Configuration(n_words)
+            pending = [0] * n_words
+            for h in ex['head'][1:]:
+                pending[h] += 1
+            ex_features = []
+            ex_transitions = []
+            while not conf.is_terminal():
+                t = self.get_oracle(conf, ex, pending)
+                if t is None:
+                    break
+                ex_features.append(self.extract_features(conf, ex))
+                ex_transitions.append(t)
+                self.apply_transition(conf, t)
+                if t != self.n_trans - 1:
+                    pending[conf.arcs[-1][0]] -= 1
+            if conf.is_terminal():
+                features += ex_features
+                transitions += ex_transitions
+        return (np.array(features, dtype=np.int32).reshape(-1, self.n_features),
+                np.array(transitions, dtype=np.int32))
 
-    def extract_features(self, stack, buf, arcs, ex):
-        if stack[0] == "ROOT":
-            stack[0] = 0
+    def fingerprint(self, examples):
+        '''
+        examples: the vectorized examples the instances are built from
+        changes whenever the vocabulary (every token id), the feature template or the examples do
+        '''
+        h = hashlib.sha1()
+        h.update(repr(sorted(self.tok2id.items())).encode("utf-8"))
+        for ex in examples:
+            h.update(repr((ex['word'], ex['pos'], ex['head'], ex['label'])).encode("utf-8"))
+        return "%d_%d_%d%d%d_%s" % (self.n_tokens, self.n_features, self.unlabeled, self.use_pos, self.use_dep, h.hexdigest()[:16])
 
-        def get_lc(k):
-            return sorted([arc[1] for arc in arcs if arc[0] == k and arc[1] < k])
+    def legal_transitions(self, conf):
+        '''
+        left-arc / right-arc / shift, indexed by tran_kind
+        '''
+        return [len(conf.stack) > 2, len(conf.stack) > 1, conf.buffer_size() > 0]
 
-        def get_rc(k):
-            return sorted([arc[1] for arc in arcs if arc[0] == k and arc[1] > k],
-                          reverse=True)
+    def apply_transition(self, conf, t):
+        if t == self.n_trans - 1:
+            conf.shift()
+        elif t < self.n_deprel:
+            conf.left_arc(None if self.unlabeled else t)
+        else:
+            conf.right_arc(None if self.unlabeled else t - self.n_deprel)
+
+    def extract_features(self, conf, ex):
+        stack = conf.stack
+        buf = conf.buffer(3)
+
+        def get_children(k):
+            lc = conf.lc[k]
+            rc = conf.rc[k]
+            lc0 = lc[-1] if len(lc) > 0 else None
+            rc0 = rc[-1] if len(rc) > 0 else None
+            lc1 = lc[-2] if len(lc) > 1 else None
+            rc1 = rc[-2] if len(rc) > 1 else None
+            llc0 = conf.lc[lc0][-1] if lc0 is not None and len(conf.lc[lc0]) > 0 else None
+            rrc0 = conf.rc[rc0][-1] if rc0 is not None and len(conf.rc[rc0]) > 0 else None
+            return [lc0, rc0, lc1, rc1, llc0, rrc0]
 
         p_features = []
         l_features = []
         features = [self.NULL] * (3 - len(stack)) + [ex['word'][x] for x in stack[-3:]]
-        features += [ex['word'][x] for x in buf[:3]] + [self.NULL] * (3 - len(buf))
+        features += [ex['word'][x] for x in buf] + [self.NULL] * (3 - len(buf))
         if self.use_pos:
             p_features = [self.P_NULL] * (3 - len(stack)) + [ex['pos'][x] for x in stack[-3:]]
-            p_features += [ex['pos'][x] for x in buf[:3]] + [self.P_NULL] * (3 - len(buf))
+            p_features += [ex['pos'][x] for x in buf] + [self.P_NULL] * (3 - len(buf))
 
         for i in range(2):
             if i < len(stack):
-                k = stack[-i-1]
-                lc = get_lc(k)
-                rc = get_rc(k)
-                llc = get_lc(lc[0]) if len(lc) > 0 else []
-                rrc = get_rc(rc[0]) if len(rc) > 0 else []
-
-                features.append(ex['word'][lc[0]] if len(lc) > 0 else self.NULL)
-                features.append(ex['word'][rc[0]] if len(rc) > 0 else self.NULL)
-                features.append(ex['word'][lc[1]] if len(lc) > 1 else self.NULL)
-                features.append(ex['word'][rc[1]] if len(rc) > 1 else self.NULL)
-                features.append(ex['word'][llc[0]] if len(llc) > 0 else self.NULL)
-                features.append(ex['word'][rrc[0]] if len(rrc) > 0 else self.NULL)
-
+                children = get_children(stack[-i-1])
+                features += [ex['word'][c] if c is not None else self.NULL for c in children]
                 if self.use_pos:
-                    p_features.append(ex['pos'][lc[0]] if len(lc) > 0 else self.P_NULL)
-                    p_features.append(ex['pos'][rc[0]] if len(rc) > 0 else self.P_NULL)
-                    p_features.append(ex['pos'][lc[1]] if len(lc) > 1 else self.P_NULL)
-                    p_features.append(ex['pos'][rc[1]] if len(rc) > 1 else self.P_NULL)
-                    p_features.append(ex['pos'][llc[0]] if len(llc) > 0 else self.P_NULL)
-                    p_features.append(ex['pos'][rrc[0]] if len(rrc) > 0 else self.P_NULL)
-
+                    p_features += [ex['pos'][c] if c is not None else self.P_NULL for c in children]
                 if self.use_dep:
-                    l_features.append(ex['label'][lc[0]] if len(lc) > 0 else self.L_NULL)
-                    l_features.append(ex['label'][rc[0]] if len(rc) > 0 else self.L_NULL)
-                    l_features.append(ex['label'][lc[1]] if len(lc) > 1 else self.L_NULL)
-                    l_features.append(ex['label'][rc[1]] if len(rc) > 1 else self.L_NULL)
-                    l_features.append(ex['label'][llc[0]] if len(llc) > 0 else self.L_NULL)
-                    l_features.append(ex['label'][rrc[0]] if len(rrc) > 0 else self.L_NULL)
+                    l_features += [ex['label'][c] if c is not None else self.L_NULL for c in children]
             else:
                 features += [self.NULL] * 6
                 if self.use_pos:
@@ -103,4 +284,54 @@ class Parser(object):
 
         features += p_features + l_features
         assert len(features) == self.n_features
-        return features
\ No newline at end of file
+        return features
+
+_worker_parser = None
+
+def _init_worker(parser):
+    global _worker_parser
+    _worker_parser = parser
+
+def _create_instances(examples):
+    return _worker_parser.create_instances(examples)
+
+def create_instances_parallel(parser, examples, num_workers, chunk_size=1000):
+    '''
+    Parser.create_instances over chunks of examples in a process pool, results concatenated in order
+    every worker receives the parser once at start-up (shared copy-on-write under fork), not once per chunk
+    '''
+    chunks = [examples[i:i + chunk_size] for i in range(0, len(examples), chunk_size)]
+    features = []
+    transitions = []
+    n_instances = 0
+    start = time.time()
+    with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(parser,)) as pool:
+        with tqdm(total=len(examples), desc="featurize", file=sys.stderr) as pbar:
+            for chunk, (chunk_features, chunk_transitions) in zip(chunks, pool.imap(_create_instances, chunks)):
+                features.append(chunk_features)
+                transitions.append(chunk_transitions)
+                n_instances += len(chunk_transitions)
+                pbar.set_postfix({"instances/s": "%.0f" % (n_instances / (time.time() - start))})
+                pbar.update(len(chunk))
+    cost = time.time() - start
+    print("featurized %d sentences into %d instances in %.1fs (%.0f sentences/s) with %d workers"
+          % (len(examples), n_instances, cost, len(examples) / cost, num_workers), file=sys.stderr)
+    return np.concatenate(features, axis=0), np.concatenate(transitions, axis=0)
+
+def load_instances(parser, examples, cache_prefix, num_workers=1):
+    '''
+    features / transitions of examples, built once by the oracle pass and saved as
+    <cache_prefix>.<fingerprint>.{features,transitions}.npy, then memory-mapped on every later call
+    '''
+    prefix = "%s.%s" % (cache_prefix, parser.fingerprint(examples))
+    features_path = prefix + ".features.npy"
+    transitions_path = prefix + ".transitions.npy"
+    if not (os.path.exists(features_path) and os.path.exists(transitions_path)):
+        print("featurize %d sentences to [%s]" % (len(examples), prefix), file=sys.stderr)
+        if num_workers > 1:
+            features, transitions = create_instances_parallel(parser, examples, num_workers)
+        else:
+            features, transitions = parser.create_instances(examples)
+        np.save(features_path, features)
+        np.save(transitions_path, transitions)
+    return np.load(features_path, mmap_mode='r'), np.load(transitions_path, mmap_mode='r')
@@ -0,0 +1,14 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_common"))
+import shuhe_config as config
+from nmt_model import NMT
+from data import Data
+# the trainer writes its checkpoints through CheckpointWriter
+from evaluation import CheckpointWriter, watch
+
+def main():
+    watch(config, NMT.load, lambda: Data(config.dev_path_src, config.dev_path_tar))
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,28 @@
+import pickle
+import optparse
 import torch
 import torch.nn as nn
 from torch.nn.utils.rnn import pad_packed_sequence, pack_padded_sequence
 from embeddings import Embeddings
 import math
+from collections import Counter
 import shuhe_config as config
+from vocab import Text
 
 
+def backtrack(tokens, backpointers, level, row):
+    '''
+    tokens, backpointers: lists of beam_search, level: length of the hypothesis, row: its row at that level
+    return: the words of the hypothesis, following the backpointers from its last word to <start>
+    '''
+    words = []
+    while (level > 0):
+        words.append(tokens[level][row])
+        row = backpointers[level][row]
+        level -= 1
+    words.reverse()
+    return words
+
 class NMT(nn.Module):
 
     def __init__(self, text, options, device):
@@ -18,6 +35,8 @@ class NMT(nn.Module):
         self.device = device
         self.encoder_layer = options.encoder_layer 
         self.decoder_layers = options.decoder_layers
+        # steps / early stops / length limits of beam_search, reported by test.py
+        self.search_stats = Counter()
 
         self.encoder = nn.LSTM(input_size=options.embed_size, hidden_size=options.hidden_size, num_layers=options.encoder_layer, bias=True, dropout=options.dropout_rate, bidirectional=False)
         self.decoder = nn.LSTM(input_size=options.embed_size+options.hidden_size, hidden_size=options.hidden_size, num_layers=options.decoder_layers, bias=True, dropout=options.dropout_rate, bidirectional=False)
@@ -27,13 +46,25 @@ class NMT(nn.Module):
         self.ht2final = nn.Linear(in_features=self.hidden_size, out_features=len(self.text.tar), bias=False)
     
     def forward(self, source, target):
+        decode_out, target_tensor = self.hidden(source, target)
+        return self.score(decode_out, target_tensor)
+
+    def hidden(self, source, target):
+        '''
+        return: decoder output (tar_len * batch_size * hidden_size) and the padded target tensor, everything before ht2final
+        '''
         len_ = []
         for sen in source:
             len_.append(len(sen))
-        source_tensor = self.text.src.word2tensor(source, self.device).cuda()
-        target_tensor = self.text.tar.word2tensor(target, self.device).cuda()
+        source_tensor = self.text.src.word2tensor(source, self.device)
+        target_tensor = self.text.tar.word2tensor(target, self.device)
         encode_h, encode_len, encode_hn_cn = self.encode(source_tensor, len_)
-        decode_out = self.decode(source_tensor, encode_hn_cn, encode_h, encode_len, target_tensor)
+        return self.decode(source_tensor, encode_hn_cn, encode_h, encode_len, target_tensor), target_tensor
+
+    def score(self, decode_out, target_tensor):
+        '''
+        return: batch_size, per-sentence log-likelihood from the output of hidden: ht2final, log_softmax and gather
+        '''
         P = nn.functional.log_softmax(self.ht2final(decode_out), dim=-1)  # sen_len * batch * vocab_size
         tar_mask = (target_tensor != self.text.tar['<pad>']).float()
         tar_log_pro = torch.gather(P, index=target_tensor[1:].unsqueeze(-1), dim=-1).squeeze(-1) * tar_mask[1:]
@@ -51,14 +82,14 @@ class NMT(nn.Module):
     def decode(self, source_tensor, h0_c0, encode_h, encode_len, target_tensor):
         y = self.embeddings.tar(target_tensor)
         ht_ct = h0_c0
-        ht = torch.zeros(encode_h.shape[0], self.hidden_size, device=self.device).cuda()
+        ht = torch.zeros(encode_h.shape[0], self.hidden_size, device=self.device)
         output = []
         for y_t in y:
             now_ht_ct, now_ht = self.step(source_tensor, encode_h, encode_len, torch.cat((y_t, ht), dim=1).view(1, y.shape[1], -1), ht_ct)
             output.append(now_ht)
             ht_ct = now_ht_ct
             ht = now_ht
-        return torch.stack(output).to(self.device).cuda() # sen_len * batch * hidden_size
+        return torch.stack(output).to(self.device) # sen_len * batch * hidden_size
     #@profile
     def step(self, source, encode_h, encode_len, pre_yt, pre_ht_ct):
         '''
@@ -97,7 +128,7 @@ class NMT(nn.Module):
         batch_ct = None
         return ht_ct, ht
         '''
-        encode_len = encode_len.cuda()
+        encode_len = encode_len.to(self.device)
         yt, ht_ct = self.decoder(pre_yt, pre_ht_ct)
         yt = torch.squeeze(yt, dim=0) # batch * hidden_size
         batch_size = yt.shape[0]
@@ -107,7 +138,7 @@ class NMT(nn.Module):
         # encode_h : batch * sen_len * hidden_size
         pre_align = torch.bmm(yt.view(batch_size, 1, self.hidden_size), torch.transpose(encode_h, 1, 2)).squeeze(dim=1) # batch * sen_len
         src_mask = (source == self.text.src['<pad>']).long().t()
-        src_mask.cuda()
+        src_mask = src_mask.to(self.device)
         #shuhe = torch.full((batch_size, encode_h.shape[1]), float("-inf"), dtype=torch.float, device=self.device)
         '''
         shuhe = torch.zeros((batch_size, encode_h.shape[1]), dtype=float)
@@ -212,31 +243,40 @@ class NMT(nn.Module):
         encode_len = []
         for i in range(test_batch_size):
             encode_len.append(len(src[i]))
+        # no hypothesis of a sentence grows past a * source length + b
+        limits = [min(max_tar_length, int(config.max_len_a*length+config.max_len_b)) for length in encode_len]
+        self.search_stats['sentences'] += test_batch_size
+        self.search_stats['max_steps'] += test_batch_size*max_tar_length
         src_tensor = self.text.src.word2tensor(src, self.device)
         now_source = src_tensor
         all_h, encode_len, (h_n, c_n) = self.encode(src_tensor, encode_len)
         sen_len = all_h.shape[1]
         now_all_h = all_h
         encode_len = torch.tensor(encode_len, dtype=torch.long, device=self.device)
-        encode_len = encode_len.cuda()
+        encode_len = encode_len.to(self.device)
         now_encode_len = encode_len
         now_h = h_n
         now_c = c_n
+        # hypotheses are stored as word and backpointer (row one level up) per level and row, no prefix is ever copied
+        tokens = torch.full((max(limits)+1, test_batch_size*search_size), self.text.tar['<pad>'], dtype=torch.long)
+        backpointers = torch.zeros((max(limits)+1, test_batch_size*search_size), dtype=torch.long)
+        tokens[0, :test_batch_size] = self.text.tar['<start>']
+        # finished hypotheses: (normalized score, level, row, last word or None)
         predict = [[] for _ in range(test_batch_size)]
-        now_predict = [[0] for _ in range(test_batch_size)]
-        now_batch_word_tensor = torch.cat((self.embeddings.tar(self.text.tar.word2tensor(now_predict, self.device)).squeeze(dim=0), torch.zeros(test_batch_size, self.hidden_size, dtype=torch.float, device=self.device).cuda()), dim=-1).reshape(1, test_batch_size, -1)
+        now_batch_word_tensor = torch.cat((self.embeddings.tar(tokens[0, :test_batch_size].to(self.device)), torch.zeros(test_batch_size, self.hidden_size, dtype=torch.float, device=self.device)), dim=-1).reshape(1, test_batch_size, -1)
         now_predict_length = 0
         now_score = torch.zeros(test_batch_size, dtype=torch.float, device=self.device).reshape(test_batch_size, 1)
         batch_index = [(i, 1) for i in range(test_batch_size)]
-        while (now_predict_length < max_tar_length):
+        while (now_predict_length < max(limits)):
             now_predict_length += 1
+            self.search_stats['steps'] += len(batch_index)
             next_ht_ct, next_ht = self.step(now_source, now_all_h, now_encode_len, now_batch_word_tensor.contiguous(), (now_h, now_c))
-            P = (nn.functional.softmax(self.ht2final(next_ht), dim=-1)+now_score).reshape(next_ht.shape[0]*len(self.text.tar))
+            P = (nn.functional.log_softmax(self.ht2final(next_ht), dim=-1)+now_score).reshape(next_ht.shape[0]*len(self.text.tar))
             next_batch_index = []
             now_start = 0
-            next_predict = []
             next_score = []
             next_words = []
+            next_parents = []
             next_all_h = None
             next_encode_len = []
             next_h = None
@@ -256,9 +296,9 @@ class NMT(nn.Module):
                     next_word_id = topk_index[i].item() % len(self.text.tar)
                     sent_id = topk_index[i].item() // len(self.text.tar)
                     if (next_word_id == self.text.tar['<end>']):
-                        if (len(now_predict[now_start+sent_id][1:]) == 0):
+                        if (now_predict_length == 1):
                             continue
-                        predict[key].append(((score[i].item()-now_score[now_start][0].item())/math.pow(len(now_predict[now_start+sent_id][1:]), config.alpha), now_predict[now_start+sent_id][1:].copy()))
+                        predict[key].append((score[i].item()/math.pow(now_predict_length-1, config.alpha), now_predict_length-1, now_start+sent_id, None))
                         if (len(predict[key]) == search_size):
                             now_flag = True
                             break
@@ -266,23 +306,29 @@ class NMT(nn.Module):
                 now_start += value
                 if (now_flag):
                     continue
+                if (len(predict[key]) > 0 and now_predict_length < limits[key]):
+                    # a live score only drops, and at most limits[key] words divide it, so nothing live can beat the best finished one
+                    live = [score[i].item() for i in range(search_size) if (topk_index[i].item() % len(self.text.tar) != self.text.tar['<end>'])]
+                    if (len(live) == 0 or max(record[0] for record in predict[key]) >= max(live)/math.pow(limits[key], config.alpha)):
+                        self.search_stats['early_stop'] += 1
+                        continue
+                if (now_predict_length == limits[key] and limits[key] < max_tar_length):
+                    self.search_stats['length_limit'] += 1
                 for i in range(search_size):
                     next_word_id = topk_index[i].item() % len(self.text.tar)
                     sent_id = topk_index[i].item() // len(self.text.tar)
                     if (next_word_id == self.text.tar['<end>']):
                         continue
-                    if (now_predict_length == max_tar_length):
-                        predict[key].append((score[i].item()/math.pow(len(now_predict[now_start-value+sent_id][1:])+1, config.alpha), now_predict[now_start-value+sent_id][1:].copy()))
-                        predict[key][-1][1].append(next_word_id)
+                    if (now_predict_length == limits[key]):
+                        predict[key].append((score[i].item()/math.pow(now_predict_length, config.alpha), now_predict_length-1, now_start-value+sent_id, next_word_id))
                         if (len(predict[key]) == search_size):
                             now_flag = True
                             break
                         continue
                     next_value += 1
-                    next_predict.append(now_predict[now_start-value+sent_id].copy())
-                    next_predict[-1].append(next_word_id)
                     next_score.append(score[i].item())
-                    next_words.append([next_word_id])
+                    next_words.append(next_word_id)
+                    next_parents.append(now_start-value+sent_id)
                     if (next_all_h is None):
                         next_all_h = all_h[key].reshape(1, -1, self.hidden_size)
                         next_encode_len.append(encode_len[key].item())
@@ -297,7 +343,7 @@ class NMT(nn.Module):
                         next_c = torch.cat((next_c, now_c[now_start-value+sent_id].reshape(1, self.encoder_layer, -1)), dim=0)
                         now_ht = torch.cat((now_ht, next_ht[now_start-value+sent_id].reshape(1, -1)), dim=0)
                         next_source = torch.cat((next_source, now_source[key].reshape(1, -1)), dim=0)
-                if (now_flag):
+                if (now_flag or next_value == 0):
                     continue
                 flag = True
                 next_batch_index.append((key, next_value))
@@ -309,28 +355,45 @@ class NMT(nn.Module):
             now_encode_len = torch.tensor(next_encode_len, dtype=torch.long, device=self.device)
             now_h = next_h.permute(1, 0, 2).contiguous()
             now_c = next_c.permute(1, 0, 2).contiguous()
-            now_predict = next_predict
+            tokens[now_predict_length, :len(next_words)] = torch.tensor(next_words, dtype=torch.long)
+            backpointers[now_predict_length, :len(next_words)] = torch.tensor(next_parents, dtype=torch.long)
             batch_index = next_batch_index
-            now_batch_word_tensor = torch.cat((self.embeddings.tar(self.text.tar.word2tensor(next_words, self.device)).squeeze(dim=0), now_ht), dim=-1).reshape(1, len(next_encode_len), -1)
+            now_batch_word_tensor = torch.cat((self.embeddings.tar(tokens[now_predict_length, :len(next_words)].to(self.device)), now_ht), dim=-1).reshape(1, len(next_encode_len), -1)
+        # the only conversion to lists, then every sentence backtracks its best hypothesis
+        tokens = tokens.tolist()
+        backpointers = backpointers.tolist()
         output = []
         for sub in predict:
-            sub = sorted(sub, key=lambda sc: sc[0], reverse=True)
-            output.append(sub[0][1])
+            if (len(sub) == 0):
+                # only <end> at the first step, which is never taken as an empty translation
+                output.append([])
+                continue
+            _, level, row, last_word = max(sub, key=lambda record: record[0])
+            words = backtrack(tokens, backpointers, level, row)
+            if (last_word is not None):
+                words.append(last_word)
+            output.append(words)
         return output
 
     @staticmethod
     def load(model_path):
-        params = torch.load(model_path, map_location=lambda storage, loc: storage)
-        model = NMT(params['text'], params['options'], params['device'])
+        try:
+            params = torch.load(model_path, map_location=lambda storage, loc: storage)
+        except pickle.UnpicklingError:
+            # checkpoints written before the vocabulary was saved as word lists pickle the Text object, only load trusted files
+            params = torch.load(model_path, map_location=lambda storage, loc: storage, weights_only=False)
+        text = Text.from_words(params['vocab']) if ('vocab' in params) else params['text']
+        options = params['options']
+        model = NMT(text, optparse.Values(options) if (isinstance(options, dict)) else options, torch.device(params['device']))
         model.load_state_dict(params['state_dict'])
         return model
     
     def save(self, model_path):
         print(f"save model to path [{model_path}]")
         params = {
-            'text': self.text,
-            'options': self.options,
-            'device': self.device,
+            'vocab': self.text.to_words(),
+            'options': vars(self.options) if (isinstance(self.options, optparse.Values)) else self.options,
+            'device': str(self.device),
             'state_dict': self.state_dict()
         }
         torch.save(params, model_path)
\ No newline at end of file
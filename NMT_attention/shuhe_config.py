@@ -19,14 +19,30 @@ decoder_layers = 4
 dropout_rate = 0.2
 batch_size = 196    #196
 dev_batch_size = 196   #196
+# padded words per validation batch, validation runs in one length-sorted pass under inference_mode
+valid_max_tokens = 8000
+# e.g. "cpu" or "cuda:1": validate in a separate process there while training continues, None validates in place
+valid_device = None
+# only write checkpoints (on a background thread) and leave ppl/BLEU and best-K to evaluator.py
+async_evaluation = False
 clip_grad = 5
 valid_iter = 1
 model_save_path = "/home/wangshuhe/shuhelearn/ShuHeLearning/NMT_attention/result/"
 max_epoch = 10000
 warm_up_step = 4000
+lr = 0.001
+optimizer = "adam"
+weight_decay = 0.0
+lr_scheduler = "plateau"
 
+# resume
+resume_model_path = None
+resume_optim_path = None
 # test
 checkpoint = "/home/wangshuhe/shuhelearn/ShuHeLearning/NMT_attention/result/checkpoint.pth"
 max_tar_length = 100
+# beam search stops a sentence at min(max_tar_length, max_len_a * source length + max_len_b) words
+max_len_a = 1.2
+max_len_b = 10
 test_batch_size = 50
 alpha = 0.7
\ No newline at end of file
@@ -38,6 +38,13 @@ def compare_bleu(predict, target):
             id_ = i
     return id_
 
+def search_report(stats):
+    '''
+    decode steps beam search ran against sentences * max_tar_length without the dynamic limit and early stop
+    '''
+    saved = 1 - stats['steps'] / max(stats['max_steps'], 1)
+    return f"decoded {stats['steps']}/{stats['max_steps']} steps ({saved*100:.1f}% saved), early stop {stats['early_stop']}, length limit {stats['length_limit']}, {stats['sentences']} sentences"
+
 def test():
     print(f"load test sentences from [{config.test_path_src}], [{config.test_path_tar}]", file=sys.stderr)
     test_data = Data(config.test_path_src, config.test_path_tar)
@@ -50,17 +57,14 @@ def test():
         #model = model.cuda()
         #model = nn.parallel.DistributedDataParallel(model)
     predict, test_data_tar = beam_search(model, test_data, test_data_loader, 15, config.max_tar_length)
-    for i in range(len(test_data_tar)):
-        for j in range(len(test_data_tar[i])):
-            test_data_tar[i][j] = model.text.tar.id2word[test_data_tar[i][j]]
-    for i in range(len(predict)):
-        for j in range(len(predict[i])):
-            predict[i][j] = model.text.tar.id2word[predict[i][j]]
+    test_data_tar = model.text.tar.decode(test_data_tar)
+    predict = model.text.tar.decode(predict)
     best_predict = []
     for i in tqdm(range(len(test_data_tar)), desc="find best predict"):
         best_predict.append(predict[i][compare_bleu(predict[i], test_data_tar[i])])
     bleu = corpus_bleu([[ref[1:-1]] for ref in test_data_tar], [pre for pre in predict])
     print(f"BLEU is {bleu*100}", file=sys.stderr)
+    print(f"beam search: {search_report(model.search_stats)}", file=sys.stderr)
 
 def main():
     torch.manual_seed(config.seed)
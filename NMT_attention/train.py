@@ -7,42 +7,23 @@ import torch
 import math
 import sys
 import os
+# modules shared by the NMT directories (optim, profiling, validate, evaluation)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_common"))
 from tqdm import tqdm
-from optim import Optim
+from optim import Optim, build_scheduler, build_optimizer
+import validate
+from evaluator import CheckpointWriter
+from profiling import PhaseTimer, add_profile_options, build_profiler, profile_done
 from data import Data
 from torch.utils.data import DataLoader
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '3'
 
-def evaluate_ppl(model, dev_data, dev_loader):
-    flag = model.training
-    model.eval()
-
-    batch_loss = 0
-    batch_size = 0
-    ppl = 0
-    
-    with torch.no_grad():
-        max_iter = int(math.ceil(len(dev_data)/config.dev_batch_size))
-        with tqdm(total=max_iter, desc="validation") as pbar:
-            for src, tar, tar_len in dev_loader:
-                loss = -model(src, tar)
-                loss = loss.sum()
-                batch_loss += loss
-                batch_size += tar_len
-                pbar.update(1)
-            ppl = math.exp(batch_loss/batch_size)
-    if (flag):
-        model.train()
-
-    return ppl
-
 def train():
     text = Text(config.src_corpus, config.tar_corpus)
     train_data = Data(config.train_path_src, config.train_path_tar)
     dev_data = Data(config.dev_path_src, config.dev_path_tar)
     train_loader = DataLoader(dataset=train_data, batch_size=config.batch_size, shuffle=True, collate_fn=utils.get_batch)
-    dev_loader = DataLoader(dataset=dev_data, batch_size=config.dev_batch_size, shuffle=True, collate_fn=utils.get_batch)    
     parser = OptionParser()
     parser.add_option("--embed_size", dest="embed_size", default=config.embed_size)
     parser.add_option("--hidden_size", dest="hidden_size", default=config.hidden_size)
@@ -50,65 +31,96 @@ def train():
     parser.add_option("--encoder_layer", dest="encoder_layer", default=config.encoder_layer)
     parser.add_option("--decoder_layers", dest="decoder_layers", default=config.decoder_layers)
     parser.add_option("--dropout_rate", dest="dropout_rate", default=config.dropout_rate)
+    add_profile_options(parser)
     (options, args) = parser.parse_args()
     device = torch.device("cuda:0" if config.cuda else "cpu")
-    #model_path = "/home/wangshuhe/shuhelearn/ShuHeLearning/NMT_attention/result/01.31_drop0.3_54_21.46508598886769_checkpoint.pth"
-    #print(f"load model from {model_path}", file=sys.stderr)
-    #model = NMT.load(model_path)
-    model = NMT(text, options, device)
-    #model = model.cuda()
-    #model_path = "/home/wangshuhe/shuhelearn/ShuHeLearning/NMT_attention/result/140_164.29781984744628_checkpoint.pth"
-    #print(f"load model from {model_path}", file=sys.stderr)
-    #model = NMT.load(model_path)
+    if (config.resume_model_path is not None):
+        print(f"load model from [{config.resume_model_path}]", file=sys.stderr)
+        model = NMT.load(config.resume_model_path)
+    else:
+        model = NMT(text, options, device)
     #model = torch.nn.DataParallel(model)
     model = model.to(device)
     model = model.cuda()
     model.train()
-    optimizer = Optim(torch.optim.Adam(model.parameters()))
-    #optimizer = Optim(torch.optim.Adam(model.parameters(), betas=(0.9, 0.98), eps=1e-9), config.hidden_size, config.warm_up_step)
-    #print(optimizer.lr)
+    optimizer = Optim(build_optimizer(model, config.optimizer, weight_decay=config.weight_decay), build_scheduler(config.lr_scheduler, config))
+    if (config.resume_optim_path is not None):
+        print(f"load optimizer from [{config.resume_optim_path}]", file=sys.stderr)
+        optimizer.load_state_dict(torch.load(config.resume_optim_path, map_location=device))
     epoch = 0
     valid_num = 1
     hist_valid_ppl = []
+    timer = PhaseTimer(enabled=options.profile, synchronize=options.profile and config.cuda)
+    profiler = build_profiler(options)
+    if (profiler is not None):
+        profiler.start()
+    step = 0
+    validator = None
+    if (config.valid_device is not None):
+        validator = validate.ValidationWorker(model, dev_data, config.valid_max_tokens, config.valid_device)
+    writer = CheckpointWriter() if (config.async_evaluation) else None
 
     print("begin training!")
     while (True):
         epoch += 1
         max_iter = int(math.ceil(len(train_data)/config.batch_size))
         with tqdm(total=max_iter, desc="train") as pbar:
-            for src_sents, tar_sents, tar_words_num_to_predict in train_loader:
+            for src_sents, tar_sents, tar_words_num_to_predict in timer.iterate(train_loader):
                 optimizer.zero_grad()
                 batch_size = len(src_sents)
 
-                now_loss = -model(src_sents, tar_sents)
-                now_loss = now_loss.sum()
-                loss = now_loss / batch_size
-                loss.backward()
+                with timer.phase("forward"):
+                    decode_out, target_tensor = model.hidden(src_sents, tar_sents)
+                with timer.phase("loss"):
+                    now_loss = -model.score(decode_out, target_tensor).sum()
+                    loss = now_loss / batch_size
+                with timer.phase("backward"):
+                    loss.backward()
 
-                _ = torch.nn.utils.clip_grad_norm_(model.parameters(), config.clip_grad)
+                with timer.phase("clip"):
+                    _ = torch.nn.utils.clip_grad_norm_(model.parameters(), config.clip_grad)
                 #optimizer.updata_lr()
-                optimizer.step_and_updata_lr()
+                with timer.phase("step"):
+                    optimizer.step_and_updata_lr()
 
                 pbar.set_postfix({"epwwoch": epoch, "avg_loss": loss.item(), "ppl": math.exp(now_loss.item()/tar_words_num_to_predict), "lr": optimizer.lr})
                 #pbar.set_postfix({"epoch": epoch, "avg_loss": loss.item(), "ppl": math.exp(now_loss.item()/tar_words_num_to_predict)})
                 pbar.update(1)
+                step += 1
+                if (profiler is not None):
+                    profiler.step()
+                if (profile_done(options, step)):
+                    profiler.stop()
+                    print(f"phase time per step: {timer.report()}", file=sys.stderr)
+                    return
         #print(optimizer.lr)
         if (epoch % config.valid_iter == 0):
             #if (epoch >= config.valid_iter//2):
             if (valid_num % 5 == 0):
                 valid_num = 0
-                optimizer.updata_lr()
+                optimizer.decay_lr()
             valid_num += 1
-            print("now begin validation ...", file=sys.stderr)
-            eav_ppl = evaluate_ppl(model, dev_data, dev_loader)
-            print("validation ppl %.2f" % (eav_ppl), file=sys.stderr)
-            flag = len(hist_valid_ppl) == 0 or eav_ppl < min(hist_valid_ppl)
-            if (flag):
-                print("current model is the best!, save to [%s]" % (config.model_save_path), file=sys.stderr)
-                hist_valid_ppl.append(eav_ppl)
-                model.save(os.path.join(config.model_save_path, f"02.08_window35drop0.2_{epoch}_{eav_ppl}_checkpoint.pth"))
-                torch.save(optimizer.optimizer.state_dict(), os.path.join(config.model_save_path, f"02.08_window35drop0.2_{epoch}_{eav_ppl}_optimizer.optim"))
+            if (writer is not None):
+                writer.save(model, optimizer, os.path.join(config.model_save_path, f"02.08_window35drop0.2_{epoch}"))
+            elif (validator is not None):
+                validator.submit(epoch, model, os.path.join(config.model_save_path, f"02.08_window35drop0.2_{epoch}_{{ppl}}_checkpoint.pth"))
+            else:
+                print("now begin validation ...", file=sys.stderr)
+                eav_ppl = validate.evaluate_ppl(model, dev_data, config.valid_max_tokens)
+                print("validation ppl %.2f" % (eav_ppl), file=sys.stderr)
+                flag = len(hist_valid_ppl) == 0 or eav_ppl < min(hist_valid_ppl)
+                if (flag):
+                    print("current model is the best!, save to [%s]" % (config.model_save_path), file=sys.stderr)
+                    hist_valid_ppl.append(eav_ppl)
+                    model.save(os.path.join(config.model_save_path, f"02.08_window35drop0.2_{epoch}_{eav_ppl}_checkpoint.pth"))
+                    torch.save(optimizer.state_dict(), os.path.join(config.model_save_path, f"02.08_window35drop0.2_{epoch}_{eav_ppl}_optimizer.optim"))
+        if (validator is not None):
+            validate.report(validator.poll())
         if (epoch == config.max_epoch):
+            if (validator is not None):
+                validate.report(validator.close())
+            if (writer is not None):
+                writer.wait()
             print("reach the maximum number of epochs!", file=sys.stderr)
             return
 
@@ -1,34 +1,117 @@
+import numpy as np
 import torch
 import utils
 
 class Vocab(object):
     '''
-    Vocabulary
+    words are kept as one utf-8 blob plus offsets, word i is blob[offsets[i]:offsets[i+1]]
+    word2id and the decode table are built on first use, so loading a binary vocabulary is two array reads
     '''
-    def __init__(self, file):
-        self.word2id = dict()
-        word_cnt = 0
-        with open(file, "r") as f:
-            for line in f:
-                line = line.strip()
-                self.word2id[line] = word_cnt
-                word_cnt += 1
-            f.close()
-        self.id2word = dict()
-        for key, value in self.word2id.items():
-            self.id2word[value] = key
-        
+    def __init__(self, file=None, words=None):
+        '''
+        file: one word per line, or a binary vocabulary written by save (.npz)
+        words: list[str], used when file is None
+        '''
+        if (file is not None and file.endswith(".npz")):
+            with np.load(file, allow_pickle=False) as table:
+                self.set_table(table['blob'], table['offsets'])
+            return
+        if (file is not None):
+            words = []
+            with open(file, "r") as f:
+                for line in f:
+                    words.append(line.strip())
+                f.close()
+        self.set_words(words)
+
+    def set_words(self, words):
+        data = [word.encode("utf-8") for word in words]
+        offsets = np.zeros(len(data)+1, dtype=np.int64)
+        np.cumsum([len(word) for word in data], out=offsets[1:])
+        self.set_table(np.frombuffer(b"".join(data), dtype=np.uint8), offsets)
+
+    def set_table(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+        self._words = None
+        self._word2id = None
+
+    def save(self, path):
+        np.savez(path, blob=self.blob, offsets=self.offsets)
+
+    def __getstate__(self):
+        return {'blob': self.blob, 'offsets': self.offsets}
+
+    def __setstate__(self, state):
+        if ('word2id' in state):
+            # checkpoints saved before the array table keep the two dicts; a word repeated in the vocabulary file
+            # kept only its last id there, so put every word back at its own id and fill the unused ids
+            word2id = state['word2id']
+            words = [f"<unused_{i}>" for i in range(max(word2id.values(), default=-1)+1)]
+            for word, word_id in word2id.items():
+                words[word_id] = word
+            self.set_words(words)
+        else:
+            self.set_table(state['blob'], state['offsets'])
+
+    @property
+    def words(self):
+        '''
+        object array of all words, indexed by id
+        '''
+        if (self._words is None):
+            data = self.blob.tobytes()
+            bounds = self.offsets.tolist()
+            words = np.empty(len(bounds)-1, dtype=object)
+            words[:] = [data[bounds[i]:bounds[i+1]].decode("utf-8") for i in range(len(bounds)-1)]
+            self._words = words
+        return self._words
+
+    @property
+    def word2id(self):
+        if (self._word2id is None):
+            self._word2id = {word: word_id for word_id, word in enumerate(self.words.tolist())}
+        return self._word2id
+    
     def __getitem__(self, word):
         return self.word2id[word]
-
+    
+    def __len__(self):
+        return len(self.offsets)-1
+    
     def __contains__(self, word):
         return word in self.word2id
-
-    def __len__(self):
-        return len(self.word2id)
     
     def id2word(self, id):
-        return self.id2word[id]
+        return self.words[id]
+
+    def encode(self, sents, unk="<unk>"):
+        '''
+        sents: list[list[str]]
+        return: list[np.ndarray], unknown words map to unk
+        '''
+        word2id = self.word2id
+        unk_id = word2id[unk]
+        lengths = [len(sen) for sen in sents]
+        ids = np.fromiter((word2id.get(word, unk_id) for sen in sents for word in sen), dtype=np.int64, count=sum(lengths))
+        return np.split(ids, np.cumsum(lengths)[:-1]) if (len(sents) > 0) else []
+
+    def decode(self, sents):
+        '''
+        sents: list of id sequences (list[int] or np.ndarray), or one 2-D np.ndarray
+        return: list[list[str]]
+        '''
+        if (isinstance(sents, np.ndarray)):
+            return self.words[sents].tolist()
+        if (len(sents) == 0):
+            return []
+        words = self.words[np.concatenate([np.asarray(sen, dtype=np.int64).reshape(-1) for sen in sents])].tolist()
+        result = []
+        start = 0
+        for sen in sents:
+            result.append(words[start:start+len(sen)])
+            start += len(sen)
+        return result
     
     def sen2id(self, sents):
         '''
@@ -52,11 +135,24 @@ class Vocab(object):
     def word2tensor(self, sents, device):
         sents_id = self.sen2id(sents)
         sents_id = utils.padding(sents_id, self['<pad>'])
-        sen_tensor = torch.tensor(sents_id, dtype=torch.long, device=device).cuda()
+        sen_tensor = torch.tensor(sents_id, dtype=torch.long, device=device)
         return sen_tensor.t()
 
 class Text(object):
 
     def __init__(self, source, target):
         self.src = Vocab(source)
-        self.tar = Vocab(target)
\ No newline at end of file
+        self.tar = Vocab(target)
+
+    def to_words(self):
+        '''
+        the vocabularies as plain word lists, what a checkpoint stores so it loads with torch.load(weights_only=True)
+        '''
+        return {'src': self.src.words.tolist(), 'tar': self.tar.words.tolist()}
+
+    @staticmethod
+    def from_words(words):
+        text = Text.__new__(Text)
+        text.src = Vocab(words=words['src'])
+        text.tar = Vocab(words=words['tar'])
+        return text
\ No newline at end of file
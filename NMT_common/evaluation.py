@@ -0,0 +1,141 @@
+import io
+import os
+import sys
+import json
+import glob
+import time
+import threading
+from optparse import OptionParser
+import torch
+from nltk.translate.bleu_score import corpus_bleu
+import validate
+
+CHECKPOINT_SUFFIX = "_checkpoint.pth"
+OPTIMIZER_SUFFIX = "_optimizer.optim"
+
+class CheckpointWriter(object):
+    '''
+    the trainer only pays for serializing into memory, the file is written on a thread
+    files appear through a rename, so the evaluator never reads half a checkpoint
+    '''
+    def __init__(self):
+        self.thread = None
+
+    def save(self, model, optimizer, prefix):
+        '''
+        writes <prefix>_checkpoint.pth and <prefix>_optimizer.optim
+        '''
+        self.wait()
+        model_buffer = io.BytesIO()
+        model.save(model_buffer)
+        optim_buffer = io.BytesIO()
+        torch.save(optimizer.state_dict(), optim_buffer)
+        files = [(optim_buffer, prefix+OPTIMIZER_SUFFIX), (model_buffer, prefix+CHECKPOINT_SUFFIX)]
+        self.thread = threading.Thread(target=self.write, args=(files,))
+        self.thread.start()
+
+    def write(self, files):
+        for buffer, path in files:
+            with open(path+".tmp", "wb") as f:
+                f.write(buffer.getbuffer())
+            os.replace(path+".tmp", path)
+
+    def wait(self):
+        if (self.thread is not None):
+            self.thread.join()
+            self.thread = None
+
+def bleu_score(model, data, search_size, max_tar_length, batch_size):
+    '''
+    corpus BLEU of beam search over data, batches of similar length
+    '''
+    predict = []
+    target = []
+    model.eval()
+    with torch.no_grad():
+        order = sorted(range(len(data)), key=lambda i: len(data.src[i]))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start+batch_size]
+            src = [data.src[i].copy() for i in batch]
+            predict.extend(model.beam_search(src, search_size, max_tar_length, len(src)))
+            target.extend(data.tar[i][1:-1] for i in batch)
+    predict = model.text.tar.decode(predict)
+    target = model.text.tar.decode(target)
+    return corpus_bleu([[tar] for tar in target], predict)
+
+def read_metrics(path):
+    metrics = []
+    if (os.path.exists(path)):
+        with open(path, "r") as f:
+            for line in f:
+                metrics.append(json.loads(line))
+    return metrics
+
+def keep_best(metrics, keep, metric):
+    '''
+    delete every evaluated checkpoint (and its optimizer file) outside the best keep
+    '''
+    alive = [record for record in metrics if os.path.exists(record['checkpoint'])]
+    # ties (e.g. BLEU 0 early in training) are broken by the other metric
+    if (metric == "bleu"):
+        alive.sort(key=lambda record: (-record['bleu'], record['ppl']))
+    else:
+        alive.sort(key=lambda record: (record['ppl'], -record['bleu']))
+    for record in alive[keep:]:
+        print(f"remove [{record['checkpoint']}], {metric} {record[metric]:.4f}", file=sys.stderr)
+        os.remove(record['checkpoint'])
+        optim_path = record['checkpoint'][:-len(CHECKPOINT_SUFFIX)] + OPTIMIZER_SUFFIX
+        if (os.path.exists(optim_path)):
+            os.remove(optim_path)
+
+def evaluate_checkpoint(config, load_model, path, dev_data, bleu_data, device, options):
+    model = load_model(path)
+    model.device = device
+    model = model.to(device)
+    start = time.time()
+    ppl = validate.evaluate_ppl(model, dev_data, config.valid_max_tokens)
+    bleu = bleu_score(model, bleu_data, options.beam, config.max_tar_length, config.test_batch_size)
+    return {'checkpoint': path, 'mtime': os.path.getmtime(path), 'ppl': ppl, 'bleu': bleu, 'eval_seconds': time.time() - start}
+
+def watch(config, load_model, load_dev):
+    '''
+    the evaluator of a model directory: scores every new checkpoint in --dir on the dev set and keeps the best
+    config: the directory's shuhe_config, load_model(path): its NMT.load, load_dev(): its dev Data
+    '''
+    parser = OptionParser()
+    parser.add_option("--dir", dest="dir", default=config.model_save_path, help="checkpoint directory to watch")
+    parser.add_option("--metrics", dest="metrics", default=None, help="json lines file, default <dir>/metrics.jsonl")
+    parser.add_option("--device", dest="device", default="cpu")
+    parser.add_option("--beam", dest="beam", type="int", default=5)
+    parser.add_option("--bleu_sentences", dest="bleu_sentences", type="int", default=None, help="decode only the first N dev sentences")
+    parser.add_option("--keep", dest="keep", type="int", default=5, help="best checkpoints to keep, 0 keeps all")
+    parser.add_option("--metric", dest="metric", type="choice", choices=["bleu", "ppl"], default="bleu", help="bleu or ppl")
+    parser.add_option("--interval", dest="interval", type="float", default=60, help="seconds between directory scans")
+    parser.add_option("--once", dest="once", action="store_true", default=False, help="evaluate what is there and exit")
+    (options, _) = parser.parse_args()
+    metrics_path = options.metrics if (options.metrics is not None) else os.path.join(options.dir, "metrics.jsonl")
+    device = torch.device(options.device)
+    dev_data = load_dev()
+    bleu_data = dev_data
+    if (options.bleu_sentences is not None):
+        bleu_data = load_dev()
+        bleu_data.src = bleu_data.src[:options.bleu_sentences]
+        bleu_data.tar = bleu_data.tar[:options.bleu_sentences]
+        bleu_data.len_ = len(bleu_data.src)
+    metrics = read_metrics(metrics_path)
+    done = set(record['checkpoint'] for record in metrics)
+    print(f"watch [{options.dir}], {len(done)} checkpoints already evaluated", file=sys.stderr)
+    while True:
+        new = sorted((path for path in glob.glob(os.path.join(options.dir, "*"+CHECKPOINT_SUFFIX)) if path not in done), key=os.path.getmtime)
+        for path in new:
+            record = evaluate_checkpoint(config, load_model, path, dev_data, bleu_data, device, options)
+            print(f"[{path}] ppl {record['ppl']:.2f} bleu {record['bleu']*100:.2f} ({record['eval_seconds']:.0f}s)", file=sys.stderr)
+            with open(metrics_path, "a") as f:
+                f.write(json.dumps(record)+'\n')
+            metrics.append(record)
+            done.add(path)
+            if (options.keep > 0):
+                keep_best(metrics, options.keep, options.metric)
+        if (options.once):
+            return
+        time.sleep(options.interval)
@@ -0,0 +1,212 @@
+import math
+import inspect
+import torch
+import torch.nn as nn
+
+schedulers = dict()
+
+def register_scheduler(name):
+    def register(cls):
+        schedulers[name] = cls
+        return cls
+    return register
+
+def build_scheduler(name, config):
+    return schedulers[name].build(config)
+
+class Scheduler(object):
+    '''
+    learning rate as a closed-form function of the update number
+    '''
+    @classmethod
+    def build(cls, config):
+        raise NotImplementedError
+
+    def get_lr(self, step):
+        raise NotImplementedError
+
+    def decay(self):
+        pass
+
+    def state_dict(self):
+        return dict(self.__dict__)
+
+    def load_state_dict(self, state_dict):
+        self.__dict__.update(state_dict)
+
+@register_scheduler("noam")
+class NoamScheduler(Scheduler):
+
+    def __init__(self, d_model, warm_up_step):
+        self.warm_up_step = warm_up_step
+        self.init_lr = math.pow(d_model, -0.5)
+
+    @classmethod
+    def build(cls, config):
+        return cls(config.d_model, config.warm_up_step)
+
+    def get_lr(self, step):
+        return self.init_lr * min(math.pow(step, -0.5), math.pow(self.warm_up_step, -1.5)*step)
+
+@register_scheduler("inverse_sqrt")
+class InverseSqrtScheduler(Scheduler):
+    '''
+    linear warm up from init_lr to lr, then decay with the inverse square root of the update number
+    same schedule as NMT_fairseq/shuhe_lr.py
+    '''
+    def __init__(self, warm_up_step, init_lr, lr):
+        self.warm_up_step = warm_up_step
+        self.init_lr = init_lr
+        self.lr_step = (lr - init_lr) / warm_up_step
+        self.decay_factor = lr * math.pow(warm_up_step, 0.5)
+
+    @classmethod
+    def build(cls, config):
+        return cls(config.warm_up_step, config.init_lr, config.lr)
+
+    def get_lr(self, step):
+        if (step < self.warm_up_step):
+            return self.init_lr + step * self.lr_step
+        return self.decay_factor * math.pow(step, -0.5)
+
+@register_scheduler("plateau")
+class PlateauScheduler(Scheduler):
+    '''
+    fixed learning rate, multiplied by factor every time the trainer calls decay
+    '''
+    def __init__(self, lr, factor=0.5):
+        self.lr = lr
+        self.factor = factor
+
+    @classmethod
+    def build(cls, config):
+        return cls(config.lr)
+
+    def get_lr(self, step):
+        return self.lr
+
+    def decay(self):
+        self.lr = self.lr * self.factor
+
+def get_parameter_groups(model, weight_decay):
+    '''
+    LayerNorm, embedding and bias parameters are kept out of weight decay
+    '''
+    no_decay = dict()
+    for module in model.modules():
+        for name, param in module.named_parameters(recurse=False):
+            if (isinstance(module, (nn.LayerNorm, nn.Embedding)) or name.endswith('bias')):
+                no_decay[id(param)] = param
+    decay = [param for param in model.parameters() if id(param) not in no_decay and param.requires_grad]
+    no_decay = [param for param in no_decay.values() if param.requires_grad]
+    groups = [{'params': decay, 'weight_decay': weight_decay}, {'params': no_decay, 'weight_decay': 0.0}]
+    return [group for group in groups if len(group['params']) > 0]
+
+def build_optimizer(model, name, betas=(0.9, 0.999), eps=1e-8, weight_decay=0.0):
+    '''
+    the learning rate is left to the scheduler, see Optim
+    '''
+    groups = get_parameter_groups(model, weight_decay)
+    if (name == "adafactor"):
+        return Adafactor(groups, beta2=betas[1])
+    kwargs = dict(betas=betas, eps=eps)
+    adam_args = inspect.signature(torch.optim.Adam).parameters
+    on_cuda = all(param.is_cuda for group in groups for param in group['params'])
+    if ('fused' in adam_args and on_cuda):
+        kwargs['fused'] = True
+    elif ('foreach' in adam_args):
+        kwargs['foreach'] = True
+    return torch.optim.Adam(groups, **kwargs)
+
+class Adafactor(torch.optim.Optimizer):
+    '''
+    Adam without the first moment and with the second moment of every matrix factored into
+    row and column averages (Shazeer & Stern, 2018): a V*d embedding keeps V+d floats of state instead of 2*V*d
+    '''
+    def __init__(self, params, lr=1e-3, beta2=0.999, eps=1e-30, clip_threshold=1.0):
+        defaults = dict(lr=lr, beta2=beta2, eps=eps, clip_threshold=clip_threshold, weight_decay=0.0)
+        super(Adafactor, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if (closure is not None):
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            for param in group['params']:
+                if (param.grad is None):
+                    continue
+                grad = param.grad
+                state = self.state[param]
+                factored = grad.dim() >= 2
+                if (len(state) == 0):
+                    state['step'] = 0
+                    if (factored):
+                        state['exp_avg_sq_row'] = torch.zeros(grad.shape[:-1], dtype=grad.dtype, device=grad.device)
+                        state['exp_avg_sq_col'] = torch.zeros(grad.shape[:-2]+grad.shape[-1:], dtype=grad.dtype, device=grad.device)
+                    else:
+                        state['exp_avg_sq'] = torch.zeros_like(grad)
+                state['step'] += 1
+                beta2 = group['beta2']
+                update = grad*grad + group['eps']
+                if (factored):
+                    row = state['exp_avg_sq_row'].mul_(beta2).add_(update.mean(dim=-1), alpha=1-beta2)
+                    col = state['exp_avg_sq_col'].mul_(beta2).add_(update.mean(dim=-2), alpha=1-beta2)
+                    row_factor = (row / row.mean(dim=-1, keepdim=True)).rsqrt().unsqueeze(dim=-1)
+                    update = grad * row_factor * col.rsqrt().unsqueeze(dim=-2)
+                else:
+                    exp_avg_sq = state['exp_avg_sq'].mul_(beta2).add_(update, alpha=1-beta2)
+                    update = grad * exp_avg_sq.rsqrt()
+                update.mul_(math.sqrt(1 - math.pow(beta2, state['step'])))
+                update.div_((update.pow(2).mean().sqrt() / group['clip_threshold']).clamp_(min=1.0))
+                if (group['weight_decay'] != 0):
+                    param.add_(param, alpha=-group['weight_decay']*group['lr'])
+                param.add_(update, alpha=-group['lr'])
+        return loss
+
+class Optim():
+
+    def __init__(self, optimizer, scheduler):
+        self.optimizer = optimizer
+        self.scheduler = scheduler
+        self.n_current_step = 0
+        self.lr = None
+        self.set_lr(self.scheduler.get_lr(1))
+
+    def step_and_updata_lr(self):
+        self.updata_lr()
+        self.optimizer.step()
+
+    def updata_lr(self):
+        self.n_current_step += 1
+        self.set_lr(self.scheduler.get_lr(self.n_current_step))
+
+    def decay_lr(self):
+        self.scheduler.decay()
+        self.set_lr(self.scheduler.get_lr(max(self.n_current_step, 1)))
+
+    def set_lr(self, lr):
+        # param_groups are only touched when the schedule actually moves
+        if (lr == self.lr):
+            return
+        self.lr = lr
+        for para in self.optimizer.param_groups:
+            para['lr'] = lr
+
+    def zero_grad(self):
+        self.optimizer.zero_grad()
+
+    def state_dict(self):
+        return {
+            'optimizer': self.optimizer.state_dict(),
+            'scheduler': self.scheduler.state_dict(),
+            'n_current_step': self.n_current_step
+        }
+
+    def load_state_dict(self, state_dict):
+        self.optimizer.load_state_dict(state_dict['optimizer'])
+        self.scheduler.load_state_dict(state_dict['scheduler'])
+        self.n_current_step = state_dict['n_current_step']
+        self.lr = None
+        self.set_lr(self.scheduler.get_lr(max(self.n_current_step, 1)))
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+from collections import OrderedDict
+import torch
+
+class PhaseTimer(object):
+    '''
+    wall time per training phase (data / forward / loss / backward / clip / step)
+    synchronize: wait for queued CUDA work at every phase boundary, otherwise a kernel is charged to whichever phase blocks on it
+    '''
+    def __init__(self, enabled=True, synchronize=False):
+        self.enabled = enabled
+        self.synchronize = synchronize
+        self.total = OrderedDict()
+        self.count = OrderedDict()
+
+    def now(self):
+        if (self.synchronize):
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def add(self, name, cost):
+        self.total[name] = self.total.get(name, 0.0) + cost
+        self.count[name] = self.count.get(name, 0) + 1
+
+    @contextmanager
+    def phase(self, name):
+        if (not self.enabled):
+            yield
+            return
+        with torch.profiler.record_function(name):
+            start = self.now()
+            yield
+            self.add(name, self.now() - start)
+
+    def iterate(self, loader, name="data"):
+        '''
+        time spent waiting for the next batch of loader
+        '''
+        iterator = iter(loader)
+        while True:
+            with self.phase(name):
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    return
+            yield batch
+
+    def report(self):
+        total = sum(self.total.values())
+        if (total == 0):
+            return ""
+        return "  ".join(f"{name} {cost/self.count[name]*1000:.1f}ms ({cost/total*100:.1f}%)" for name, cost in self.total.items())
+
+    def reset(self):
+        self.total = OrderedDict()
+        self.count = OrderedDict()
+
+def add_profile_options(parser):
+    parser.add_option("--profile", dest="profile", action="store_true", default=False, help="profile a window of steps, then stop")
+    parser.add_option("--profile_wait", dest="profile_wait", type="int", default=5, help="steps skipped before profiling")
+    parser.add_option("--profile_steps", dest="profile_steps", type="int", default=10, help="steps recorded by torch.profiler")
+    parser.add_option("--profile_dir", dest="profile_dir", default="profile", help="where the chrome trace is written")
+
+def build_profiler(options):
+    '''
+    torch.profiler over profile_steps steps after profile_wait + 1 warm up steps
+    the chrome trace (open in chrome://tracing or perfetto) and the top operators go to profile_dir
+    '''
+    if (not options.profile):
+        return None
+    os.makedirs(options.profile_dir, exist_ok=True)
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if (torch.cuda.is_available()):
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    def on_trace_ready(profiler):
+        trace_path = os.path.join(options.profile_dir, f"trace_{profiler.step_num}.json")
+        profiler.export_chrome_trace(trace_path)
+        sort_by = "cuda_time_total" if (torch.cuda.is_available()) else "cpu_time_total"
+        table = profiler.key_averages().table(sort_by=sort_by, row_limit=30)
+        with open(os.path.join(options.profile_dir, f"ops_{profiler.step_num}.txt"), "w") as f:
+            f.write(table)
+        print(table, file=sys.stderr)
+        print(f"write chrome trace to [{trace_path}]", file=sys.stderr)
+
+    return torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(wait=options.profile_wait, warmup=1, active=options.profile_steps, repeat=1),
+        on_trace_ready=on_trace_ready,
+        record_shapes=True,
+        profile_memory=True
+    )
+
+def profile_done(options, step):
+    return options.profile and step >= options.profile_wait + 1 + options.profile_steps
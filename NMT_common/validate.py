@@ -0,0 +1,111 @@
+import sys
+import math
+import copy
+import torch
+import torch.multiprocessing as mp
+
+def token_batches(data, max_tokens):
+    '''
+    data: Data
+    return: list of index lists, sorted by length so padding is minimal, each at most max_tokens padded words
+    '''
+    order = sorted(range(len(data)), key=lambda i: (len(data.tar[i]), len(data.src[i])))
+    batches = []
+    batch = []
+    width = 0
+    for i in order:
+        now_width = max(width, len(data.src[i]), len(data.tar[i]))
+        if (len(batch) > 0 and now_width * (len(batch)+1) > max_tokens):
+            batches.append(batch)
+            batch = []
+            now_width = max(len(data.src[i]), len(data.tar[i]))
+        batch.append(i)
+        width = now_width
+    if (len(batch) > 0):
+        batches.append(batch)
+    return batches
+
+def evaluate_ppl(model, data, max_tokens):
+    '''
+    perplexity of model over data, tar_word_num counted as in utils.get_batch
+    the loss stays on the device until the end, so there is one synchronization per validation
+    '''
+    flag = model.training
+    model.eval()
+    sum_loss = None
+    sum_word = 0
+    with torch.inference_mode():
+        for batch in token_batches(data, max_tokens):
+            src = [data.src[i].copy() for i in batch]
+            tar = [data.tar[i].copy() for i in batch]
+            batch_loss = -model(src, tar).sum()
+            sum_loss = batch_loss if (sum_loss is None) else sum_loss + batch_loss
+            sum_word += sum(len(sen) for sen in tar)
+    if (flag):
+        model.train()
+    if (sum_loss is None or sum_word == 0):
+        print("validation data is empty, perplexity is inf", file=sys.stderr)
+        return math.inf
+    return math.exp(sum_loss.item() / sum_word)
+
+def _validation_loop(model, data, max_tokens, device, requests, results):
+    model.device = device
+    model = model.to(device)
+    best = None
+    while True:
+        request = requests.get()
+        if (request is None):
+            break
+        tag, state_dict, save_path = request
+        model.load_state_dict(state_dict)
+        ppl = evaluate_ppl(model, data, max_tokens)
+        is_best = best is None or ppl < best
+        if (is_best):
+            best = ppl
+            if (save_path is not None):
+                model.save(save_path.format(ppl=ppl))
+        results.put((tag, ppl, is_best))
+
+class ValidationWorker(object):
+    '''
+    validates snapshots in a separate process on another device (or the CPU) while training continues
+    the worker keeps the best perplexity and saves that snapshot itself, the optimizer state is not saved in this mode
+    '''
+    def __init__(self, model, data, max_tokens, device):
+        context = mp.get_context("spawn")
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.pending = 0
+        snapshot = copy.deepcopy(model).cpu()
+        self.process = context.Process(target=_validation_loop, args=(snapshot, data, max_tokens, torch.device(device), self.requests, self.results), daemon=True)
+        self.process.start()
+
+    def submit(self, tag, model, save_path=None):
+        '''
+        save_path: where a new best snapshot goes, "{ppl}" is filled in
+        '''
+        state_dict = {key: value.detach().to("cpu", copy=True) for key, value in model.state_dict().items()}
+        self.requests.put((tag, state_dict, save_path))
+        self.pending += 1
+
+    def poll(self, block=False):
+        '''
+        return: list of (tag, ppl, is_best) finished since the last call, with block wait for all pending ones
+        '''
+        output = []
+        while (self.pending > 0):
+            if (not block and self.results.empty()):
+                break
+            output.append(self.results.get())
+            self.pending -= 1
+        return output
+
+    def close(self):
+        output = self.poll(block=True)
+        self.requests.put(None)
+        self.process.join()
+        return output
+
+def report(results):
+    for tag, ppl, is_best in results:
+        print(f"validation {tag}: ppl {ppl:.2f}" + (" (best, saved)" if is_best else ""), file=sys.stderr)
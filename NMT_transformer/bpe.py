@@ -0,0 +1,241 @@
+import sys
+import heapq
+import multiprocessing
+from collections import Counter, defaultdict
+from optparse import OptionParser
+import numpy as np
+from tqdm import tqdm
+import shuhe_config as config
+from vocab import Vocab
+
+SPECIAL = ['<start>', '<end>', '<pad>', '<unk>']
+END = '</w>'
+MARK = '@@'
+
+def merge_word(word, pair):
+    first, second = pair
+    output = []
+    i = 0
+    while (i < len(word)):
+        if (i < len(word)-1 and word[i] == first and word[i+1] == second):
+            output.append(first+second)
+            i += 2
+        else:
+            output.append(word[i])
+            i += 1
+    return tuple(output) if (len(output) != len(word)) else word
+
+def learn_bpe(word_count, num_merges, min_frequency=2):
+    '''
+    word_count: Counter of whitespace tokens
+    return: list of merged symbol pairs, most frequent first
+    pair counts are updated only for the words a merge touches, the best pair comes from a lazily invalidated heap
+    '''
+    words = [tuple(word[:-1]) + (word[-1]+END,) for word in word_count]
+    counts = list(word_count.values())
+    stats = Counter()
+    index = defaultdict(set)
+    for i, word in enumerate(words):
+        for pair in zip(word, word[1:]):
+            stats[pair] += counts[i]
+            index[pair].add(i)
+    heap = [(-freq, pair) for pair, freq in stats.items()]
+    heapq.heapify(heap)
+    merges = []
+    with tqdm(total=num_merges, desc="learn bpe") as pbar:
+        while (len(merges) < num_merges and len(heap) > 0):
+            freq, pair = heapq.heappop(heap)
+            if (stats.get(pair, 0) != -freq):
+                continue
+            if (-freq < min_frequency):
+                break
+            merges.append(pair)
+            pbar.update(1)
+            changed = set()
+            for i in index.pop(pair):
+                word = words[i]
+                new_word = merge_word(word, pair)
+                if (new_word is word):
+                    continue
+                for old_pair in zip(word, word[1:]):
+                    stats[old_pair] -= counts[i]
+                    changed.add(old_pair)
+                for new_pair in zip(new_word, new_word[1:]):
+                    stats[new_pair] += counts[i]
+                    index[new_pair].add(i)
+                    changed.add(new_pair)
+                words[i] = new_word
+            for now_pair in changed:
+                if (stats[now_pair] <= 0):
+                    del stats[now_pair]
+                else:
+                    heapq.heappush(heap, (-stats[now_pair], now_pair))
+    return merges
+
+class BPE(object):
+    '''
+    applies merges in learned order, word pieces except the last carry the "@@" continuation mark
+    '''
+    def __init__(self, merges):
+        self.merges = merges
+        self.ranks = {pair: rank for rank, pair in enumerate(merges)}
+        self.cache = dict()
+
+    def segment(self, word):
+        if (word in self.cache):
+            return self.cache[word]
+        symbols = list(word[:-1]) + [word[-1]+END]
+        while (len(symbols) > 1):
+            rank, i = min((self.ranks.get(pair, len(self.ranks)), i) for i, pair in enumerate(zip(symbols, symbols[1:])))
+            if (rank == len(self.ranks)):
+                break
+            symbols[i:i+2] = [symbols[i]+symbols[i+1]]
+        pieces = [symbol+MARK for symbol in symbols[:-1]] + [symbols[-1][:-len(END)]]
+        self.cache[word] = pieces
+        return pieces
+
+    def apply(self, line):
+        '''
+        line: str
+        return: list[str] word pieces
+        '''
+        pieces = []
+        for word in line.split():
+            pieces.extend(self.segment(word))
+        return pieces
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for first, second in self.merges:
+                f.write(first+' '+second+'\n')
+
+    @staticmethod
+    def load(path):
+        merges = []
+        with open(path, "r") as f:
+            for line in f:
+                first, second = line.rstrip('\n').split(' ')
+                merges.append((first, second))
+        return BPE(merges)
+
+def remove_bpe(pieces):
+    '''
+    pieces: list[str]
+    return: str, the detokenized words
+    '''
+    return (" ".join(pieces)+" ").replace(MARK+" ", "").strip()
+
+def count_words(files):
+    word_count = Counter()
+    for path in files:
+        with open(path, "r") as f:
+            for line in f:
+                word_count.update(line.split())
+    return word_count
+
+def build_vocab(bpe, files, vocab_file):
+    '''
+    special words first so <start>/<end>/<pad>/<unk> keep ids 0-3, then word pieces by frequency
+    vocab_file ending in .npz is written in the binary Vocab format
+    '''
+    piece_count = Counter()
+    for word, cnt in count_words(files).items():
+        for piece in bpe.segment(word):
+            piece_count[piece] += cnt
+    words = SPECIAL + [piece for piece, _ in piece_count.most_common() if piece not in SPECIAL]
+    vocab = Vocab(words=words)
+    if (vocab_file.endswith(".npz")):
+        vocab.save(vocab_file)
+    else:
+        with open(vocab_file, "w") as f:
+            for word in words:
+                f.write(word+'\n')
+    return vocab
+
+_worker_bpe = None
+_worker_vocab = None
+
+def _init_worker(merges, words):
+    global _worker_bpe, _worker_vocab
+    _worker_bpe = BPE(merges)
+    _worker_vocab = Vocab(words=words)
+
+def _encode_lines(lines):
+    '''
+    the per-worker segmentation cache lives as long as the worker, so frequent words are split once per process
+    '''
+    sents = _worker_vocab.encode([_worker_bpe.apply(line) for line in lines])
+    lengths = np.array([len(sen) for sen in sents], dtype=np.int64)
+    ids = np.concatenate(sents).astype(np.int32) if (len(sents) > 0) else np.zeros(0, dtype=np.int32)
+    return ids, lengths
+
+def read_chunks(path, chunk_size):
+    lines = []
+    with open(path, "r") as f:
+        for line in f:
+            lines.append(line)
+            if (len(lines) == chunk_size):
+                yield lines
+                lines = []
+    if (len(lines) > 0):
+        yield lines
+
+def encode_file(bpe, vocab, in_file, out_file, num_workers=1, chunk_size=10000):
+    '''
+    segment and number in_file, written as a binary corpus (.npz, int32 ids + int64 sentence offsets) that utils.read_corpus reads
+    '''
+    args = (bpe.merges, vocab.words.tolist())
+    all_ids = []
+    all_lengths = []
+    if (num_workers > 1):
+        pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=args)
+        results = pool.imap(_encode_lines, read_chunks(in_file, chunk_size))
+    else:
+        pool = None
+        _init_worker(*args)
+        results = map(_encode_lines, read_chunks(in_file, chunk_size))
+    with tqdm(desc=f"encode {in_file}", unit=" sentences") as pbar:
+        for ids, lengths in results:
+            all_ids.append(ids)
+            all_lengths.append(lengths)
+            pbar.update(len(lengths))
+    if (pool is not None):
+        pool.close()
+        pool.join()
+    lengths = np.concatenate(all_lengths) if (len(all_lengths) > 0) else np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(len(lengths)+1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    ids = np.concatenate(all_ids) if (len(all_ids) > 0) else np.zeros(0, dtype=np.int32)
+    np.savez(out_file, ids=ids, offsets=offsets)
+    print(f"{len(lengths)} sentences, {len(ids)} tokens, {len(ids)/max(len(lengths), 1):.2f} tokens/sentence -> [{out_file}]", file=sys.stderr)
+
+def main():
+    parser = OptionParser(usage="%prog learn|vocab|encode [options] file ...")
+    parser.add_option("-c", "--codes", dest="codes", default=config.bpe_codes, help="merge file")
+    parser.add_option("-n", "--merges", dest="merges", type="int", default=config.bpe_merges, help="number of merges to learn, i.e. the vocabulary size")
+    parser.add_option("--min_frequency", dest="min_frequency", type="int", default=2)
+    parser.add_option("-v", "--vocab", dest="vocab", help="vocabulary file, text or .npz")
+    parser.add_option("-o", "--output", dest="output", help="encode: output .npz per input, default <file>.npz")
+    parser.add_option("-j", "--workers", dest="workers", type="int", default=config.bpe_workers)
+    (options, args) = parser.parse_args()
+    if (len(args) < 2):
+        parser.error("need a command and at least one file")
+    command, files = args[0], args[1:]
+    if (command == "learn"):
+        print(f"learn {options.merges} merges from {files}", file=sys.stderr)
+        bpe = BPE(learn_bpe(count_words(files), options.merges, options.min_frequency))
+        bpe.save(options.codes)
+    elif (command == "vocab"):
+        vocab = build_vocab(BPE.load(options.codes), files, options.vocab)
+        print(f"{len(vocab)} words -> [{options.vocab}]", file=sys.stderr)
+    elif (command == "encode"):
+        bpe = BPE.load(options.codes)
+        vocab = Vocab(options.vocab)
+        for path in files:
+            out_file = options.output if (options.output is not None and len(files) == 1) else path+".npz"
+            encode_file(bpe, vocab, path, out_file, options.workers)
+    else:
+        parser.error(f"unknown command {command}")
+
+if __name__ == '__main__':
+    main()
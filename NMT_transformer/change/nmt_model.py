@@ -1,7 +1,9 @@
+import pickle
 import torch
 import torch.nn as nn
 import math
 import shuhe_config as config
+from vocab import Text
 from embeddings import Embeddings
 from label_smoothing import LabelSmoothing
 
@@ -26,10 +28,22 @@ class NMT(nn.Module):
         self.smoothing = LabelSmoothing(len(self.text.tar), self.text.tar['<pad>'], self.args['smoothing_eps'])
 
     def forward(self, source, target, smoothing=False):
+        output, target_tensor = self.hidden(source, target)
+        return self.score(output, target_tensor, smoothing)
+
+    def hidden(self, source, target):
+        '''
+        return: decoder output (tar_len * batch_size * d_model) and the padded target tensor, everything before the projection
+        '''
         source_tensor = self.text.src.word2tensor(source, self.device)
         target_tensor = self.text.tar.word2tensor(target, self.device)
         memory, memory_padding_mask = self.encode(source_tensor)
-        output = self.decode(memory, memory_padding_mask, target_tensor)
+        return self.decode(memory, memory_padding_mask, target_tensor), target_tensor
+
+    def score(self, output, target_tensor, smoothing=False):
+        '''
+        return: batch_size, per-sentence log-likelihood from the output of hidden: projection, log_softmax and gather
+        '''
         output_mask = (target_tensor != self.text.tar['<pad>']).float()
         if (smoothing):
             return self.smoothing(nn.functional.log_softmax(self.project(output), dim=-1), target_tensor)
@@ -209,16 +223,21 @@ class NMT(nn.Module):
         
     def save(self, model_path):
         params = {
-            'text': self.text,
+            'vocab': self.text.to_words(),
             'args': self.args,
-            'device': self.device,
+            'device': str(self.device),
             'state_dict': self.state_dict()
         }
         torch.save(params, model_path)
     
     @staticmethod
     def load(model_path):
-        params = torch.load(model_path, map_location=lambda storage, loc: storage)
-        model = NMT(params['text'], params['args'], params['device'])
+        try:
+            params = torch.load(model_path, map_location=lambda storage, loc: storage)
+        except pickle.UnpicklingError:
+            # checkpoints written before the vocabulary was saved as word lists pickle the Text object, only load trusted files
+            params = torch.load(model_path, map_location=lambda storage, loc: storage, weights_only=False)
+        text = Text.from_words(params['vocab']) if ('vocab' in params) else params['text']
+        model = NMT(text, params['args'], torch.device(params['device']))
         model.load_state_dict(params['state_dict'])
         return model
\ No newline at end of file
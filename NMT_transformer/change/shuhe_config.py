@@ -12,6 +12,9 @@ embed_size = 512
 # train
 cuda = True
 warm_up_step = 4000
+optimizer = "adam"
+weight_decay = 0.0
+lr_scheduler = "noam"
 train_batch_size = 16
 max_epoch = 100000
 valid_iter = 1
@@ -24,7 +27,16 @@ dropout = 0.1
 smoothing_eps = 0.05
 # dev
 dev_batch_size = 16
+# padded words per validation batch, validation runs in one length-sorted pass under inference_mode
+valid_max_tokens = 8000
+# e.g. "cpu" or "cuda:1": validate in a separate process there while training continues, None validates in place
+valid_device = None
+# only write checkpoints (on a background thread) and leave ppl/BLEU and best-K to evaluator.py
+async_evaluation = False
 model_save_path = "/home/wangshuhe/shuhelearn/ShuHeLearning/NMT_transformer/change/result/"
+# resume
+resume_model_path = None
+resume_optim_path = None
 # test
 # checkpoint
 max_tar_length = 100
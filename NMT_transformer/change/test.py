@@ -48,12 +48,8 @@ def test():
     if (config.cuda):
         model = model.to(torch.device("cuda:0"))
     predict, test_data_tar = beam_search(model, test_data, test_data_loader, 15, config.max_tar_length)
-    for i in range(len(test_data_tar)):
-        for j in range(len(test_data_tar[i])):
-            test_data_tar[i][j] = model.text.tar.id2word[test_data_tar[i][j]]
-    for i in range(len(predict)):
-        for j in range(len(predict[i])):
-            predict[i][j] = model.text.tar.id2word[predict[i][j]]
+    test_data_tar = model.text.tar.decode(test_data_tar)
+    predict = model.text.tar.decode(predict)
     bleu = corpus_bleu([[tar[1:-1]] for tar in test_data_tar], [pre for pre in predict])
     print(f"Corpus BLEU: {bleu * 100}", file=sys.stderr)
 
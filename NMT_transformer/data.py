@@ -1,6 +1,30 @@
+import os
 import utils
+import shuhe_config as config
 from torch.utils.data import Dataset
 
+def data_paths(split):
+    '''
+    split: "train", "dev" or "test"
+    return: source and target file, the ones re-numbered to the joint vocabulary when config.share_vocab is on
+    '''
+    if (not config.share_vocab):
+        return getattr(config, f"{split}_path_src"), getattr(config, f"{split}_path_tar")
+    paths = getattr(config, f"{split}_path_src_joint"), getattr(config, f"{split}_path_tar_joint")
+    for path in paths:
+        if (not os.path.exists(path)):
+            raise FileNotFoundError(f"share_vocab is on but [{path}] does not exist, re-number the {split} data with share_vocab.py --src_data/--tar_data")
+    return paths
+
+def check_vocab(data, text, name):
+    '''
+    refuse data with word ids outside the vocabulary, e.g. files still numbered for another vocabulary
+    '''
+    for side, corpus, vocab in [("source", data.src, text.src), ("target", data.tar, text.tar)]:
+        max_id = max((max(sen) for sen in corpus if (len(sen) > 0)), default=-1)
+        if (max_id >= len(vocab)):
+            raise ValueError(f"{name} {side} data has word id {max_id}, but the vocabulary has {len(vocab)} words; with share_vocab, re-number the data with share_vocab.py")
+
 class Data(Dataset):
 
     def __init__(self, src_file, tar_file):
@@ -0,0 +1,277 @@
+import math
+import torch
+import shuhe_config as config
+
+strategies = dict()
+
+def register_strategy(name):
+    def register(cls):
+        strategies[name] = cls
+        cls.name = name
+        return cls
+    return register
+
+def build_strategy(name, options):
+    return strategies[name].build(options)
+
+def add_decoding_options(parser):
+    parser.add_option("--strategy", dest="strategy", default=config.decoding_strategy, help="one of " + ", ".join(sorted(strategies)))
+    parser.add_option("--beam", dest="beam", type="int", default=config.beam_size, help="beam size of beam and diverse_beam")
+    parser.add_option("--groups", dest="groups", type="int", default=config.diverse_groups, help="beam groups of diverse_beam")
+    parser.add_option("--diversity", dest="diversity", type="float", default=config.diversity_strength, help="penalty of a word already chosen by an earlier group")
+    parser.add_option("--top_k", dest="top_k", type="int", default=config.top_k, help="sample among the k most likely words, 0 for all")
+    parser.add_option("--top_p", dest="top_p", type="float", default=config.top_p, help="sample among the most likely words covering probability p")
+    parser.add_option("--temperature", dest="temperature", type="float", default=config.temperature)
+    parser.add_option("--seed", dest="seed", type="int", default=None, help="seed of sample")
+
+def get_limits(source, max_tar_length, device):
+    '''
+    the per-sentence length limit of NMT.beam_search
+    '''
+    return torch.tensor([min(max_tar_length, int(config.max_len_a*len(sen)+config.max_len_b)) for sen in source], dtype=torch.long, device=device)
+
+def get_words(model, tokens):
+    '''
+    tokens: <start> w1 w2 ... [<end> <pad> ...], return: [w1, w2, ...]
+    '''
+    words = []
+    for word_id in tokens[1:].tolist():
+        if (word_id == model.text.tar['<end>'] or word_id == model.text.tar['<pad>']):
+            break
+        words.append(word_id)
+    return words
+
+def sample_search(model, source, max_tar_length, choose):
+    '''
+    one hypothesis per sentence, choose(log_probs) picks the next word of every row
+    a sentence leaves the batch as soon as it ends, so the batch shrinks while decoding
+    '''
+    end = model.text.tar['<end>']
+    limits = get_limits(source, max_tar_length, model.device)
+    model.search_stats['sentences'] += len(source)
+    model.search_stats['max_steps'] += len(source)*max_tar_length
+    state = model.init_decoder_state(source)
+    alive = torch.arange(len(source), device=model.device)
+    predict = [None for _ in range(len(source))]
+    step = 0
+    while (alive.shape[0] > 0):
+        step += 1
+        model.search_stats['steps'] += alive.shape[0]
+        log_probs = model.decode_step(state)
+        if (step == 1):
+            # an empty translation is never chosen, as in beam_search
+            log_probs[:, end] = -math.inf
+        words = choose(log_probs)
+        done = (words == end) | (limits[alive] <= step)
+        state = model.reorder_decoder_state(state, None, words)
+        for row in done.nonzero().flatten().tolist():
+            predict[alive[row].item()] = get_words(model, state['tokens'][row])
+        keep = (~done).nonzero().flatten()
+        if (keep.shape[0] < alive.shape[0]):
+            state = model.reorder_decoder_state(state, keep)
+            alive = alive[keep]
+    return predict
+
+def beam_core(model, source, beam, groups, diversity, max_tar_length):
+    '''
+    batched beam search over rows = sentences * beam, split into groups of beam // groups hypotheses
+    group g ranks its candidates with diversity * (times an earlier group chose the word at this step) subtracted,
+    its hypotheses keep their true scores, groups=1 is plain beam search
+    a finished hypothesis continues with <pad> at no cost, a sentence leaves the batch once all its hypotheses finished
+    return: the best hypothesis of every sentence under the config.alpha length penalty
+    '''
+    end = model.text.tar['<end>']
+    pad = model.text.tar['<pad>']
+    vocab_size = len(model.text.tar)
+    group_size = beam // groups
+    N = len(source)
+    device = model.device
+    limits = get_limits(source, max_tar_length, device)
+    model.search_stats['sentences'] += N
+    model.search_stats['max_steps'] += N*max_tar_length
+    state = model.init_decoder_state(source)
+    state = model.reorder_decoder_state(state, torch.arange(N, device=device).repeat_interleave(beam))
+    # every group starts from a single hypothesis
+    scores = torch.full((N, beam), -math.inf, device=device)
+    scores[:, ::group_size] = 0
+    finished = torch.zeros((N, beam), dtype=torch.bool, device=device)
+    lengths = torch.zeros((N, beam), device=device)
+    finished_log_probs = torch.full((vocab_size,), -math.inf, device=device)
+    finished_log_probs[pad] = 0
+    alive = torch.arange(N, device=device)
+    predict = [None for _ in range(N)]
+    step = 0
+    while (alive.shape[0] > 0):
+        step += 1
+        model.search_stats['steps'] += alive.shape[0]
+        now_N = alive.shape[0]
+        log_probs = model.decode_step(state).view(now_N, beam, vocab_size)
+        if (step == 1):
+            log_probs[:, :, end] = -math.inf
+        log_probs = torch.where(finished.unsqueeze(dim=-1), finished_log_probs, log_probs)
+        candidates = scores.unsqueeze(dim=-1) + log_probs
+        chosen = torch.zeros((now_N, vocab_size), device=device)
+        origins = []
+        words = []
+        next_scores = []
+        for g in range(groups):
+            group_candidates = candidates[:, g*group_size:(g+1)*group_size].reshape(now_N, group_size*vocab_size)
+            ranked = group_candidates
+            if (g > 0 and diversity != 0):
+                ranked = group_candidates - diversity*chosen.repeat(1, group_size)
+            index = torch.topk(ranked, group_size, dim=-1)[1]
+            origins.append(g*group_size + index // vocab_size)
+            words.append(index % vocab_size)
+            next_scores.append(group_candidates.gather(1, index))
+            chosen.scatter_add_(1, index % vocab_size, torch.ones(index.shape, device=device))
+            chosen[:, pad] = 0
+        origin = torch.cat(origins, dim=1)
+        word = torch.cat(words, dim=1)
+        scores = torch.cat(next_scores, dim=1)
+        was_finished = finished.gather(1, origin)
+        lengths = lengths.gather(1, origin) + (~was_finished & (word != end)).float()
+        finished = was_finished | (word == end) | (limits[alive] <= step).unsqueeze(dim=-1)
+        rows = (torch.arange(now_N, device=device)*beam).unsqueeze(dim=-1) + origin
+        state = model.reorder_decoder_state(state, rows.flatten(), word.flatten())
+        done = finished.all(dim=1)
+        if (done.any()):
+            best = (scores / lengths.clamp(min=1).pow(config.alpha)).argmax(dim=1)
+            for sent in done.nonzero().flatten().tolist():
+                predict[alive[sent].item()] = get_words(model, state['tokens'][sent*beam+best[sent].item()])
+            keep = (~done).nonzero().flatten()
+            state = model.reorder_decoder_state(state, ((keep*beam).unsqueeze(dim=-1) + torch.arange(beam, device=device)).flatten())
+            scores = scores[keep]
+            finished = finished[keep]
+            lengths = lengths[keep]
+            alive = alive[keep]
+    return predict
+
+class Strategy(object):
+    '''
+    a decoding strategy: search returns one translation (list of word ids) per source sentence
+    deterministic: the same model and source always give the same output, so outputs may be cached
+    '''
+    deterministic = True
+    supports_shortlist = False
+
+    @classmethod
+    def build(cls, options):
+        raise NotImplementedError
+
+    def search(self, model, source, max_tar_length, shortlist=None):
+        raise NotImplementedError
+
+    def size(self):
+        '''
+        hypotheses kept per sentence
+        '''
+        return 1
+
+    def key(self):
+        '''
+        what tells two configurations of the strategy apart in a translation cache
+        '''
+        return self.name
+
+@register_strategy("beam")
+class BeamSearch(Strategy):
+    '''
+    NMT.beam_search, with early stop and shortlist support
+    '''
+    supports_shortlist = True
+
+    def __init__(self, beam):
+        self.beam = beam
+
+    @classmethod
+    def build(cls, options):
+        return cls(options.beam)
+
+    def search(self, model, source, max_tar_length, shortlist=None):
+        return model.beam_search(source, self.beam, max_tar_length, len(source), shortlist)
+
+    def size(self):
+        return self.beam
+
+    def key(self):
+        # the key translation caches used before there were strategies
+        return ""
+
+@register_strategy("diverse_beam")
+class DiverseBeamSearch(Strategy):
+    '''
+    diverse beam search (Vijayakumar et al., 2016) with the Hamming diversity penalty
+    '''
+    def __init__(self, beam, groups, diversity):
+        if (beam % groups != 0):
+            raise ValueError(f"beam {beam} is not a multiple of groups {groups}")
+        self.beam = beam
+        self.groups = groups
+        self.diversity = diversity
+
+    @classmethod
+    def build(cls, options):
+        return cls(options.beam, options.groups, options.diversity)
+
+    def search(self, model, source, max_tar_length, shortlist=None):
+        return beam_core(model, source, self.beam, self.groups, self.diversity, max_tar_length)
+
+    def size(self):
+        return self.beam
+
+    def key(self):
+        return f"{self.name}|{self.groups}|{self.diversity}"
+
+@register_strategy("greedy")
+class GreedySearch(Strategy):
+
+    @classmethod
+    def build(cls, options):
+        return cls()
+
+    def search(self, model, source, max_tar_length, shortlist=None):
+        return sample_search(model, source, max_tar_length, lambda log_probs: log_probs.argmax(dim=-1))
+
+@register_strategy("sample")
+class Sampling(Strategy):
+    '''
+    ancestral sampling from the temperature scaled distribution, restricted to the top_k words (0: no limit)
+    and to the smallest set of words whose probability reaches top_p (1: no limit)
+    '''
+    # even with a seed a draw depends on the sentences sampled before it, so samples are never cached
+    deterministic = False
+
+    def __init__(self, top_k, top_p, temperature, seed=None):
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = temperature
+        self.seed = seed
+        self.generator = None
+
+    @classmethod
+    def build(cls, options):
+        return cls(options.top_k, options.top_p, options.temperature, options.seed)
+
+    def choose(self, log_probs):
+        if (self.generator is None or self.generator.device != log_probs.device):
+            self.generator = torch.Generator(device=log_probs.device)
+            if (self.seed is not None):
+                self.generator.manual_seed(self.seed)
+        logits = log_probs / self.temperature
+        if (self.top_k > 0):
+            kth = torch.topk(logits, min(self.top_k, logits.shape[-1]), dim=-1)[0][:, -1:]
+            logits = logits.masked_fill(logits < kth, -math.inf)
+        if (self.top_p < 1):
+            sorted_logits, sorted_index = torch.sort(logits, dim=-1, descending=True)
+            sorted_probs = torch.softmax(sorted_logits, dim=-1)
+            # drop a word once the more likely words already cover top_p, the most likely word always stays
+            drop = (sorted_probs.cumsum(dim=-1) - sorted_probs) >= self.top_p
+            sorted_logits = sorted_logits.masked_fill(drop, -math.inf)
+            logits = torch.full_like(logits, -math.inf).scatter(-1, sorted_index, sorted_logits)
+        return torch.multinomial(torch.softmax(logits, dim=-1), 1, generator=self.generator).squeeze(dim=-1)
+
+    def search(self, model, source, max_tar_length, shortlist=None):
+        return sample_search(model, source, max_tar_length, self.choose)
+
+    def key(self):
+        return f"{self.name}|{self.top_k}|{self.top_p}|{self.temperature}|{self.seed}"
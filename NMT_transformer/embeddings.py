@@ -6,5 +6,9 @@ class Embeddings(nn.Module):
         super(Embeddings, self).__init__()
         self.embed_size = embed_size
         self.src = nn.Embedding(num_embeddings=len(text.src), embedding_dim=self.embed_size, padding_idx=text.src['<pad>'])
-        self.tar = nn.Embedding(num_embeddings=len(text.tar), embedding_dim=self.embed_size, padding_idx=text.tar['<pad>'])
+        if (text.is_joint()):
+            # source embedding = target embedding = output projection
+            self.tar = self.src
+        else:
+            self.tar = nn.Embedding(num_embeddings=len(text.tar), embedding_dim=self.embed_size, padding_idx=text.tar['<pad>'])
         
\ No newline at end of file
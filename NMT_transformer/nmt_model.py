@@ -1,9 +1,26 @@
+import pickle
 import torch
 import torch.nn as nn
 import math
+from collections import Counter
+from torch.utils.checkpoint import checkpoint
 import shuhe_config as config
+from vocab import Text
 from embeddings import Embeddings
 
+def backtrack(tokens, backpointers, level, row):
+    '''
+    tokens, backpointers: lists of beam_search, level: length of the hypothesis, row: its row at that level
+    return: the words of the hypothesis, following the backpointers from its last word to <start>
+    '''
+    words = []
+    while (level > 0):
+        words.append(tokens[level][row])
+        row = backpointers[level][row]
+        level -= 1
+    words.reverse()
+    return words
+
 class NMT(nn.Module):
 
     def __init__(self, text, args, device):
@@ -23,12 +40,28 @@ class NMT(nn.Module):
         self.dropout = nn.Dropout(args['dropout'])
         self.project_value = math.pow(args['d_model'], 0.5)
         self.eps = args['smoothing_eps']
+        # steps / early stops / length limits of beam_search, reported by test.py
+        self.search_stats = Counter()
 
     def forward(self, source, target, smoothing=False):
+        output, target_tensor = self.hidden(source, target)
+        return self.score(output, target_tensor, smoothing)
+
+    def hidden(self, source, target):
+        '''
+        return: decoder output (tar_len * batch_size * d_model) and the padded target tensor, everything before the projection
+        '''
         source_tensor = self.text.src.word2tensor(source, self.device)
         target_tensor = self.text.tar.word2tensor(target, self.device)
         memory, memory_padding_mask = self.encode(source_tensor)
-        output = self.decode(memory, memory_padding_mask, target_tensor)
+        return self.decode(memory, memory_padding_mask, target_tensor), target_tensor
+
+    def score(self, output, target_tensor, smoothing=False):
+        '''
+        return: batch_size, per-sentence log-likelihood from the output of hidden: projection, log_softmax and gather
+        '''
+        if (config.loss_chunk_size is not None):
+            return self.chunked_score(output, target_tensor, smoothing)
         output_mask = (target_tensor != self.text.tar['<pad>']).float()
         if (smoothing):
             P = nn.functional.log_softmax(self.project(output), dim=-1)
@@ -43,13 +76,59 @@ class NMT(nn.Module):
             score = torch.gather(P, index=target_tensor[1:].unsqueeze(dim=-1), dim=-1).squeeze(dim=-1) * output_mask[1:]
         return score.sum(dim=0)
 
+    def chunk_score(self, output, target, mask, smoothing):
+        '''
+        output: chunk_len * batch_size * d_model
+        target: chunk_len * batch_size, the word each position predicts
+        return: batch_size, (label smoothed) log-likelihood summed over the chunk
+        '''
+        P = nn.functional.log_softmax(self.project(output), dim=-1)
+        score = torch.gather(P, index=target.unsqueeze(dim=-1), dim=-1).squeeze(dim=-1)
+        if (smoothing):
+            # the smoothed target puts 1-eps on the gold word and eps/(V-1) on every other word
+            score = self.eps/(P.shape[-1]-1)*(P.sum(dim=-1)-score) + (1-self.eps)*score
+        return (score*mask).sum(dim=0)
+
+    def chunked_score(self, output, target_tensor, smoothing):
+        '''
+        same value as the dense path of forward, but logits exist for config.loss_chunk_size positions at a time
+        in training every chunk is recomputed in backward, so the T * batch_size * V logits are never stored
+        '''
+        # position t predicts word t+1, the last position predicts nothing
+        output = output[:-1]
+        target = target_tensor[1:]
+        if (smoothing):
+            mask = ((target_tensor != self.text.tar['<pad>']) & (target_tensor != self.text.tar['<end>']))[:-1].float()
+        else:
+            mask = (target != self.text.tar['<pad>']).float()
+        score = 0
+        for start in range(0, target.shape[0], config.loss_chunk_size):
+            end = start + config.loss_chunk_size
+            if (torch.is_grad_enabled()):
+                score = score + checkpoint(self.chunk_score, output[start:end], target[start:end], mask[start:end], smoothing, use_reentrant=False)
+            else:
+                score = score + self.chunk_score(output[start:end], target[start:end], mask[start:end], smoothing)
+        return score
+
+    def checkpoint_activations(self):
+        '''
+        keep only every layer's input during training and recompute the layer in backward
+        '''
+        return self.training and self.args.get('checkpoint_activations', False)
+
     def encode(self, source_tensor):
         S = source_tensor.shape[0]
         N = source_tensor.shape[1]
         source_padding_mask = (source_tensor == self.text.src['<pad>']).bool().t()
         source_padding_mask = source_padding_mask.to(self.device)
         source_embed_tensor = self.dropout(self.Embeddings.src(source_tensor).to(self.device)*self.project_value+self.get_position(S, N))
-        output = self.encoder(source_embed_tensor, src_key_padding_mask=source_padding_mask)
+        if (self.checkpoint_activations()):
+            output = source_embed_tensor
+            for layer in self.encoder.layers:
+                output = checkpoint(layer, output, src_key_padding_mask=source_padding_mask, use_reentrant=False)
+            output = self.encoder.norm(output)
+        else:
+            output = self.encoder(source_embed_tensor, src_key_padding_mask=source_padding_mask)
         # output: sen_len * batch_size * feature_size
         # source_padding_mask: batch_size * sen_len
         return output, source_padding_mask
@@ -66,7 +145,13 @@ class NMT(nn.Module):
         target_padding_mask = (target_tensor == self.text.tar['<pad>']).bool().t()
         target_padding_mask = target_padding_mask.to(self.device)
         target_embed_tensor = self.dropout(self.Embeddings.tar(target_tensor).to(self.device)*self.project_value+self.get_position(T, N))
-        output = self.decoder(target_embed_tensor, memory, tgt_mask=target_mask, tgt_key_padding_mask=target_padding_mask, memory_key_padding_mask=memory_padding_mask)
+        if (self.checkpoint_activations()):
+            output = target_embed_tensor
+            for layer in self.decoder.layers:
+                output = checkpoint(layer, output, memory, tgt_mask=target_mask, tgt_key_padding_mask=target_padding_mask, memory_key_padding_mask=memory_padding_mask, use_reentrant=False)
+            output = self.decoder.norm(output)
+        else:
+            output = self.decoder(target_embed_tensor, memory, tgt_mask=target_mask, tgt_key_padding_mask=target_padding_mask, memory_key_padding_mask=memory_padding_mask)
         # output: sen_len * batch_size * feature
         return output
 
@@ -85,7 +170,40 @@ class NMT(nn.Module):
         pre_PE = pre_PE.expand(pre_PE.shape[0], batch_size, pre_PE.shape[2])
         return pre_PE
 
-    def beam_search(self, source, search_size, max_tar_length, batch_size):
+    def init_decoder_state(self, source):
+        '''
+        source: list[list[int]]
+        return: state of a batch of hypotheses, one per sentence, holding only <start>
+        memory: sen_len * rows * feature, memory_padding: rows * sen_len, tokens: rows * length
+        '''
+        source_tensor = self.text.src.word2tensor(source, self.device)
+        memory, memory_padding = self.encode(source_tensor)
+        tokens = torch.full((len(source), 1), self.text.tar['<start>'], dtype=torch.long, device=self.device)
+        return {'memory': memory, 'memory_padding': memory_padding, 'tokens': tokens}
+
+    def decode_step(self, state):
+        '''
+        return: rows * tar_vocab, log-probabilities of the next word of every hypothesis in state
+        no key/value cache: the decoder runs over the whole prefix in state['tokens'] every step and only the last position is kept,
+        so a step costs O(prefix length) and a sentence O(length^2)
+        '''
+        output = self.decode(state['memory'], state['memory_padding'], state['tokens'].t())[-1]
+        return nn.functional.log_softmax(self.project(output), dim=-1)
+
+    def reorder_decoder_state(self, state, index, words=None):
+        '''
+        index: rows of state the new hypotheses continue, None: every row continues itself (nothing is copied)
+        words: the word each of them appends
+        '''
+        if (index is None):
+            state = dict(state)
+        else:
+            state = {'memory': state['memory'].index_select(1, index), 'memory_padding': state['memory_padding'].index_select(0, index), 'tokens': state['tokens'].index_select(0, index)}
+        if (words is not None):
+            state['tokens'] = torch.cat((state['tokens'], words.unsqueeze(dim=-1)), dim=-1)
+        return state
+
+    def beam_search(self, source, search_size, max_tar_length, batch_size, shortlist=None):
         '''
         source_tensor = self.text.src.word2tensor(source, self.device)
         now_source_tensor = source_tensor
@@ -132,40 +250,61 @@ class NMT(nn.Module):
             now_predict = next_predict.copy()
         return predict
         '''
+        vocab_size = len(self.text.tar)
+        project_weight = self.project.weight
+        candidates = None
+        if (shortlist is not None):
+            # only score the target words the shortlist allows for this batch
+            candidates = shortlist(source, self.device)
+            project_weight = project_weight[candidates]
+            vocab_size = candidates.shape[0]
+            candidates = candidates.tolist()
+        # no hypothesis of a sentence grows past a * source length + b
+        limits = [min(max_tar_length, int(config.max_len_a*len(sen)+config.max_len_b)) for sen in source]
+        self.search_stats['sentences'] += batch_size
+        self.search_stats['max_steps'] += batch_size*max_tar_length
         source_tensor = self.text.src.word2tensor(source, self.device)
         memory, memory_padding = self.encode(source_tensor)
         now_memory = memory
         now_memory_padding = memory_padding
-        now_predict = [[0] for _ in range(batch_size)]
+        # hypotheses are stored as word and backpointer (row one level up) per level and row, no prefix is ever copied
+        tokens = torch.full((max(limits)+1, batch_size*search_size), self.text.tar['<pad>'], dtype=torch.long)
+        backpointers = torch.zeros((max(limits)+1, batch_size*search_size), dtype=torch.long)
+        tokens[0, :batch_size] = self.text.tar['<start>']
+        now_predict_tensor = torch.full((1, batch_size), self.text.tar['<start>'], dtype=torch.long, device=self.device)
+        # finished hypotheses: (normalized score, level, row, last word or None)
         predict = [[] for _ in range(batch_size)]
         now_predict_length = 0
         now_score = torch.zeros(batch_size, dtype=torch.float, device=self.device).reshape(batch_size, 1)
         batch_index = [(i, 1) for i in range(batch_size)]
-        while (now_predict_length < max_tar_length):
+        while (now_predict_length < max(limits)):
             now_predict_length += 1
-            now_predict_tensor = self.text.tar.word2tensor(now_predict, self.device)
+            self.search_stats['steps'] += len(batch_index)
             output = self.decode(now_memory, now_memory_padding, now_predict_tensor)[-1]
-            P = (nn.functional.log_softmax(self.project(output), dim=-1)+now_score).reshape(output.shape[0]*len(self.text.tar))
+            P = (nn.functional.log_softmax(nn.functional.linear(output, project_weight), dim=-1)+now_score).reshape(output.shape[0]*vocab_size)
             now_memory = memory.permute(1, 0, 2)
             now_memory_padding = memory_padding
             next_memory = None
             next_memory_padding = None
             next_batch_index = []
             now_start = 0
-            next_predict = []
+            next_words = []
+            next_parents = []
             next_score = []
             flag = False
             for key, value in batch_index:
-                score, topk_index = torch.topk(P[len(self.text.tar)*now_start:len(self.text.tar)*(value+now_start)], search_size)
+                score, topk_index = torch.topk(P[vocab_size*now_start:vocab_size*(value+now_start)], search_size)
                 next_value = 0
                 now_flag = False
                 for i in range(search_size):
-                    next_word_id = topk_index[i].item() % len(self.text.tar)
-                    sent_id = topk_index[i].item() // len(self.text.tar)
+                    next_word_id = topk_index[i].item() % vocab_size
+                    sent_id = topk_index[i].item() // vocab_size
+                    if (candidates is not None):
+                        next_word_id = candidates[next_word_id]
                     if (next_word_id == self.text.tar['<end>']):
-                        if (len(now_predict[now_start+sent_id][1:]) == 0):
+                        if (now_predict_length == 1):
                             continue
-                        predict[key].append(((score[i].item()-now_score[now_start][0].item())/math.pow(len(now_predict[now_start+sent_id][1:]), config.alpha), now_predict[now_start+sent_id][1:].copy()))
+                        predict[key].append((score[i].item()/math.pow(now_predict_length-1, config.alpha), now_predict_length-1, now_start+sent_id, None))
                         if (len(predict[key]) == search_size):
                             now_flag = True
                             break
@@ -173,21 +312,30 @@ class NMT(nn.Module):
                 now_start += value
                 if (now_flag):
                     continue
+                if (len(predict[key]) > 0 and now_predict_length < limits[key]):
+                    # a live score only drops, and at most limits[key] words divide it, so nothing live can beat the best finished one
+                    live = [score[i].item() for i in range(search_size) if ((topk_index[i].item() % vocab_size if (candidates is None) else candidates[topk_index[i].item() % vocab_size]) != self.text.tar['<end>'])]
+                    if (len(live) == 0 or max(record[0] for record in predict[key]) >= max(live)/math.pow(limits[key], config.alpha)):
+                        self.search_stats['early_stop'] += 1
+                        continue
+                if (now_predict_length == limits[key] and limits[key] < max_tar_length):
+                    self.search_stats['length_limit'] += 1
                 for i in range(search_size):
-                    next_word_id = topk_index[i].item() % len(self.text.tar)
-                    sent_id = topk_index[i].item() // len(self.text.tar)
+                    next_word_id = topk_index[i].item() % vocab_size
+                    sent_id = topk_index[i].item() // vocab_size
+                    if (candidates is not None):
+                        next_word_id = candidates[next_word_id]
                     if (next_word_id == self.text.tar['<end>']):
                         continue
-                    if (now_predict_length == max_tar_length):
-                        predict[key].append((score[i].item()/math.pow(len(now_predict[now_start-value+sent_id][1:])+1, config.alpha), now_predict[now_start-value+sent_id][1:].copy()))
-                        predict[key][-1][1].append(next_word_id)
+                    if (now_predict_length == limits[key]):
+                        predict[key].append((score[i].item()/math.pow(now_predict_length, config.alpha), now_predict_length-1, now_start-value+sent_id, next_word_id))
                         if (len(predict[key]) == search_size):
                             now_flag = True
                             break
                         continue
                     next_value += 1
-                    next_predict.append(now_predict[now_start-value+sent_id].copy())
-                    next_predict[-1].append(next_word_id)
+                    next_words.append(next_word_id)
+                    next_parents.append(now_start-value+sent_id)
                     next_score.append(score[i].item())
                     if (next_memory is None):
                         next_memory = now_memory[key].unsqueeze(dim=0)
@@ -195,7 +343,7 @@ class NMT(nn.Module):
                     else:
                         next_memory = torch.cat((next_memory, now_memory[key].unsqueeze(dim=0)), dim=0)
                         next_memory_padding = torch.cat((next_memory_padding, now_memory_padding[key].unsqueeze(dim=0)), dim=0)
-                if (now_flag):
+                if (now_flag or next_value == 0):
                     continue
                 flag = True
                 next_batch_index.append((key, next_value))
@@ -204,26 +352,45 @@ class NMT(nn.Module):
             now_score = torch.tensor(next_score, dtype=torch.float, device=self.device).reshape(-1, 1)
             now_memory = next_memory.permute(1, 0, 2)
             now_memory_padding = next_memory_padding
-            now_predict = next_predict
+            tokens[now_predict_length, :len(next_words)] = torch.tensor(next_words, dtype=torch.long)
+            backpointers[now_predict_length, :len(next_words)] = torch.tensor(next_parents, dtype=torch.long)
+            next_words = torch.tensor(next_words, dtype=torch.long, device=self.device)
+            next_parents = torch.tensor(next_parents, dtype=torch.long, device=self.device)
+            now_predict_tensor = torch.cat((now_predict_tensor.index_select(1, next_parents), next_words.unsqueeze(dim=0)), dim=0)
             batch_index = next_batch_index
+        # the only conversion to lists, then every sentence backtracks its best hypothesis
+        tokens = tokens.tolist()
+        backpointers = backpointers.tolist()
         output = []
         for sub in predict:
-            sub = sorted(sub, key=lambda sc: sc[0], reverse=True)
-            output.append(sub[0][1])
+            if (len(sub) == 0):
+                # only <end> at the first step, which is never taken as an empty translation
+                output.append([])
+                continue
+            _, level, row, last_word = max(sub, key=lambda record: record[0])
+            words = backtrack(tokens, backpointers, level, row)
+            if (last_word is not None):
+                words.append(last_word)
+            output.append(words)
         return output
         
     def save(self, model_path):
         params = {
-            'text': self.text,
+            'vocab': self.text.to_words(),
             'args': self.args,
-            'device': self.device,
+            'device': str(self.device),
             'state_dict': self.state_dict()
         }
         torch.save(params, model_path)
     
     @staticmethod
     def load(model_path):
-        params = torch.load(model_path, map_location=lambda storage, loc: storage)
-        model = NMT(params['text'], params['args'], params['device'])
+        try:
+            params = torch.load(model_path, map_location=lambda storage, loc: storage)
+        except pickle.UnpicklingError:
+            # checkpoints written before the vocabulary was saved as word lists pickle the Text object, only load trusted files
+            params = torch.load(model_path, map_location=lambda storage, loc: storage, weights_only=False)
+        text = Text.from_words(params['vocab']) if ('vocab' in params) else params['text']
+        model = NMT(text, params['args'], torch.device(params['device']))
         model.load_state_dict(params['state_dict'])
         return model
\ No newline at end of file
@@ -0,0 +1,65 @@
+import os
+import time
+from collections import Counter
+import torch
+import torch.multiprocessing as mp
+from nmt_model import NMT
+from shortlist import Shortlist
+
+def make_shards(sources, workers):
+    '''
+    return: workers index lists, sentences dealt out longest first, so every shard gets a similar amount of decoding
+    '''
+    order = sorted(range(len(sources)), key=lambda i: len(sources[i]), reverse=True)
+    return [order[i::workers] for i in range(workers)]
+
+def _translate_shard(model_path, device, threads, strategy, sources, batch_size, max_tar_length, shortlist_path):
+    '''
+    runs in a worker process with its own copy of the model
+    return: predictions in the order of sources, search stats, seconds spent decoding
+    '''
+    torch.set_num_threads(threads)
+    device = torch.device(device)
+    model = NMT.load(model_path)
+    model.device = device
+    model = model.to(device)
+    model.eval()
+    shortlist = Shortlist.load(shortlist_path) if (shortlist_path is not None) else None
+    order = sorted(range(len(sources)), key=lambda i: len(sources[i]))
+    predict = [None for _ in range(len(sources))]
+    start = time.perf_counter()
+    with torch.no_grad():
+        for begin in range(0, len(order), batch_size):
+            batch = order[begin:begin+batch_size]
+            output = strategy.search(model, [sources[i].copy() for i in batch], max_tar_length, shortlist)
+            for i, sub in zip(batch, output):
+                predict[i] = sub
+    if (device.type == "cuda"):
+        torch.cuda.synchronize(device)
+    return predict, model.search_stats, time.perf_counter() - start
+
+def sharded_translate(model_path, sources, strategy, workers, devices=None, batch_size=50, max_tar_length=100, shortlist_path=None, threads=None):
+    '''
+    translate sources with workers processes, each loading the checkpoint on its own device
+    devices: list of device names dealt to the workers in turn, default all on the CPU
+    threads: torch threads per worker, default the CPU cores split evenly between the workers
+    return: predictions in the order of sources, summed search stats, decoding seconds of every worker
+    '''
+    if (devices is None or len(devices) == 0):
+        devices = ["cpu"]
+    if (threads is None):
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    shards = make_shards(sources, workers)
+    tasks = [(model_path, devices[i % len(devices)], threads, strategy, [sources[j] for j in shard], batch_size, max_tar_length, shortlist_path) for i, shard in enumerate(shards)]
+    # spawn: a forked child would inherit the parent's CUDA context and torch thread pool
+    with mp.get_context("spawn").Pool(workers) as pool:
+        results = pool.starmap(_translate_shard, tasks)
+    predict = [None for _ in range(len(sources))]
+    stats = Counter()
+    seconds = []
+    for shard, (shard_predict, shard_stats, cost) in zip(shards, results):
+        for i, sub in zip(shard, shard_predict):
+            predict[i] = sub
+        stats.update(shard_stats)
+        seconds.append(cost)
+    return predict, stats, seconds
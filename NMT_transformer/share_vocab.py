@@ -0,0 +1,76 @@
+import torch
+import sys
+from optparse import OptionParser
+import shuhe_config as config
+import utils
+from vocab import Text
+from nmt_model import NMT
+
+def build_joint_corpus(src_file, tar_file, corpus_file):
+    '''
+    same layout as pre_data.py: special words first, then source words, then target words not seen yet
+    '''
+    words = dict()
+    for path in [src_file, tar_file]:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if (line not in words):
+                    words[line] = len(words)
+    with open(corpus_file, "w") as f:
+        for word in words:
+            f.write(word+'\n')
+
+def convert_model(model, text):
+    '''
+    copy a model with separate source/target embeddings into the three-way-tied layout over text
+    a word known to both old vocabularies starts from the average of its two rows
+    '''
+    new_model = NMT(text, model.args, model.device)
+    state_dict = model.state_dict()
+    src_weight = state_dict['Embeddings.src.weight']
+    tar_weight = state_dict['Embeddings.tar.weight']
+    weight = torch.zeros(len(text.src), src_weight.shape[1], dtype=src_weight.dtype)
+    count = torch.zeros(len(text.src), 1, dtype=src_weight.dtype)
+    for old_vocab, old_weight in [(model.text.src, src_weight), (model.text.tar, tar_weight)]:
+        for word, word_id in old_vocab.word2id.items():
+            weight[text.src[word]] += old_weight[word_id]
+            count[text.src[word]] += 1
+    weight = weight / count.clamp(min=1)
+    for key in ['Embeddings.src.weight', 'Embeddings.tar.weight', 'project.weight']:
+        state_dict[key] = weight
+    new_model.load_state_dict(state_dict)
+    return new_model
+
+def convert_corpus(old_vocab, new_vocab, in_file, out_file):
+    corpus = utils.read_corpus(in_file)
+    with open(out_file, "w") as f:
+        for sen in new_vocab.encode(old_vocab.decode(corpus)):
+            f.write(" ".join(str(word_id) for word_id in sen.tolist())+'\n')
+
+def main():
+    parser = OptionParser(usage="%prog [options] old_checkpoint new_checkpoint")
+    parser.add_option("--build_corpus", dest="build_corpus", action="store_true", default=False, help="merge config.src_corpus and config.tar_corpus into config.corpus")
+    parser.add_option("--src_data", dest="src_data", action="append", default=[], help="source side data file to re-number, written to <file>.joint")
+    parser.add_option("--tar_data", dest="tar_data", action="append", default=[], help="target side data file to re-number, written to <file>.joint")
+    (options, args) = parser.parse_args()
+    if (len(args) != 2):
+        parser.error("need old_checkpoint and new_checkpoint")
+    if (options.build_corpus):
+        print(f"build joint vocabulary [{config.corpus}]", file=sys.stderr)
+        build_joint_corpus(config.src_corpus, config.tar_corpus, config.corpus)
+    text = Text(config.corpus)
+    model = NMT.load(args[0])
+    if (model.text.is_joint()):
+        print(f"[{args[0]}] already shares its vocabulary", file=sys.stderr)
+        return
+    new_model = convert_model(model, text)
+    print(f"{sum(p.numel() for p in model.parameters())} -> {sum(p.numel() for p in new_model.parameters())} parameters, save to [{args[1]}]", file=sys.stderr)
+    new_model.save(args[1])
+    for old_vocab, files in [(model.text.src, options.src_data), (model.text.tar, options.tar_data)]:
+        for path in files:
+            print(f"re-number [{path}]", file=sys.stderr)
+            convert_corpus(old_vocab, text.src, path, path+".joint")
+
+if __name__ == '__main__':
+    main()
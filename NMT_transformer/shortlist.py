@@ -0,0 +1,74 @@
+import torch
+import sys
+from collections import Counter
+import shuhe_config as config
+import utils
+from vocab import Text
+from data import data_paths
+
+class Shortlist(object):
+    '''
+    lexical shortlist: source word id -> candidate target word ids
+    '''
+    def __init__(self, candidates, frequent):
+        self.candidates = candidates
+        self.frequent = frequent
+
+    def __call__(self, source, device):
+        '''
+        source: list[list[int]]
+        return: sorted target word ids allowed for this batch
+        '''
+        words = set(self.frequent)
+        for sen in source:
+            for word_id in sen:
+                words.update(self.candidates.get(word_id, ()))
+        return torch.tensor(sorted(words), dtype=torch.long, device=device)
+
+    def save(self, path):
+        params = {
+            'candidates': self.candidates,
+            'frequent': self.frequent
+        }
+        torch.save(params, path)
+
+    @staticmethod
+    def load(path):
+        params = torch.load(path)
+        return Shortlist(params['candidates'], params['frequent'])
+
+def build_shortlist(src_file, tar_file, top_k, frequent_num, special):
+    '''
+    rank target words for every source word by the dice coefficient of their sentence co-occurrence
+    special: target ids which must always be predictable, e.g. <end> and <unk>
+    '''
+    src_count = Counter()
+    tar_count = Counter()
+    co_count = dict()
+    for src_sen, tar_sen in zip(utils.read_corpus(src_file), utils.read_corpus(tar_file)):
+        src_sen = set(src_sen)
+        tar_sen = set(tar_sen)
+        src_count.update(src_sen)
+        tar_count.update(tar_sen)
+        for src_word in src_sen:
+            if (src_word not in co_count):
+                co_count[src_word] = Counter()
+            co_count[src_word].update(tar_sen)
+    candidates = dict()
+    for src_word, counter in co_count.items():
+        dice = [(2*cnt/(src_count[src_word]+tar_count[tar_word]), tar_word) for tar_word, cnt in counter.items()]
+        dice.sort(reverse=True)
+        candidates[src_word] = [tar_word for _, tar_word in dice[:top_k]]
+    frequent = list(special) + [tar_word for tar_word, _ in tar_count.most_common(frequent_num)]
+    return Shortlist(candidates, sorted(set(frequent)))
+
+def main():
+    text = Text(config.corpus) if config.share_vocab else Text(config.src_corpus, config.tar_corpus)
+    train_path_src, train_path_tar = data_paths("train")
+    print(f"build shortlist from [{train_path_src}], [{train_path_tar}]", file=sys.stderr)
+    shortlist = build_shortlist(train_path_src, train_path_tar, config.shortlist_top_k, config.shortlist_frequent, [text.tar['<end>'], text.tar['<unk>']])
+    print(f"save shortlist to [{config.shortlist_path}]", file=sys.stderr)
+    shortlist.save(config.shortlist_path)
+
+if __name__ == '__main__':
+    main()
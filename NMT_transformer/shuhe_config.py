@@ -4,16 +4,28 @@ dev_path_src = "/data/wangshuhe/learn/process_data/wmt14en2de/wmt17_en_de/prepro
 dev_path_tar = "/data/wangshuhe/learn/process_data/wmt14en2de/wmt17_en_de/preprocess/only_de_valid.txt"
 test_path_src = "/data/wangshuhe/learn/process_data/wmt14en2de/wmt17_en_de/preprocess/only_en_test.txt"
 test_path_tar = "/data/wangshuhe/learn/process_data/wmt14en2de/wmt17_en_de/preprocess/only_de_test.txt"
-#corpus = "/data/wangshuhe/learn/process_data/shuhe/corpus.txt"
+corpus = "/data/wangshuhe/learn/process_data/wmt14en2de/wmt17_en_de/preprocess/corpus_joint.txt"
 src_corpus = "/data/wangshuhe/learn/process_data/wmt14en2de/wmt17_en_de/preprocess/corpus_en.txt"
 tar_corpus = "/data/wangshuhe/learn/process_data/wmt14en2de/wmt17_en_de/preprocess/corpus_de.txt"
 
 embed_size = 512
+# share one embedding over the joint vocabulary in config.corpus for source, target and output projection
+share_vocab = False
+# the data re-numbered to the joint vocabulary (share_vocab.py --src_data/--tar_data), read instead when share_vocab is on
+train_path_src_joint = train_path_src + ".joint"
+train_path_tar_joint = train_path_tar + ".joint"
+dev_path_src_joint = dev_path_src + ".joint"
+dev_path_tar_joint = dev_path_tar + ".joint"
+test_path_src_joint = test_path_src + ".joint"
+test_path_tar_joint = test_path_tar + ".joint"
 # train
 cuda = True
 warm_up_step = 4000
 lr = 3e-4
 init_lr = 1e-7
+optimizer = "adam"
+weight_decay = 0.0
+lr_scheduler = "noam"
 train_batch_size = 16
 max_epoch = 100000
 valid_iter = 1
@@ -24,12 +36,48 @@ num_decoder_layers = 6
 dim_feedforward = 2048
 dropout = 0.1
 smoothing_eps = 0.1
+# recompute each encoder/decoder layer in backward instead of storing its activations
+checkpoint_activations = False
+# target positions per output projection / loss chunk (e.g. 16), None for the dense T * batch_size * V logits
+loss_chunk_size = None
 # dev
 dev_batch_size = 16
+# padded words per validation batch, validation runs in one length-sorted pass under inference_mode
+valid_max_tokens = 8000
+# e.g. "cpu" or "cuda:1": validate in a separate process there while training continues, None validates in place
+valid_device = None
+# only write checkpoints (on a background thread) and leave ppl/BLEU and best-K to evaluator.py
+async_evaluation = False
 model_save_path = "/home/wangshuhe/shuhelearn/ShuHeLearning/NMT_transformer/result/"
+# resume
+resume_model_path = None
+resume_optim_path = None
 # test
 # checkpoint
 max_tar_length = 100
+# beam search stops a sentence at min(max_tar_length, max_len_a * source length + max_len_b) words
+max_len_a = 1.2
+max_len_b = 10
 test_batch_size = 50
 num_threads = 8
-alpha = 0.7
\ No newline at end of file
+alpha = 0.7
+# decoding strategy of test.py: beam, diverse_beam, greedy or sample (see decoding.py)
+decoding_strategy = "beam"
+beam_size = 15
+diverse_groups = 5
+diversity_strength = 0.5
+top_k = 0
+top_p = 0.9
+temperature = 1.0
+# shortlist
+shortlist_path = "/data/wangshuhe/learn/process_data/wmt14en2de/wmt17_en_de/preprocess/shortlist.pth"
+shortlist_top_k = 50
+shortlist_frequent = 1000
+# translation cache, None to always decode
+translation_cache_path = "/home/wangshuhe/shuhelearn/ShuHeLearning/NMT_transformer/result/translation_cache.sqlite"
+# rows kept across all checkpoints, the least recently used are evicted when the cache is opened
+translation_cache_max_rows = 2000000
+# bpe
+bpe_codes = "/data/wangshuhe/learn/process_data/wmt14en2de/wmt17_en_de/preprocess/bpe.codes"
+bpe_merges = 32000
+bpe_workers = 8
@@ -7,12 +7,33 @@ import os
 from nltk.translate.bleu_score import corpus_bleu
 import math
 from torch.utils.data import DataLoader
-from data import Data
+from data import Data, data_paths
 import utils
+import time
+from collections import Counter
+from shortlist import Shortlist
+from translation_cache import TranslationCache
+from optparse import OptionParser
+from decoding import add_decoding_options, build_strategy
+from sharded import sharded_translate
 
-os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+def cached_search(model, strategy, src, max_tar_length, shortlist=None, cache=None):
+    '''
+    only the sentences missing from cache go through the decoding strategy
+    '''
+    if (cache is None):
+        return strategy.search(model, src, max_tar_length, shortlist)
+    predict = cache.get(src)
+    miss = [i for i in range(len(src)) if predict[i] is None]
+    if (len(miss) > 0):
+        miss_src = [src[i] for i in miss]
+        miss_predict = strategy.search(model, miss_src, max_tar_length, shortlist)
+        cache.put(miss_src, miss_predict)
+        for i, sub in zip(miss, miss_predict):
+            predict[i] = sub
+    return predict
 
-def beam_search(model, test_data, test_data_loader, search_size, max_tar_length):
+def translate(model, test_data, test_data_loader, strategy, max_tar_length, shortlist=None, cache=None):
     model.eval()
     predict = []
     test_tar = []
@@ -20,7 +41,7 @@ def beam_search(model, test_data, test_data_loader, search_size, max_tar_length)
         max_iter = int(math.ceil(len(test_data)/config.test_batch_size))
         with tqdm(range(max_iter), desc='test', file=sys.stderr) as pbar:
             for src, tar, _ in test_data_loader:
-                now_predict = model.beam_search(src, search_size, max_tar_length, len(src))
+                now_predict = cached_search(model, strategy, src, max_tar_length, shortlist, cache)
                 for sub_tar in tar:
                     test_tar.append(sub_tar)
                 for sub in now_predict:
@@ -38,27 +59,93 @@ def compare_bleu(predict, target):
             id_ = i
     return id_
 
-def test():
-    print(f"load test sentences from [{config.test_path_src}], [{config.test_path_tar}]", file=sys.stderr)
+def get_bleu(model, predict, test_data_tar):
+    test_data_tar = model.text.tar.decode(test_data_tar)
+    predict = model.text.tar.decode(predict)
+    return corpus_bleu([[tar[1:-1]] for tar in test_data_tar], [pre for pre in predict])
+
+def search_report(stats):
+    '''
+    decode steps the search ran against sentences * max_tar_length without the dynamic limit and early stop
+    '''
+    saved = 1 - stats['steps'] / max(stats['max_steps'], 1)
+    return f"decoded {stats['steps']}/{stats['max_steps']} steps ({saved*100:.1f}% saved), early stop {stats['early_stop']}, length limit {stats['length_limit']}, {stats['sentences']} sentences"
+
+def sharded_test(model_path, test_data, strategy, options, shortlist_path=None, cache=None):
+    '''
+    translate test_data with options.workers processes, each holding its own copy of the model
+    return: predictions and references in test_data order, summed search stats
+    '''
+    src = test_data.src
+    predict = [None for _ in range(len(src))] if (cache is None) else cache.get(src)
+    miss = [i for i in range(len(src)) if predict[i] is None]
+    stats = Counter()
+    if (len(miss) > 0):
+        miss_src = [src[i] for i in miss]
+        devices = options.devices.split(",") if (options.devices is not None) else None
+        miss_predict, stats, seconds = sharded_translate(model_path, miss_src, strategy, options.workers, devices, config.test_batch_size, config.max_tar_length, shortlist_path, options.threads)
+        print(f"{options.workers} workers decoded {len(miss)} sentences, seconds per worker: " + ", ".join(f"{cost:.1f}" for cost in seconds), file=sys.stderr)
+        if (cache is not None):
+            cache.put(miss_src, miss_predict)
+        for i, sub in zip(miss, miss_predict):
+            predict[i] = sub
+    return predict, test_data.tar, stats
+
+def open_cache(model_path, strategy, extra=""):
+    if (config.translation_cache_path is None or not strategy.deterministic):
+        return None
+    return TranslationCache(config.translation_cache_path, model_path, strategy.size(), config.max_tar_length, extra=strategy.key()+extra)
+
+def test(options):
+    strategy = build_strategy(options.strategy, options)
+    test_path_src, test_path_tar = data_paths("test")
+    print(f"load test sentences from [{test_path_src}], [{test_path_tar}]", file=sys.stderr)
     #test_data_src, test_data_tar = utils.read_corpus(config.test_path)
-    test_data = Data(config.test_path_src, config.test_path_tar)
-    test_data_loader = DataLoader(dataset=test_data, batch_size=config.test_batch_size, shuffle=True, collate_fn=utils.get_batch)
+    test_data = Data(test_path_src, test_path_tar)
+    # fixed order: the shortlist of a batch, and so a sentence's output, depends on its batchmates
+    test_data_loader = DataLoader(dataset=test_data, batch_size=config.test_batch_size, shuffle=False, collate_fn=utils.get_batch)
     model_path = "/home/wangshuhe/shuhelearn/ShuHeLearning/NMT_transformer/result/02.10_7_13056.424134041457_checkpoint.pth"
     model = NMT.load(model_path)
     if (config.cuda):
         model = model.to(torch.device("cuda:0"))
-    predict, test_data_tar = beam_search(model, test_data, test_data_loader, 15, config.max_tar_length)
-    for i in range(len(test_data_tar)):
-        for j in range(len(test_data_tar[i])):
-            test_data_tar[i][j] = model.text.tar.id2word[test_data_tar[i][j]]
-    for i in range(len(predict)):
-        for j in range(len(predict[i])):
-            predict[i][j] = model.text.tar.id2word[predict[i][j]]
-    bleu = corpus_bleu([[tar[1:-1]] for tar in test_data_tar], [pre for pre in predict])
-    print(f"Corpus BLEU: {bleu * 100}", file=sys.stderr)
+    cache = open_cache(model_path, strategy)
+    start_time = time.time()
+    if (options.workers > 1):
+        predict, test_data_tar, stats = sharded_test(model_path, test_data, strategy, options, cache=cache)
+    else:
+        predict, test_data_tar = translate(model, test_data, test_data_loader, strategy, config.max_tar_length, cache=cache)
+        stats = model.search_stats
+    bleu = get_bleu(model, predict, test_data_tar)
+    print(f"Corpus BLEU ({strategy.name}): {bleu * 100}, time: {time.time() - start_time:.2f}s", file=sys.stderr)
+    print(f"{strategy.name}: {search_report(stats)}", file=sys.stderr)
+    if (cache is not None):
+        print(f"translation cache: {cache.stats()}", file=sys.stderr)
+        cache.close()
+    if (strategy.supports_shortlist and os.path.exists(config.shortlist_path)):
+        print(f"load shortlist from [{config.shortlist_path}]", file=sys.stderr)
+        shortlist = Shortlist.load(config.shortlist_path)
+        # never cached: the shortlist is the union over a batch, so an output is not a function of its sentence alone
+        model.search_stats.clear()
+        start_time = time.time()
+        if (options.workers > 1):
+            predict, test_data_tar, stats = sharded_test(model_path, test_data, strategy, options, config.shortlist_path)
+        else:
+            predict, test_data_tar = translate(model, test_data, test_data_loader, strategy, config.max_tar_length, shortlist)
+            stats = model.search_stats
+        bleu = get_bleu(model, predict, test_data_tar)
+        print(f"Shortlist corpus BLEU: {bleu * 100}, time: {time.time() - start_time:.2f}s", file=sys.stderr)
+        print(f"{strategy.name}: {search_report(stats)}", file=sys.stderr)
 
 def main():
-    test()
+    parser = OptionParser()
+    add_decoding_options(parser)
+    parser.add_option("--workers", dest="workers", type="int", default=1, help="processes translating a shard of the test set each")
+    parser.add_option("--devices", dest="devices", default=None, help="comma separated devices of the workers, e.g. cuda:0,cuda:1, default cpu")
+    parser.add_option("--threads", dest="threads", type="int", default=None, help="torch threads per worker, default the cores split between the workers")
+    (options, _) = parser.parse_args()
+    if (options.devices is None):
+        os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+    test(options)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -6,36 +6,21 @@ import math
 from tqdm import tqdm
 import sys
 import os
-from optim import Optim
-from data import Data
+# modules shared by the NMT directories (optim, profiling, validate, evaluation)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_common"))
+from optim import Optim, build_scheduler, build_optimizer
+from profiling import PhaseTimer, add_profile_options, build_profiler, profile_done
+from optparse import OptionParser
+import validate
+from evaluator import CheckpointWriter
+from data import Data, data_paths, check_vocab
 from torch.utils.data import DataLoader
 from vocab import Text
 import utils
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '2'
 
-def evaluate_ppl(model, dev_data, dev_loader, dev_batch_size):
-    flag = model.training
-    model.eval()
-    sum_word = 0
-    sum_loss = 0
-    with torch.no_grad():
-        max_iter = int(math.ceil(len(dev_data)/dev_batch_size))
-        with tqdm(total=max_iter, desc="validation") as pbar:
-            for batch_src, batch_tar, tar_word_num in dev_loader:
-                now_batch_size = len(batch_src)
-                batch_loss = -model(batch_src, batch_tar)
-                batch_loss = batch_loss.sum()
-                loss = batch_loss / now_batch_size
-                sum_loss += batch_loss
-                sum_word += tar_word_num
-                pbar.set_postfix({"avg_pool": '{%.2f}' % (loss.item()), "ppl": '{%.2f}' % (math.exp(batch_loss.item() / tar_word_num))})
-                pbar.update(1)
-    if (flag):
-        model.train()
-    return math.exp(sum_loss.item() / sum_word)
-
-def train():
+def train(options):
     torch.manual_seed(1)
     if (config.cuda):
         torch.cuda.manual_seed(1)
@@ -48,62 +33,102 @@ def train():
     args['dim_feedforward'] = config.dim_feedforward
     args['dropout'] = config.dropout
     args['smoothing_eps'] = config.smoothing_eps
-    text = Text(config.src_corpus, config.tar_corpus)
-    train_data = Data(config.train_path_src, config.train_path_tar)
-    dev_data = Data(config.dev_path_src, config.dev_path_tar)
+    args['checkpoint_activations'] = config.checkpoint_activations
+    if (config.share_vocab):
+        text = Text(config.corpus)
+    else:
+        text = Text(config.src_corpus, config.tar_corpus)
+    train_data = Data(*data_paths("train"))
+    dev_data = Data(*data_paths("dev"))
+    check_vocab(train_data, text, "train")
+    check_vocab(dev_data, text, "dev")
     train_loader = DataLoader(dataset=train_data, batch_size=config.train_batch_size, shuffle=True, collate_fn=utils.get_batch)
-    dev_loader = DataLoader(dataset=dev_data, batch_size=config.dev_batch_size, shuffle=True, collate_fn=utils.get_batch)
     #train_data_src, train_data_tar = utils.read_corpus(config.train_path)
     #dev_data_src, dev_data_tar = utils.read_corpus(config.dev_path)
     device = torch.device("cuda:0" if config.cuda else "cpu")
-    model = NMT(text, args, device)
+    if (config.resume_model_path is not None):
+        print(f"load model from [{config.resume_model_path}]", file=sys.stderr)
+        model = NMT.load(config.resume_model_path)
+    else:
+        model = NMT(text, args, device)
     #model = nn.DataParallel(model, device_ids=[0, 1])
     model = model.to(device)
     #model = model.module
-    #model_path = "/home/wangshuhe/shuhelearn/ShuHeLearning/NMT_transformer/result/02.01_1_344.6820465077113_checkpoint.pth"
-    #model = NMT.load(model_path)
-    #model = model.to(device)
     model.train()
-    optimizer = Optim(torch.optim.Adam(model.parameters(), betas=(0.9, 0.98), eps=1e-9), config.d_model, config.warm_up_step)
-    #optimizer = Optim(torch.optim.Adam(model.parameters(), betas=(0.9, 0.98), eps=1e-9), config.warm_up_step, config.init_lr, config.lr)
-    #optimizer = Optim(torch.optim.Adam(model.parameters()))
+    optimizer = Optim(build_optimizer(model, config.optimizer, betas=(0.9, 0.98), eps=1e-9, weight_decay=config.weight_decay), build_scheduler(config.lr_scheduler, config))
+    if (config.resume_optim_path is not None):
+        print(f"load optimizer from [{config.resume_optim_path}]", file=sys.stderr)
+        optimizer.load_state_dict(torch.load(config.resume_optim_path, map_location=device))
 
     epoch = 0
     history_valid_ppl = []
+    timer = PhaseTimer(enabled=options.profile, synchronize=options.profile and config.cuda)
+    profiler = build_profiler(options)
+    if (profiler is not None):
+        profiler.start()
+    step = 0
+    validator = None
+    if (config.valid_device is not None):
+        validator = validate.ValidationWorker(model, dev_data, config.valid_max_tokens, config.valid_device)
+    writer = CheckpointWriter() if (config.async_evaluation) else None
     print("begin training!", file=sys.stderr)
     while (True):
         epoch += 1
         max_iter = int(math.ceil(len(train_data)/config.train_batch_size))
         with tqdm(total=max_iter, desc="train") as pbar:
             #for batch_src, batch_tar, tar_word_num in utils.batch_iter(train_data_src, train_data_tar, config.train_batch_size):
-            for batch_src, batch_tar, tar_word_num in train_loader:
+            for batch_src, batch_tar, tar_word_num in timer.iterate(train_loader):
                 optimizer.zero_grad()
                 now_batch_size = len(batch_src)
-                batch_loss = -model(batch_src, batch_tar, smoothing=True)
-                batch_loss = batch_loss.sum()
-                loss = batch_loss / now_batch_size
-                loss.backward()
+                with timer.phase("forward"):
+                    output, target_tensor = model.hidden(batch_src, batch_tar)
+                with timer.phase("loss"):
+                    batch_loss = -model.score(output, target_tensor, smoothing=True).sum()
+                    loss = batch_loss / now_batch_size
+                with timer.phase("backward"):
+                    loss.backward()
                 #optimizer.step()
                 #optimizer.updata_lr()
-                optimizer.step_and_updata_lr()
+                with timer.phase("step"):
+                    optimizer.step_and_updata_lr()
                 pbar.set_postfix({"epoch": epoch, "avg_loss": '{%.2f}' % (loss.item()), "ppl": '{%.2f}' % (math.exp(batch_loss.item()/tar_word_num))})
                 pbar.update(1)
-        if (epoch % config.valid_iter == 0):
+                step += 1
+                if (profiler is not None):
+                    profiler.step()
+                if (profile_done(options, step)):
+                    profiler.stop()
+                    print(f"phase time per step: {timer.report()}", file=sys.stderr)
+                    return
+        if (epoch % config.valid_iter == 0 and writer is not None):
+            writer.save(model, optimizer, os.path.join(config.model_save_path, f"02.10_{epoch}"))
+        elif (epoch % config.valid_iter == 0 and validator is not None):
+            validator.submit(epoch, model, os.path.join(config.model_save_path, f"02.10_{epoch}_{{ppl}}_checkpoint.pth"))
+        elif (epoch % config.valid_iter == 0):
             print("now begin validation...", file=sys.stderr)
-            eval_ppl = evaluate_ppl(model, dev_data, dev_loader, config.dev_batch_size)
+            eval_ppl = validate.evaluate_ppl(model, dev_data, config.valid_max_tokens)
             print(eval_ppl)
             flag = len(history_valid_ppl) == 0 or eval_ppl < min(history_valid_ppl)
             if (flag):
                 print(f"current model is the best! save to [{config.model_save_path}]", file=sys.stderr)
                 history_valid_ppl.append(eval_ppl)
                 model.save(os.path.join(config.model_save_path, f"02.10_{epoch}_{eval_ppl}_checkpoint.pth"))
-                torch.save(optimizer.optimizer.state_dict(), os.path.join(config.model_save_path, f"02.10_{epoch}_{eval_ppl}_optimizer.optim"))
+                torch.save(optimizer.state_dict(), os.path.join(config.model_save_path, f"02.10_{epoch}_{eval_ppl}_optimizer.optim"))
+        if (validator is not None):
+            validate.report(validator.poll())
         if (epoch == config.max_epoch):
+            if (validator is not None):
+                validate.report(validator.close())
+            if (writer is not None):
+                writer.wait()
             print("reach the maximum number of epochs!", file=sys.stderr)
             return
 
 def main():
-    train()
+    parser = OptionParser()
+    add_profile_options(parser)
+    (options, args) = parser.parse_args()
+    train(options)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
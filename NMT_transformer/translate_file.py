@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import queue
+import threading
+from optparse import OptionParser
+import torch
+from tqdm import tqdm
+import shuhe_config as config
+from nmt_model import NMT
+from bpe import BPE
+from translator import Translator, normalize
+from decoding import add_decoding_options, build_strategy
+
+def count_lines(path):
+    '''
+    complete lines of path, a trailing line without newline (an interrupted write) is cut off
+    '''
+    lines = 0
+    end = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if (not line.endswith(b"\n")):
+                break
+            lines += 1
+            end += len(line)
+    return lines, end
+
+def truncate_output(path, lines):
+    '''
+    keep the first lines lines of path
+    '''
+    end = 0
+    with open(path, "rb") as f:
+        for i in range(lines):
+            line = f.readline()
+            if (not line.endswith(b"\n")):
+                raise ValueError(f"[{path}] has only {i} complete lines, cannot resume from line {lines}")
+            end += len(line)
+    with open(path, "r+b") as f:
+        f.truncate(end)
+
+def read_windows(path, start, window):
+    '''
+    lines start, start+1, ... of path in lists of window lines, read lazily
+    '''
+    with open(path, "r") as f:
+        for i, _ in zip(range(start), f):
+            pass
+        lines = []
+        for line in f:
+            lines.append(line.rstrip("\n"))
+            if (len(lines) == window):
+                yield lines
+                lines = []
+        if (len(lines) > 0):
+            yield lines
+
+def token_batches(lengths, max_tokens, max_sentences):
+    '''
+    lengths: source length of every sentence
+    return: list of index lists, shortest sentences first, at most max_tokens padded source words and max_sentences sentences each
+    '''
+    order = sorted((i for i in range(len(lengths)) if lengths[i] > 0), key=lambda i: lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        if (len(batch) > 0 and (lengths[i] * (len(batch)+1) > max_tokens or len(batch) == max_sentences)):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if (len(batch) > 0):
+        batches.append(batch)
+    return batches
+
+class Prefetcher(object):
+    '''
+    reads, encodes, sorts and batches the input on a thread while the model decodes
+    items: ('window', size, empty line indices) before the batches of every window, ('batch', index list, sources), None at the end
+    '''
+    def __init__(self, windows, encode, max_tokens, max_sentences, prefetch):
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.thread = threading.Thread(target=self.run, args=(windows, encode, max_tokens, max_sentences), daemon=True)
+        self.thread.start()
+
+    def run(self, windows, encode, max_tokens, max_sentences):
+        try:
+            for lines in windows:
+                sources = [encode(line) for line in lines]
+                self.queue.put(('window', len(lines), [i for i in range(len(sources)) if len(sources[i]) == 0]))
+                for batch in token_batches([len(source) for source in sources], max_tokens, max_sentences):
+                    self.queue.put(('batch', batch, [sources[i] for i in batch]))
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if (item is None):
+                return
+            if (isinstance(item, Exception)):
+                raise item
+            yield item
+
+class OrderedWriter(object):
+    '''
+    writes the translations of a window in input order as soon as every earlier line is done
+    '''
+    def __init__(self, f):
+        self.f = f
+        self.output = []
+        self.next = 0
+
+    def start(self, size):
+        self.output = [None for _ in range(size)]
+        self.next = 0
+
+    def put(self, index, line):
+        self.output[index] = line
+        written = 0
+        while (self.next < len(self.output) and self.output[self.next] is not None):
+            self.f.write(self.output[self.next] + "\n")
+            self.output[self.next] = None
+            self.next += 1
+            written += 1
+        if (written > 0):
+            self.f.flush()
+        return written
+
+def main():
+    parser = OptionParser(usage="%prog [options] checkpoint input output")
+    parser.add_option("--format", dest="format", default="text", help="text: raw sentences (see translator.py), ids: word ids per line as read_corpus")
+    parser.add_option("--bpe", dest="bpe", default=None, help="merge file written by bpe.py, text format only")
+    parser.add_option("--window", dest="window", type="int", default=100000, help="lines sorted by length together")
+    parser.add_option("--max_tokens", dest="max_tokens", type="int", default=4000, help="padded source words per batch")
+    parser.add_option("--max_sentences", dest="max_sentences", type="int", default=config.test_batch_size*4)
+    parser.add_option("--prefetch", dest="prefetch", type="int", default=16, help="batches encoded ahead of the model")
+    parser.add_option("--offset", dest="offset", type="int", default=None, help="start at this input line and cut the output to as many lines, default: continue after the complete lines already in output")
+    parser.add_option("--cuda", dest="cuda", action="store_true", default=False)
+    add_decoding_options(parser)
+    (options, args) = parser.parse_args()
+    if (len(args) != 3):
+        parser.error("need a checkpoint, an input and an output file")
+    checkpoint_path, input_path, output_path = args
+    if (options.format not in ["text", "ids"]):
+        parser.error(f"unknown format {options.format}")
+    model = NMT.load(checkpoint_path)
+    if (options.cuda):
+        model.device = torch.device("cuda:0")
+        model = model.to(model.device)
+    model.eval()
+    strategy = build_strategy(options.strategy, options)
+    if (options.format == "text"):
+        bpe = BPE.load(options.bpe) if (options.bpe is not None) else None
+        translator = Translator(model, bpe)
+        encode = lambda line: translator.encode(normalize(line)) if (len(line.strip()) > 0) else []
+        decode = translator.decode
+    else:
+        encode = lambda line: [int(word) for word in line.split()]
+        decode = lambda ids: " ".join(str(word_id) for word_id in ids)
+
+    start = 0
+    if (os.path.exists(output_path)):
+        if (options.offset is None):
+            start, end = count_lines(output_path)
+            with open(output_path, "r+b") as f:
+                f.truncate(end)
+        else:
+            start = options.offset
+            truncate_output(output_path, start)
+    elif (options.offset is not None and options.offset > 0):
+        parser.error(f"offset {options.offset} but [{output_path}] does not exist")
+    if (start > 0):
+        print(f"resume [{input_path}] from line {start}", file=sys.stderr)
+
+    begin_time = time.time()
+    lines_done = 0
+    words_done = 0
+    prefetcher = Prefetcher(read_windows(input_path, start, options.window), encode, options.max_tokens, options.max_sentences, options.prefetch)
+    with open(output_path, "a") as f, tqdm(desc="translate", unit="line", initial=start, file=sys.stderr) as pbar:
+        writer = OrderedWriter(f)
+        with torch.no_grad():
+            for item in prefetcher:
+                if (item[0] == 'window'):
+                    _, size, empty = item
+                    writer.start(size)
+                    # nothing to decode for an empty line
+                    for i in empty:
+                        pbar.update(writer.put(i, ""))
+                    continue
+                _, batch, sources = item
+                predict = strategy.search(model, sources, config.max_tar_length)
+                for i, ids in zip(batch, predict):
+                    words_done += len(ids)
+                    pbar.update(writer.put(i, decode(ids)))
+                lines_done += len(batch)
+    cost = time.time() - begin_time
+    print(f"translated {lines_done} lines to [{output_path}] in {cost:.1f}s, {lines_done/max(cost, 1e-9):.1f} sentences/s, {words_done/max(cost, 1e-9):.1f} words/s", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
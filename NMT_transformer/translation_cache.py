@@ -0,0 +1,83 @@
+import time
+import hashlib
+import sqlite3
+import shuhe_config as config
+
+def file_hash(path, block_size=1<<20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if (len(block) == 0):
+                break
+            sha.update(block)
+    return sha.hexdigest()
+
+# bump whenever the search itself changes what it returns for the same settings
+# 2: per-sentence length limit and early stop in beam_search
+SEARCH_VERSION = 2
+
+class TranslationCache(object):
+    '''
+    beam search outputs stored in sqlite, keyed by (search version, checkpoint hash, beam size, max length, max_len_a, max_len_b, alpha, extra, source ids)
+    rows of every checkpoint are kept side by side (a retrained model hashes differently, so it never sees stale outputs),
+    only the least recently used rows beyond max_rows are evicted when the cache is opened
+    extra: anything else that changes the output, e.g. the decoding strategy key; only outputs that depend on nothing
+    but their own sentence belong here (not shortlist runs, whose vocabulary is shared by a batch)
+    '''
+    def __init__(self, path, checkpoint_path, search_size, max_tar_length, alpha=None, extra="", max_len_a=None, max_len_b=None, max_rows=None):
+        # read at call time, so a config changed after import still changes the key
+        alpha = config.alpha if (alpha is None) else alpha
+        max_len_a = config.max_len_a if (max_len_a is None) else max_len_a
+        max_len_b = config.max_len_b if (max_len_b is None) else max_len_b
+        max_rows = config.translation_cache_max_rows if (max_rows is None) else max_rows
+        self.checkpoint = file_hash(checkpoint_path)
+        self.prefix = f"v{SEARCH_VERSION}|{self.checkpoint}|{search_size}|{max_tar_length}|{max_len_a}|{max_len_b}|{alpha}|{extra}|"
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, checkpoint TEXT, output TEXT, used REAL)")
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(translations)")]
+        if ('used' not in columns):
+            # caches written before eviction by age
+            self.db.execute("ALTER TABLE translations ADD COLUMN used REAL DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS translations_used ON translations (used)")
+        self.db.execute("DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY used DESC LIMIT -1 OFFSET ?)", (max_rows,))
+        self.db.commit()
+
+    def key(self, source):
+        return hashlib.sha256((self.prefix + " ".join(str(word_id) for word_id in source)).encode()).hexdigest()
+
+    def get(self, sources):
+        '''
+        sources: list[list[int]]
+        return: list, the cached prediction or None for every source
+        '''
+        keys = [self.key(source) for source in sources]
+        found = dict()
+        for i in range(0, len(keys), 500):
+            now_keys = keys[i:i+500]
+            rows = self.db.execute(f"SELECT key, output FROM translations WHERE key IN ({','.join('?'*len(now_keys))})", now_keys)
+            for key, output in rows:
+                found[key] = [int(word_id) for word_id in output.split()]
+        if (len(found) > 0):
+            now = time.time()
+            self.db.executemany("UPDATE translations SET used = ? WHERE key = ?", [(now, key) for key in found])
+            self.db.commit()
+        output = [found.get(key) for key in keys]
+        hits = sum(1 for predict in output if predict is not None)
+        self.hits += hits
+        self.misses += len(output) - hits
+        return output
+
+    def put(self, sources, predicts):
+        now = time.time()
+        rows = [(self.key(source), self.checkpoint, " ".join(str(word_id) for word_id in predict), now) for source, predict in zip(sources, predicts)]
+        self.db.executemany("INSERT OR REPLACE INTO translations (key, checkpoint, output, used) VALUES (?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,145 @@
+import re
+import sys
+import unicodedata
+from collections import OrderedDict
+from optparse import OptionParser
+import torch
+import shuhe_config as config
+from nmt_model import NMT
+from bpe import BPE, remove_bpe
+
+TOKEN = re.compile(r"\w+(?:[-']\w+)*|[^\w\s]")
+NO_SPACE_BEFORE = re.compile(r" ([.,!?;:%)\]}])")
+NO_SPACE_AFTER = re.compile(r"([(\[{$]) ")
+
+class LRUCache(object):
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if (key not in self.data):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if (len(self.data) > self.capacity):
+            self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+def normalize(line):
+    return " ".join(unicodedata.normalize("NFKC", line).split())
+
+def tokenize(line):
+    return TOKEN.findall(line)
+
+def detokenize(words):
+    line = " ".join(words)
+    line = NO_SPACE_BEFORE.sub(r"\1", line)
+    return NO_SPACE_AFTER.sub(r"\1", line)
+
+class Translator(object):
+    '''
+    raw text in, raw text out: normalize -> tokenize (-> bpe) -> ids -> batched beam search -> words -> detokenize
+    both caches are keyed on the normalized sentence, so repeats cost one dict lookup
+    '''
+    def __init__(self, model, bpe=None, search_size=5, max_tar_length=config.max_tar_length, batch_size=config.test_batch_size, shortlist=None, cache_size=100000):
+        self.model = model
+        self.bpe = bpe
+        self.search_size = search_size
+        self.max_tar_length = max_tar_length
+        self.batch_size = batch_size
+        self.shortlist = shortlist
+        self.token_cache = LRUCache(cache_size)
+        self.translation_cache = LRUCache(cache_size)
+
+    def encode(self, line):
+        '''
+        line: normalized sentence
+        return: list[int] source ids
+        '''
+        ids = self.token_cache.get(line)
+        if (ids is None):
+            words = tokenize(line)
+            if (self.bpe is not None):
+                words = self.bpe.apply(" ".join(words))
+            ids = self.model.text.src.encode([words])[0].tolist()
+            self.token_cache.put(line, ids)
+        return ids
+
+    def decode(self, ids):
+        words = self.model.text.tar.decode([ids])[0]
+        if (self.bpe is not None):
+            words = remove_bpe(words).split()
+        return detokenize(words)
+
+    def translate(self, sents):
+        '''
+        sents: list[str]
+        return: list[str], one translation per input
+        '''
+        keys = [normalize(sen) for sen in sents]
+        output = dict()
+        pending = []
+        for key in dict.fromkeys(keys):
+            if (len(key) == 0):
+                output[key] = ""
+                continue
+            translation = self.translation_cache.get(key)
+            if (translation is None):
+                pending.append((key, self.encode(key)))
+            else:
+                output[key] = translation
+        # similar lengths in one batch keep padding and beam search steps low
+        pending.sort(key=lambda item: len(item[1]))
+        self.model.eval()
+        with torch.no_grad():
+            for i in range(0, len(pending), self.batch_size):
+                batch = pending[i:i+self.batch_size]
+                source = [ids for _, ids in batch]
+                predict = self.model.beam_search(source, self.search_size, self.max_tar_length, len(source), self.shortlist)
+                for (key, _), ids in zip(batch, predict):
+                    output[key] = self.decode(ids)
+                    self.translation_cache.put(key, output[key])
+        return [output[key] for key in keys]
+
+    def stats(self):
+        return {
+            'token_hits': self.token_cache.hits,
+            'token_misses': self.token_cache.misses,
+            'translation_hits': self.translation_cache.hits,
+            'translation_misses': self.translation_cache.misses
+        }
+
+def main():
+    parser = OptionParser(usage="%prog [options] checkpoint < input > output")
+    parser.add_option("--bpe", dest="bpe", default=None, help="merge file written by bpe.py")
+    parser.add_option("--beam", dest="beam", type="int", default=5)
+    parser.add_option("--batch_size", dest="batch_size", type="int", default=config.test_batch_size)
+    parser.add_option("--cuda", dest="cuda", action="store_true", default=False)
+    (options, args) = parser.parse_args()
+    if (len(args) != 1):
+        parser.error("need a checkpoint")
+    model = NMT.load(args[0])
+    if (options.cuda):
+        model = model.to(torch.device("cuda:0"))
+    bpe = BPE.load(options.bpe) if (options.bpe is not None) else None
+    translator = Translator(model, bpe, options.beam, batch_size=options.batch_size)
+    lines = sys.stdin.readlines()
+    for i in range(0, len(lines), options.batch_size*8):
+        for translation in translator.translate(lines[i:i+options.batch_size*8]):
+            print(translation)
+    print(translator.stats(), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
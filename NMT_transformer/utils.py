@@ -1,3 +1,5 @@
+import numpy as np
+
 def padding(sents, pad_word):
     '''
     sents: list[list[int]]
@@ -13,7 +15,21 @@ def padding(sents, pad_word):
     return padding_sents
 
 def read_corpus(file_path, flag=False):
+    '''
+    file_path: one sentence of word ids per line, or a binary corpus written by bpe.py (.npz)
+    flag: wrap every sentence in <start> (0) and <end> (1)
+    '''
     output = []
+    if (file_path.endswith(".npz")):
+        with np.load(file_path, allow_pickle=False) as corpus:
+            ids = corpus['ids'].tolist()
+            offsets = corpus['offsets'].tolist()
+        for i in range(len(offsets)-1):
+            now = ids[offsets[i]:offsets[i+1]]
+            if (flag):
+                now = [0] + now + [1]
+            output.append(now)
+        return output
     with open(file_path, "r") as f:
         for line in f:
             line = line.strip().split()
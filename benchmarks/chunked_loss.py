@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import random
+import tempfile
+from optparse import OptionParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_transformer"))
+import torch
+import shuhe_config as config
+from vocab import Text
+from nmt_model import NMT
+from nmt_speed import make_vocab
+from memory_report import SavedTensorMeter, reset_peak, peak_mb
+
+def run(model, src, tar, smoothing, chunk_size, device):
+    '''
+    per-sentence scores, gradients, seconds, saved activation MB and peak MB of one forward+backward
+    '''
+    config.loss_chunk_size = chunk_size
+    model.zero_grad(set_to_none=True)
+    meter = SavedTensorMeter(model)
+    reset_peak(device)
+    start = time.perf_counter()
+    with meter.hooks():
+        score = model([sen.copy() for sen in src], [sen.copy() for sen in tar], smoothing=smoothing)
+    (-score.sum()).backward()
+    if (device.type == "cuda"):
+        torch.cuda.synchronize(device)
+    cost = time.perf_counter() - start
+    grads = torch.cat([p.grad.flatten() for p in model.parameters() if p.grad is not None])
+    return score.detach(), grads, cost, meter.bytes / (1<<20), peak_mb(device)
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--chunk_sizes", dest="chunk_sizes", default="1,8,16,32")
+    parser.add_option("--batch_size", dest="batch_size", type="int", default=16)
+    parser.add_option("--min_len", dest="min_len", type="int", default=10)
+    parser.add_option("--max_len", dest="max_len", type="int", default=60)
+    parser.add_option("--vocab_size", dest="vocab_size", type="int", default=37000)
+    parser.add_option("--d_model", dest="d_model", type="int", default=256)
+    parser.add_option("--layers", dest="layers", type="int", default=2)
+    parser.add_option("--tolerance", dest="tolerance", type="float", default=1e-3)
+    parser.add_option("--cuda", dest="cuda", action="store_true", default=False)
+    (options, _) = parser.parse_args()
+    device = torch.device("cuda:0" if options.cuda else "cpu")
+    with tempfile.TemporaryDirectory() as tmp:
+        make_vocab(os.path.join(tmp, "vocab"), options.vocab_size)
+        text = Text(os.path.join(tmp, "vocab"), os.path.join(tmp, "vocab"))
+    args = {
+        'embed_size': options.d_model, 'd_model': options.d_model, 'nhead': 4,
+        'num_encoder_layers': options.layers, 'num_decoder_layers': options.layers,
+        'dim_feedforward': options.d_model*4, 'dropout': 0.0, 'smoothing_eps': config.smoothing_eps
+    }
+    torch.manual_seed(1)
+    model = NMT(text, args, device).to(device)
+    model.train()
+    rng = random.Random(1)
+    src = [[rng.randint(4, options.vocab_size-1) for _ in range(rng.randint(options.min_len, options.max_len))] for _ in range(options.batch_size)]
+    tar = [[0] + [rng.randint(4, options.vocab_size-1) for _ in range(rng.randint(options.min_len, options.max_len))] + [1] for _ in range(options.batch_size)]
+    ok = True
+    for smoothing in [False, True]:
+        score, grads, cost, saved, peak = run(model, src, tar, smoothing, None, device)
+        print(f"smoothing={smoothing} dense      {cost*1000:8.1f}ms  saved {saved:8.1f}MB  peak {peak}MB", file=sys.stderr)
+        for chunk_size in [int(size) for size in options.chunk_sizes.split(",")]:
+            chunk_score, chunk_grads, cost, saved, peak = run(model, src, tar, smoothing, chunk_size, device)
+            score_diff = ((chunk_score - score).abs() / score.abs().clamp(min=1)).max().item()
+            grad_diff = (chunk_grads - grads).abs().max().item() / max(grads.abs().max().item(), 1e-12)
+            ok = ok and score_diff < options.tolerance and grad_diff < options.tolerance
+            print(f"smoothing={smoothing} chunk={chunk_size:<4d} {cost*1000:8.1f}ms  saved {saved:8.1f}MB  peak {peak}MB  score diff {score_diff:.2e}  grad diff {grad_diff:.2e}", file=sys.stderr)
+    print("chunked loss matches" if ok else "chunked loss MISMATCH", file=sys.stderr)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import time
+from optparse import OptionParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_transformer"))
+import torch
+from nltk.translate.bleu_score import corpus_bleu
+import shuhe_config as config
+from nmt_model import NMT
+from data import Data
+from decoding import add_decoding_options, build_strategy
+
+def run(model, strategy, data, batch_size, max_tar_length):
+    '''
+    decode data in batches of similar length, return the outputs in data order and the seconds spent
+    '''
+    order = sorted(range(len(data)), key=lambda i: len(data.src[i]))
+    predict = [None for _ in range(len(data))]
+    with torch.no_grad():
+        # warm up
+        strategy.search(model, [data.src[i].copy() for i in order[:batch_size]], max_tar_length)
+    model.search_stats.clear()
+    start = time.perf_counter()
+    with torch.no_grad():
+        for begin in range(0, len(order), batch_size):
+            batch = order[begin:begin+batch_size]
+            output = strategy.search(model, [data.src[i].copy() for i in batch], max_tar_length)
+            for i, sub in zip(batch, output):
+                predict[i] = sub
+    if (model.device.type == "cuda"):
+        torch.cuda.synchronize(model.device)
+    return predict, time.perf_counter() - start
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--model", dest="model", default=None, help="checkpoint to decode with")
+    parser.add_option("--src", dest="src", default=config.test_path_src)
+    parser.add_option("--tar", dest="tar", default=config.test_path_tar)
+    parser.add_option("--strategies", dest="strategies", default="greedy,sample,beam,diverse_beam")
+    parser.add_option("--sentences", dest="sentences", type="int", default=None, help="decode only the first N sentences")
+    parser.add_option("--batch_size", dest="batch_size", type="int", default=config.test_batch_size)
+    parser.add_option("--output", dest="output", default="decoding_speed.json")
+    parser.add_option("--cuda", dest="cuda", action="store_true", default=False)
+    add_decoding_options(parser)
+    (options, _) = parser.parse_args()
+    if (options.model is None):
+        parser.error("--model is required")
+    device = torch.device("cuda:0" if options.cuda else "cpu")
+    model = NMT.load(options.model)
+    model.device = device
+    model = model.to(device)
+    model.eval()
+    data = Data(options.src, options.tar)
+    if (options.sentences is not None):
+        data.src = data.src[:options.sentences]
+        data.tar = data.tar[:options.sentences]
+        data.len_ = len(data.src)
+    target = model.text.tar.decode([sen[1:-1] for sen in data.tar])
+    results = []
+    for name in options.strategies.split(","):
+        strategy = build_strategy(name, options)
+        predict, cost = run(model, strategy, data, options.batch_size, config.max_tar_length)
+        words = sum(len(sub) for sub in predict)
+        result = {
+            'strategy': name, 'key': strategy.key(), 'seconds': cost,
+            'sentences_per_sec': len(data) / cost, 'tokens_per_sec': words / cost,
+            'mean_length': words / len(data), 'decode_steps': model.search_stats['steps'],
+            'bleu': corpus_bleu([[tar] for tar in target], model.text.tar.decode(predict)) * 100
+        }
+        results.append(result)
+        print(f"{name:<12} {result['sentences_per_sec']:8.1f} sentences/s {result['tokens_per_sec']:9.1f} tokens/s  mean length {result['mean_length']:.1f}  BLEU {result['bleu']:.2f}", file=sys.stderr)
+    with open(options.output, "w") as f:
+        json.dump({'device': str(device), 'model': options.model, 'sentences': len(data), 'batch_size': options.batch_size, 'results': results}, f, indent=2)
+    print(f"write [{options.output}]", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import random
+import tempfile
+from optparse import OptionParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_transformer"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_common"))
+import torch
+import shuhe_config as config
+from vocab import Text
+from nmt_model import NMT
+from optim import build_optimizer
+from nmt_speed import make_vocab
+
+class SavedTensorMeter(object):
+    '''
+    bytes autograd keeps alive for backward, counted through saved_tensors_hooks so it works on CPU as well
+    storages are counted once, views of a saved tensor are free, parameters are not activations
+    '''
+    def __init__(self, model):
+        self.storages = set((p.untyped_storage().data_ptr(), p.device) for p in model.parameters())
+        self.bytes = 0
+
+    def pack(self, tensor):
+        storage = tensor.untyped_storage()
+        key = (storage.data_ptr(), storage.device)
+        if (key not in self.storages):
+            self.storages.add(key)
+            self.bytes += storage.nbytes()
+        return tensor
+
+    def hooks(self):
+        return torch.autograd.graph.saved_tensors_hooks(self.pack, lambda tensor: tensor)
+
+def peak_mb(device):
+    if (device.type == "cuda"):
+        return torch.cuda.max_memory_allocated(device) / (1<<20)
+    return None
+
+def reset_peak(device):
+    if (device.type == "cuda"):
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+
+def measure(model, optimizer, src, tar, device):
+    '''
+    peak allocated memory of forward (incl. loss), backward and optimizer step, plus the activations saved for backward
+    '''
+    report = dict()
+    optimizer.zero_grad(set_to_none=True)
+    meter = SavedTensorMeter(model)
+    reset_peak(device)
+    with meter.hooks():
+        loss = -model([sen.copy() for sen in src], [sen.copy() for sen in tar], smoothing=True).sum() / len(src)
+    report['forward_peak_mb'] = peak_mb(device)
+    report['saved_activations_mb'] = meter.bytes / (1<<20)
+    reset_peak(device)
+    loss.backward()
+    report['backward_peak_mb'] = peak_mb(device)
+    reset_peak(device)
+    optimizer.step()
+    report['step_peak_mb'] = peak_mb(device)
+    return report
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--batch_sizes", dest="batch_sizes", default="16,32,64")
+    parser.add_option("--sen_len", dest="sen_len", type="int", default=30)
+    parser.add_option("--vocab_size", dest="vocab_size", type="int", default=37000)
+    parser.add_option("--output", dest="output", default="memory_report.json")
+    parser.add_option("--cuda", dest="cuda", action="store_true", default=False)
+    (options, _) = parser.parse_args()
+    device = torch.device("cuda:0" if options.cuda else "cpu")
+    with tempfile.TemporaryDirectory() as tmp:
+        make_vocab(os.path.join(tmp, "vocab"), options.vocab_size)
+        text = Text(os.path.join(tmp, "vocab"), os.path.join(tmp, "vocab"))
+    results = []
+    for checkpoint_activations in [False, True]:
+        args = {
+            'embed_size': config.embed_size, 'd_model': config.d_model, 'nhead': config.nhead,
+            'num_encoder_layers': config.num_encoder_layers, 'num_decoder_layers': config.num_decoder_layers,
+            'dim_feedforward': config.dim_feedforward, 'dropout': config.dropout, 'smoothing_eps': config.smoothing_eps,
+            'checkpoint_activations': checkpoint_activations
+        }
+        model = NMT(text, args, device).to(device)
+        model.train()
+        optimizer = build_optimizer(model, config.optimizer, betas=(0.9, 0.98), eps=1e-9)
+        for batch_size in [int(size) for size in options.batch_sizes.split(",")]:
+            rng = random.Random(batch_size)
+            src = [[rng.randint(4, options.vocab_size-1) for _ in range(options.sen_len)] for _ in range(batch_size)]
+            tar = [[0] + [rng.randint(4, options.vocab_size-1) for _ in range(options.sen_len)] + [1] for _ in range(batch_size)]
+            try:
+                report = measure(model, optimizer, src, tar, device)
+            except torch.cuda.OutOfMemoryError:
+                report = {'error': "out of memory"}
+                torch.cuda.empty_cache()
+            report.update({'checkpoint_activations': checkpoint_activations, 'batch_size': batch_size})
+            results.append(report)
+            print(" ".join(f"{key}={value:.1f}" if isinstance(value, float) else f"{key}={value}" for key, value in report.items()), file=sys.stderr)
+        del model, optimizer
+    with open(options.output, "w") as f:
+        json.dump({'device': str(device), 'sen_len': options.sen_len, 'vocab_size': options.vocab_size, 'results': results}, f, indent=2)
+    print(f"write [{options.output}]", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import random
+import resource
+import platform
+import tempfile
+import subprocess
+from optparse import OptionParser
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+VARIANTS = {
+    'transformer': os.path.join(ROOT, "NMT_transformer"),
+    'change': os.path.join(ROOT, "NMT_transformer", "change"),
+    'attention': os.path.join(ROOT, "NMT_attention")
+}
+
+def make_vocab(path, size):
+    with open(path, "w") as f:
+        for word in ['<start>', '<end>', '<pad>', '<unk>']:
+            f.write(word+'\n')
+        for i in range(size-4):
+            f.write(f"w{i}\n")
+
+def make_batches(n_batches, batch_size, vocab_size, min_len, max_len, rng):
+    '''
+    random sentences of word ids 4..vocab_size-1, targets wrapped in <start>/<end> like read_corpus(path, True)
+    '''
+    batches = []
+    for _ in range(n_batches):
+        src = [[rng.randint(4, vocab_size-1) for _ in range(rng.randint(min_len, max_len))] for _ in range(batch_size)]
+        tar = [[0] + [rng.randint(4, vocab_size-1) for _ in range(rng.randint(min_len, max_len))] + [1] for _ in range(batch_size)]
+        batches.append((src, tar))
+    return batches
+
+def summary(latency, tokens):
+    latency = np.array(latency)
+    return {
+        'tokens_per_sec': tokens / latency.sum(),
+        'p50_ms': np.percentile(latency, 50) * 1000,
+        'p90_ms': np.percentile(latency, 90) * 1000,
+        'p99_ms': np.percentile(latency, 99) * 1000,
+        'iterations': len(latency)
+    }
+
+def timed(fn, batches, warm_up):
+    for batch in batches[:warm_up]:
+        fn(batch)
+    latency = []
+    for batch in batches:
+        start = time.perf_counter()
+        fn(batch)
+        latency.append(time.perf_counter() - start)
+    return latency
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if (sys.platform == "darwin") else rss / 1024
+
+def build_model(variant, text, options, device):
+    from nmt_model import NMT
+    if (variant == 'attention'):
+        args = type("Options", (object,), {
+            'embed_size': options.d_model, 'hidden_size': options.d_model, 'window_size_d': 10,
+            'encoder_layer': options.layers, 'decoder_layers': options.layers, 'dropout_rate': 0.1
+        })()
+    else:
+        args = {
+            'embed_size': options.d_model, 'd_model': options.d_model, 'nhead': options.nhead,
+            'num_encoder_layers': options.layers, 'num_decoder_layers': options.layers,
+            'dim_feedforward': options.d_model * 4, 'dropout': 0.1, 'smoothing_eps': 0.1
+        }
+    return NMT(text, args, device)
+
+def run_variant(variant, options):
+    '''
+    runs inside its own interpreter: the variants share module names (nmt_model, vocab, shuhe_config), and peak RSS is per process
+    '''
+    sys.path.insert(0, VARIANTS[variant])
+    import torch
+    from vocab import Text
+    torch.manual_seed(options.seed)
+    torch.set_num_threads(options.threads)
+    device = torch.device("cpu")
+    rng = random.Random(options.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        make_vocab(os.path.join(tmp, "src.vocab"), options.vocab_size)
+        make_vocab(os.path.join(tmp, "tar.vocab"), options.vocab_size)
+        text = Text(os.path.join(tmp, "src.vocab"), os.path.join(tmp, "tar.vocab"))
+    model = build_model(variant, text, options, device)
+    batches = make_batches(options.iterations, options.batch_size, options.vocab_size, options.min_len, options.max_len, rng)
+    result = {'parameters': sum(p.numel() for p in model.parameters())}
+
+    def train_step(batch):
+        src, tar = batch
+        model.zero_grad()
+        loss = -model(src, tar).sum()
+        loss.backward()
+    model.train()
+    latency = timed(train_step, batches, options.warm_up)
+    result['train_step'] = summary(latency, sum(len(sen)-1 for _, tar in batches for sen in tar))
+
+    model.eval()
+    with torch.no_grad():
+        def encode(batch):
+            src_tensor = text.src.word2tensor([sen.copy() for sen in batch[0]], device)
+            if (variant == 'attention'):
+                return model.encode(src_tensor, [len(sen) for sen in batch[0]])
+            return model.encode(src_tensor)
+        latency = timed(encode, batches, options.warm_up)
+        result['encode'] = summary(latency, sum(len(sen) for src, _ in batches for sen in src))
+
+        # one target position with a prefix of prefix_len words already generated
+        states = [encode(batch) for batch in batches]
+        prefix = [[0] + [4] * (options.prefix_len-1) for _ in range(options.batch_size)]
+        def decode_step(i):
+            if (variant == 'attention'):
+                all_h, encode_len, h_c = states[i]
+                src_tensor = text.src.word2tensor([sen.copy() for sen in batches[i][0]], device)
+                word = model.embeddings.tar(torch.full((options.batch_size,), 4, dtype=torch.long, device=device))
+                step_input = torch.cat((word, torch.zeros(options.batch_size, model.hidden_size, device=device)), dim=-1).unsqueeze(dim=0)
+                _, ht = model.step(src_tensor, all_h, encode_len.to(device), step_input, h_c)
+                return model.ht2final(ht)
+            memory, memory_padding = states[i]
+            output = model.decode(memory, memory_padding, text.tar.word2tensor([sen.copy() for sen in prefix], device))[-1]
+            return model.project(output)
+        latency = timed(decode_step, list(range(len(batches))), options.warm_up)
+        result['decode_step'] = summary(latency, options.batch_size * len(batches))
+
+        decode_batches = batches[:options.beam_iterations]
+        def beam_search(batch):
+            src = [sen[:options.beam_src_len] for sen in batch[0][:options.beam_batch_size]]
+            return model.beam_search(src, options.beam, options.max_tar_length, len(src))
+        tokens = [0]
+        def counted_beam_search(batch):
+            tokens[0] += sum(len(sen) for sen in beam_search(batch))
+        latency = timed(counted_beam_search, decode_batches, 0)
+        result['beam_search'] = summary(latency, tokens[0])
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--variants", dest="variants", default="transformer,change,attention")
+    parser.add_option("--output", dest="output", default="nmt_speed.json")
+    parser.add_option("--vocab_size", dest="vocab_size", type="int", default=8000)
+    parser.add_option("--d_model", dest="d_model", type="int", default=256)
+    parser.add_option("--nhead", dest="nhead", type="int", default=4)
+    parser.add_option("--layers", dest="layers", type="int", default=2)
+    parser.add_option("--batch_size", dest="batch_size", type="int", default=32)
+    parser.add_option("--min_len", dest="min_len", type="int", default=10)
+    parser.add_option("--max_len", dest="max_len", type="int", default=40)
+    parser.add_option("--prefix_len", dest="prefix_len", type="int", default=16)
+    parser.add_option("--iterations", dest="iterations", type="int", default=20)
+    parser.add_option("--warm_up", dest="warm_up", type="int", default=2)
+    parser.add_option("--beam", dest="beam", type="int", default=4)
+    parser.add_option("--beam_batch_size", dest="beam_batch_size", type="int", default=8)
+    parser.add_option("--beam_src_len", dest="beam_src_len", type="int", default=20)
+    parser.add_option("--beam_iterations", dest="beam_iterations", type="int", default=3)
+    parser.add_option("--max_tar_length", dest="max_tar_length", type="int", default=30)
+    parser.add_option("--threads", dest="threads", type="int", default=1)
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    parser.add_option("--run", dest="run", default=None, help="internal: benchmark one variant and print its JSON")
+    (options, _) = parser.parse_args()
+    if (options.run is not None):
+        print(json.dumps(run_variant(options.run, options)))
+        return
+    report = {
+        'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'options': {key: value for key, value in vars(options).items() if key not in ('run', 'output', 'variants')},
+        'variants': dict()
+    }
+    try:
+        report['commit'] = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        pass
+    for variant in options.variants.split(","):
+        print(f"benchmark {variant}", file=sys.stderr)
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", variant] + sys.argv[1:], capture_output=True, text=True)
+        if (process.returncode != 0):
+            print(process.stderr, file=sys.stderr)
+            report['variants'][variant] = {'error': process.stderr.strip().split('\n')[-1]}
+            continue
+        result = json.loads(process.stdout.strip().split('\n')[-1])
+        report['variants'][variant] = result
+        for phase in ['train_step', 'encode', 'decode_step', 'beam_search']:
+            print(f"  {phase:12s} {result[phase]['tokens_per_sec']:10.1f} tokens/s  p50 {result[phase]['p50_ms']:8.2f}ms  p99 {result[phase]['p99_ms']:8.2f}ms", file=sys.stderr)
+        print(f"  peak rss {result['peak_rss_mb']:.1f}MB", file=sys.stderr)
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"write [{options.output}]", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
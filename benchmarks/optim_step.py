@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import tempfile
+from optparse import OptionParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_transformer"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_common"))
+import torch
+import shuhe_config as config
+from vocab import Text
+from nmt_model import NMT
+from optim import get_parameter_groups, Adafactor
+
+def make_vocab(path, size):
+    with open(path, "w") as f:
+        for word in ['<start>', '<end>', '<pad>', '<unk>']:
+            f.write(word+'\n')
+        for i in range(size-4):
+            f.write(f"w{i}\n")
+
+def state_size(optimizer):
+    size = 0
+    for state in optimizer.state.values():
+        for value in state.values():
+            if (torch.is_tensor(value)):
+                size += value.numel() * value.element_size()
+    return size
+
+def time_step(optimizer, params, steps, device):
+    for param in params:
+        param.grad = torch.randn_like(param)
+    for _ in range(3):
+        optimizer.step()
+    if (device.type == 'cuda'):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        optimizer.step()
+    if (device.type == 'cuda'):
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / steps
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--vocab_size", dest="vocab_size", type="int", default=37000)
+    parser.add_option("--steps", dest="steps", type="int", default=20)
+    parser.add_option("--cuda", dest="cuda", action="store_true", default=False)
+    (options, _) = parser.parse_args()
+    device = torch.device("cuda:0" if options.cuda else "cpu")
+    with tempfile.TemporaryDirectory() as tmp:
+        vocab_path = os.path.join(tmp, "vocab.txt")
+        make_vocab(vocab_path, options.vocab_size)
+        text = Text(vocab_path, vocab_path)
+    args = dict()
+    for key in ['embed_size', 'd_model', 'nhead', 'num_encoder_layers', 'num_decoder_layers', 'dim_feedforward', 'dropout', 'smoothing_eps']:
+        args[key] = getattr(config, key)
+    model = NMT(text, args, device).to(device)
+    params = list(model.parameters())
+    groups = lambda: get_parameter_groups(model, 0.01)
+    optimizers = [
+        ("adam (for-loop)", lambda: torch.optim.Adam(groups(), foreach=False)),
+        ("adam (foreach)", lambda: torch.optim.Adam(groups(), foreach=True)),
+        ("adafactor", lambda: Adafactor(groups()))
+    ]
+    if (device.type == 'cuda'):
+        optimizers.append(("adam (fused)", lambda: torch.optim.Adam(groups(), fused=True)))
+    print(f"{sum(param.numel() for param in params)} parameters on {device}", file=sys.stderr)
+    for name, build in optimizers:
+        optimizer = build()
+        step_time = time_step(optimizer, params, options.steps, device)
+        print(f"{name:20s} step {step_time*1000:8.2f} ms  state {state_size(optimizer)/2**20:8.1f} MiB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+import random
+from optparse import OptionParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Dependency_parsing"))
+from utils import Parser, Configuration, P_PREFIX
+
+def make_dataset(n_sentences, seed):
+    '''
+    Penn Treebank sized by default: ~40k training sentences of 5-45 words
+    '''
+    rng = random.Random(seed)
+    dataset = []
+    for _ in range(n_sentences):
+        n = rng.randint(5, 45)
+        dataset.append({
+            'word': [f"w{rng.randint(0, 40000)}" for _ in range(n)],
+            'pos': [f"p{rng.randint(0, 45)}" for _ in range(n)],
+            'head': [0] + [rng.randint(1, n) for _ in range(n - 1)],
+            'label': [f"l{rng.randint(0, 40)}" for _ in range(n)]
+        })
+    return dataset
+
+def to_ids(parser, ex):
+    return {
+        'word': [parser.ROOT] + [parser.tok2id[w] for w in ex['word']],
+        'pos': [parser.P_ROOT] + [parser.tok2id[P_PREFIX + p] for p in ex['pos']],
+        'label': [-1] + [0 for _ in ex['label']]
+    }
+
+def random_transitions(n_words, rng):
+    '''
+    a random legal arc-standard sequence, replayed by both featurizers
+    '''
+    conf = Configuration(n_words)
+    sequence = []
+    while not conf.is_terminal():
+        legal = []
+        if conf.buffer_size() > 0:
+            legal.append('S')
+        if len(conf.stack) > 2:
+            legal.append('L')
+        if len(conf.stack) > 1:
+            legal.append('R')
+        kind = rng.choice(legal)
+        sequence.append(kind)
+        if kind == 'S':
+            conf.shift()
+        elif kind == 'L':
+            conf.left_arc()
+        else:
+            conf.right_arc()
+    return sequence
+
+def legacy_extract_features(parser, stack, buf, arcs, ex):
+    '''
+    the list-scanning child lookup Parser.extract_features used before Configuration
+    '''
+    def get_lc(k):
+        return sorted([arc[1] for arc in arcs if arc[0] == k and arc[1] < k])
+
+    def get_rc(k):
+        return sorted([arc[1] for arc in arcs if arc[0] == k and arc[1] > k], reverse=True)
+
+    features = [parser.NULL] * (3 - len(stack)) + [ex['word'][x] for x in stack[-3:]]
+    features += [ex['word'][x] for x in buf[:3]] + [parser.NULL] * (3 - len(buf))
+    p_features = [parser.P_NULL] * (3 - len(stack)) + [ex['pos'][x] for x in stack[-3:]]
+    p_features += [ex['pos'][x] for x in buf[:3]] + [parser.P_NULL] * (3 - len(buf))
+    for i in range(2):
+        if i < len(stack):
+            k = stack[-i-1]
+            lc = get_lc(k)
+            rc = get_rc(k)
+            llc = get_lc(lc[0]) if len(lc) > 0 else []
+            rrc = get_rc(rc[0]) if len(rc) > 0 else []
+            children = [lc[0] if len(lc) > 0 else None, rc[0] if len(rc) > 0 else None,
+                        lc[1] if len(lc) > 1 else None, rc[1] if len(rc) > 1 else None,
+                        llc[0] if len(llc) > 0 else None, rrc[0] if len(rrc) > 0 else None]
+            features += [ex['word'][c] if c is not None else parser.NULL for c in children]
+            p_features += [ex['pos'][c] if c is not None else parser.P_NULL for c in children]
+        else:
+            features += [parser.NULL] * 6
+            p_features += [parser.P_NULL] * 6
+    return features + p_features
+
+def run_indexed(parser, examples, sequences):
+    n_features = 0
+    for ex, sequence in zip(examples, sequences):
+        conf = Configuration(len(ex['word']))
+        for kind in sequence:
+            parser.extract_features(conf, ex)
+            n_features += 1
+            if kind == 'S':
+                conf.shift()
+            elif kind == 'L':
+                conf.left_arc()
+            else:
+                conf.right_arc()
+    return n_features
+
+def run_legacy(parser, examples, sequences):
+    n_features = 0
+    for ex, sequence in zip(examples, sequences):
+        stack = [0]
+        buf = list(range(1, len(ex['word'])))
+        arcs = []
+        for kind in sequence:
+            legacy_extract_features(parser, stack, buf, arcs, ex)
+            n_features += 1
+            if kind == 'S':
+                stack.append(buf.pop(0))
+            elif kind == 'L':
+                dep = stack.pop(-2)
+                arcs.append((stack[-1], dep))
+            else:
+                dep = stack.pop()
+                arcs.append((stack[-1], dep))
+    return n_features
+
+def check(parser, examples, sequences):
+    for ex, sequence in zip(examples, sequences):
+        conf = Configuration(len(ex['word']))
+        stack = [0]
+        buf = list(range(1, len(ex['word'])))
+        arcs = []
+        for kind in sequence:
+            assert parser.extract_features(conf, ex) == legacy_extract_features(parser, stack, buf, arcs, ex)
+            if kind == 'S':
+                conf.shift()
+                stack.append(buf.pop(0))
+            elif kind == 'L':
+                conf.left_arc()
+                dep = stack.pop(-2)
+                arcs.append((stack[-1], dep))
+            else:
+                conf.right_arc()
+                dep = stack.pop()
+                arcs.append((stack[-1], dep))
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--sentences", dest="sentences", type="int", default=40000)
+    parser.add_option("--legacy_sentences", dest="legacy_sentences", type="int", default=2000)
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    (options, _) = parser.parse_args()
+    dataset = make_dataset(options.sentences, options.seed)
+    dep_parser = Parser(dataset)
+    examples = [to_ids(dep_parser, ex) for ex in dataset]
+    rng = random.Random(options.seed)
+    sequences = [random_transitions(len(ex['word']), rng) for ex in examples]
+    check(dep_parser, examples[:200], sequences[:200])
+    for name, run, n in [("indexed", run_indexed, options.sentences), ("legacy", run_legacy, options.legacy_sentences)]:
+        start = time.perf_counter()
+        n_features = run(dep_parser, examples[:n], sequences[:n])
+        cost = time.perf_counter() - start
+        print(f"{name:8s} {n:6d} sentences  {n/cost:9.1f} sentences/s  {cost/n_features*1e6:7.2f} us/transition")
+
+if __name__ == '__main__':
+    main()
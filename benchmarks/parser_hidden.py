@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+from optparse import OptionParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Dependency_parsing"))
+import numpy as np
+import torch
+from model import ParserModel
+
+def sample_features(n, n_words, n_pos, n_features, rng):
+    '''
+    word positions draw Zipf distributed ids like real text, POS positions draw uniformly from a small tag set
+    '''
+    features = np.empty((n, n_features), dtype=np.int64)
+    n_word_features = n_features // 2
+    ranks = np.minimum(rng.zipf(1.2, size=(n, n_word_features)) - 1, n_words - 1)
+    features[:, :n_word_features] = n_pos + ranks
+    features[:, n_word_features:] = rng.integers(0, n_pos, size=(n, n_features - n_word_features))
+    return torch.from_numpy(features)
+
+def time_forward(model, features, batch_size, repeat):
+    with torch.no_grad():
+        model(features[:batch_size])
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for i in range(0, len(features), batch_size):
+                model(features[i:i+batch_size])
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--words", dest="words", type="int", default=40000)
+    parser.add_option("--top_k", dest="top_k", type="int", default=1000)
+    parser.add_option("--instances", dest="instances", type="int", default=100000)
+    parser.add_option("--batch_size", dest="batch_size", type="int", default=1024)
+    parser.add_option("--repeat", dest="repeat", type="int", default=3)
+    (options, _) = parser.parse_args()
+    rng = np.random.default_rng(1)
+    n_pos, n_features = 50, 36
+    embeddings = rng.standard_normal((n_pos + options.words, 50)).astype(np.float32)
+    model = ParserModel(embeddings, {'n_features': n_features, 'n_classes': 3, 'dropout_prob': 0.5, 'hidden_size': 200})
+    model.eval()
+    train = sample_features(options.instances, options.words, n_pos, n_features, rng)
+    test = sample_features(options.instances // 4, options.words, n_pos, n_features, rng)
+    plain = time_forward(model, test, options.batch_size, options.repeat)
+    with torch.no_grad():
+        expected = model(test[:options.batch_size])
+    model.precompute(train, options.top_k)
+    cached = time_forward(model, test, options.batch_size, options.repeat)
+    with torch.no_grad():
+        error = (model(test[:options.batch_size]) - expected).abs().max().item()
+    print(f"plain  {len(test)/plain:10.1f} configurations/s")
+    print(f"cached {len(test)/cached:10.1f} configurations/s  ({plain/cached:.2f}x, max abs diff {error:.2e})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import random
+import tempfile
+from optparse import OptionParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Dependency_parsing"))
+import numpy as np
+from utils import Parser, Configuration, create_instances_parallel, load_instances
+from parser_features import make_dataset, random_transitions
+
+def make_treebank(n_sentences, seed):
+    '''
+    make_dataset with projective trees, read off random legal transition sequences, so the oracle keeps every sentence
+    '''
+    dataset = make_dataset(n_sentences, seed)
+    rng = random.Random(seed)
+    for ex in dataset:
+        conf = Configuration(len(ex['word']) + 1)
+        for kind in random_transitions(conf.n_words, rng):
+            if kind == 'S':
+                conf.shift()
+            elif kind == 'L':
+                conf.left_arc()
+            else:
+                conf.right_arc()
+        head = [0] * conf.n_words
+        for (h, d, _) in conf.arcs:
+            head[d] = h
+        ex['head'] = head[1:]
+    return dataset
+
+def check_same(name, instances, reference):
+    features, transitions = instances
+    assert np.array_equal(features, reference[0]) and np.array_equal(transitions, reference[1]), f"{name} differs from Parser.create_instances"
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--sentences", dest="sentences", type="int", default=10000)
+    parser.add_option("--workers", dest="workers", type="int", default=2)
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    (options, _) = parser.parse_args()
+    dataset = make_treebank(options.sentences, options.seed)
+    dep_parser = Parser(dataset)
+    examples = dep_parser.vectorize(dataset)
+
+    start = time.perf_counter()
+    reference = dep_parser.create_instances(examples)
+    print(f"{'serial':>10s}  {time.perf_counter()-start:7.2f}s  {len(reference[1])} instances")
+    start = time.perf_counter()
+    check_same("create_instances_parallel", create_instances_parallel(dep_parser, examples, options.workers), reference)
+    print(f"{'parallel':>10s}  {time.perf_counter()-start:7.2f}s  {options.workers} workers")
+    with tempfile.TemporaryDirectory() as tmp:
+        prefix = os.path.join(tmp, "train")
+        for name in ["build", "cached"]:
+            start = time.perf_counter()
+            instances = load_instances(dep_parser, examples, prefix, options.workers)
+            check_same(f"load_instances ({name})", instances, reference)
+            print(f"{name:>10s}  {time.perf_counter()-start:7.2f}s")
+        # another corpus of the same size must not reuse the cache
+        other_dataset = make_treebank(options.sentences, options.seed+1)
+        other = Parser(other_dataset)
+        other_examples = other.vectorize(other_dataset)
+        check_same("load_instances (other corpus)", load_instances(other, other_examples, prefix), other.create_instances(other_examples))
+        print(f"{len(os.listdir(tmp))//2} cache entries, cached instances equal fresh ones")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+from optparse import OptionParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Dependency_parsing"))
+import numpy as np
+import torch
+from utils import Parser, Configuration
+from model import ParserModel
+from parser_transitions import minibatch_parse
+from parser_features import make_dataset, to_ids
+
+def parse_one_by_one(parser, model, dataset):
+    '''
+    the per-sentence loop minibatch_parse replaces: one sentence at a time, one model forward per transition
+    '''
+    confs = []
+    tran_kind = torch.tensor(parser.tran_kind, dtype=torch.long)
+    model.eval()
+    with torch.no_grad():
+        for ex in dataset:
+            conf = Configuration(len(ex['word']))
+            while not conf.is_terminal():
+                features = torch.tensor([parser.extract_features(conf, ex)], dtype=torch.long)
+                legal = torch.tensor(parser.legal_transitions(conf), dtype=torch.bool)
+                logits = model(features)[0]
+                logits.masked_fill_(~legal[tran_kind], float('-inf'))
+                parser.apply_transition(conf, logits.argmax().item())
+            confs.append(conf)
+    return confs
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--sentences", dest="sentences", type="int", default=2000)
+    parser.add_option("--batch_sizes", dest="batch_sizes", default="32,256,1024")
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    (options, _) = parser.parse_args()
+    torch.manual_seed(options.seed)
+    dataset = make_dataset(options.sentences, options.seed)
+    dep_parser = Parser(dataset)
+    examples = [to_ids(dep_parser, ex) for ex in dataset]
+    embeddings = np.random.default_rng(options.seed).standard_normal((dep_parser.n_tokens, 50)).astype(np.float32)
+    model = ParserModel(embeddings, dict(n_features=dep_parser.n_features, n_classes=dep_parser.n_trans, dropout_prob=0.5, hidden_size=200))
+    start = time.perf_counter()
+    reference = parse_one_by_one(dep_parser, model, examples)
+    base = time.perf_counter() - start
+    print(f"{'loop':>8s}  {options.sentences/base:9.1f} sentences/s")
+    for batch_size in [int(n) for n in options.batch_sizes.split(",")]:
+        timing = dict()
+        start = time.perf_counter()
+        confs = minibatch_parse(dep_parser, model, examples, batch_size, timing=timing)
+        cost = time.perf_counter() - start
+        same = all(conf.arcs == ref.arcs for conf, ref in zip(confs, reference))
+        phases = "  ".join(f"{phase} {seconds/cost*100:.0f}%" for phase, seconds in timing.items())
+        print(f"{batch_size:8d}  {options.sentences/cost:9.1f} sentences/s  speedup {base/cost:6.1f}  {phases}  same arcs {same}")
+
+if __name__ == '__main__':
+    main()
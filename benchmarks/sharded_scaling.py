@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+import time
+from optparse import OptionParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NMT_transformer"))
+from nltk.translate.bleu_score import corpus_bleu
+import shuhe_config as config
+from nmt_model import NMT
+from data import Data
+from decoding import add_decoding_options, build_strategy
+from sharded import sharded_translate
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--model", dest="model", default=None, help="checkpoint to decode with")
+    parser.add_option("--src", dest="src", default=config.test_path_src)
+    parser.add_option("--tar", dest="tar", default=config.test_path_tar)
+    parser.add_option("--workers", dest="workers", default="1,2,4")
+    parser.add_option("--threads", dest="threads", type="int", default=1, help="torch threads per worker, fixed so only the worker count changes")
+    parser.add_option("--devices", dest="devices", default=None, help="comma separated devices of the workers, default cpu")
+    parser.add_option("--sentences", dest="sentences", type="int", default=None, help="decode only the first N sentences")
+    parser.add_option("--batch_size", dest="batch_size", type="int", default=config.test_batch_size)
+    parser.add_option("--output", dest="output", default="sharded_scaling.json")
+    add_decoding_options(parser)
+    (options, _) = parser.parse_args()
+    if (options.model is None):
+        parser.error("--model is required")
+    data = Data(options.src, options.tar)
+    src = data.src[:options.sentences] if (options.sentences is not None) else data.src
+    tar = data.tar[:len(src)]
+    strategy = build_strategy(options.strategy, options)
+    devices = options.devices.split(",") if (options.devices is not None) else None
+    # only for decoding words, the workers load their own copies
+    text = NMT.load(options.model).text
+    target = text.tar.decode([sen[1:-1] for sen in tar])
+    reference = None
+    results = []
+    for workers in [int(n) for n in options.workers.split(",")]:
+        start = time.perf_counter()
+        predict, _, seconds = sharded_translate(options.model, src, strategy, workers, devices, options.batch_size, config.max_tar_length, threads=options.threads)
+        cost = time.perf_counter() - start
+        if (reference is None):
+            reference = predict
+        result = {
+            'workers': workers, 'seconds': cost, 'decode_seconds': max(seconds), 'worker_seconds': seconds,
+            'sentences_per_sec': len(src) / cost,
+            'bleu': corpus_bleu([[sen] for sen in target], text.tar.decode(predict)) * 100,
+            'same_as_first': predict == reference
+        }
+        results.append(result)
+    base = results[0]
+    for result in results:
+        # speedup of the slowest worker's decoding, process start and model loading are in seconds only
+        result['speedup'] = base['decode_seconds'] / result['decode_seconds']
+        result['efficiency'] = result['speedup'] / (result['workers'] / base['workers'])
+        print(f"{result['workers']:3d} workers  {result['seconds']:7.1f}s  decode {result['decode_seconds']:7.1f}s  speedup {result['speedup']:.2f}  efficiency {result['efficiency']*100:.0f}%  BLEU {result['bleu']:.2f}  same output {result['same_as_first']}", file=sys.stderr)
+    with open(options.output, "w") as f:
+        json.dump({'model': options.model, 'strategy': options.strategy, 'sentences': len(src), 'cpu_count': os.cpu_count(), 'threads': options.threads, 'results': results}, f, indent=2)
+    print(f"write [{options.output}]", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()